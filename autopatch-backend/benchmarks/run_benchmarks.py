@@ -0,0 +1,201 @@
+"""Cold-start and warm latency benchmarks for every Lambda against local stand-ins.
+
+    python benchmarks/run_benchmarks.py                       # run and compare with baseline.json
+    python benchmarks/run_benchmarks.py --update-baseline     # record a new baseline
+    python benchmarks/run_benchmarks.py --fleet-size 500 --latency-ms 20 --only fetch_os_info
+
+Per handler it reports the import time of lambda_function in a fresh interpreter, warm
+p50/p95/p99 latency, AWS/MSRC calls per invocation and peak traced memory of one invocation.
+Exits 1 when a gated handler regresses against the baseline.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+LAMBDA_DIR = os.path.join(BACKEND_DIR, "lambda")
+LAYER_DIR = os.path.join(BACKEND_DIR, "layers", "autopatch_common", "python")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+sys.path.insert(0, LAYER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from scenarios import ENVIRONMENT, SCENARIOS
+from standins import StandIns
+
+# Regressions here fail the run; other handlers are reported only
+GATED_HANDLERS = ["fetch_os_info", "update_full_cve_data", "poll_command_status", "poll_get_KB_command_result"]
+
+# Timing is noisy, call counts are not: latency/memory/import may grow by the relative
+# tolerance plus a small absolute slack, call counts may not grow at all
+LATENCY_SLACK_MS = 5.0
+IMPORT_SLACK_MS = 50.0
+MEMORY_SLACK_KB = 64.0
+
+def handler_names():
+    return sorted(d for d in os.listdir(LAMBDA_DIR) if os.path.isfile(os.path.join(LAMBDA_DIR, d, "lambda_function.py")))
+
+def load_handler(name):
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(LAMBDA_DIR, name, "lambda_function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def measure_import(name):
+    # Fresh interpreter per sample so boto3/botocore imports count like a cold start
+    code = (
+        "import importlib.util, sys, time; sys.path.insert(0, %r)\n"
+        "t = time.perf_counter()\n"
+        "spec = importlib.util.spec_from_file_location('lambda_function', %r)\n"
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+        "print((time.perf_counter() - t) * 1000)\n"
+    ) % (LAYER_DIR, os.path.join(LAMBDA_DIR, name, "lambda_function.py"))
+    env = dict(os.environ, **ENVIRONMENT)
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def bench_handler(name, args):
+    from autopatch_common import aws
+
+    standins = StandIns(args.fleet_size, args.latency_ms, args.msrc_records, args.watchers)
+    standins.install(aws)
+    module = load_handler(name)
+    if hasattr(module, "http"):
+        module.http = standins.msrc
+
+    event = SCENARIOS[name](standins)
+
+    # First call fills warm-container caches, like the first request after a cold start
+    check_response(module.lambda_handler(json.loads(json.dumps(event)), None))
+
+    latencies = []
+    for _ in range(args.iterations):
+        payload = json.loads(json.dumps(event))
+        started = time.perf_counter()
+        module.lambda_handler(payload, None)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    standins.log.reset()
+    tracemalloc.start()
+    module.lambda_handler(json.loads(json.dumps(event)), None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls = standins.log.snapshot()
+
+    return {
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "peak_kb": round(peak / 1024, 1),
+        "api_calls_total": sum(calls.values()),
+        "api_calls": calls
+    }
+
+def check_response(response):
+    # A handler that fails fast would otherwise look like a speed-up
+    if not isinstance(response, dict):
+        return
+    if response.get("statusCode", 200) >= 400 or response.get("status") == "error":
+        raise RuntimeError(f"handler returned an error: {json.dumps(response, default=str)[:200]}")
+
+def compare(results, baseline, tolerance, gated):
+    failures = []
+    for name in gated:
+        current, previous = results.get(name), baseline.get("handlers", {}).get(name)
+        if not current or not previous or "error" in current:
+            if current and "error" in current:
+                failures.append(f"{name}: {current['error']}")
+            continue
+
+        if current["api_calls_total"] > previous["api_calls_total"]:
+            failures.append(f"{name}: {current['api_calls_total']} API calls (baseline {previous['api_calls_total']})")
+        checks = [("p95_ms", LATENCY_SLACK_MS, "ms p95"), ("import_ms", IMPORT_SLACK_MS, "ms import"),
+                  ("peak_kb", MEMORY_SLACK_KB, "KB peak memory")]
+        for key, slack, label in checks:
+            limit = previous[key] * (1 + tolerance) + slack
+            if current[key] > limit:
+                failures.append(f"{name}: {current[key]} {label} (baseline {previous[key]}, limit {limit:.1f})")
+    return failures
+
+def print_report(results):
+    print(f"{'handler':32} {'import':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'calls':>6} {'peak KB':>9}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:32} ERROR: {r['error']}")
+            continue
+        print(f"{name:32} {r['import_ms']:>9.1f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['api_calls_total']:>6} {r['peak_kb']:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet-size", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="injected latency per AWS/MSRC call")
+    parser.add_argument("--msrc-records", type=int, default=1500)
+    parser.add_argument("--watchers", type=int, default=5, help="dashboard connections per instance")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--import-samples", type=int, default=3)
+    parser.add_argument("--only", help="comma-separated handler names")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative growth of timings/memory")
+    parser.add_argument("--gate", default=",".join(GATED_HANDLERS), help="comma-separated handlers that fail the run")
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+
+    names = args.only.split(",") if args.only else handler_names()
+    results = {}
+    for name in names:
+        if name not in SCENARIOS:
+            results[name] = {"error": "no scenario in benchmarks/scenarios.py"}
+            continue
+        try:
+            import_ms = min(measure_import(name) for _ in range(args.import_samples))
+            results[name] = dict(import_ms=round(import_ms, 1), **bench_handler(name, args))
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    print_report(results)
+
+    settings = {"fleet_size": args.fleet_size, "latency_ms": args.latency_ms,
+                "msrc_records": args.msrc_records, "watchers": args.watchers}
+    report = {"settings": settings, "handlers": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (run with --update-baseline)")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print(f"Baseline was recorded with {baseline.get('settings')}, not comparing")
+        return 0
+
+    gated = [name for name in args.gate.split(",") if name in results]
+    failures = compare(results, baseline, args.tolerance, gated)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""One representative invocation per Lambda, sized by the fleet in the stand-ins.
+
+setup() seeds the stand-ins and returns the event passed to lambda_handler on every run.
+"""
+from datetime import datetime, timedelta
+from boto3.dynamodb.types import TypeSerializer
+
+PATCH_TABLE = "PatchProgress"
+CVE_TABLE = "vpbank-cve-data"
+CONNECTIONS_TABLE = "PatchProgressConnections"
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "PATCH_TABLE": PATCH_TABLE,
+    "TABLE_NAME": CVE_TABLE,
+    "CONNECTIONS_TABLE": CONNECTIONS_TABLE,
+    "WEBSOCKET_ENDPOINT": "http://localhost:8766",
+    "SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:000000000000:autopatch-summary",
+    "PATCH_STATE_MACHINE_ARN": "arn:aws:states:us-east-1:000000000000:stateMachine:Runpatch",
+    "RETRY_SINGLE_KB_STATE_MACHINE_ARN": "arn:aws:states:us-east-1:000000000000:stateMachine:RetrySingleKBPatch",
+    # Measure the DynamoDB path of get_patch_status, not its warm-container cache
+    "STATUS_CACHE_SECONDS": "0",
+    # Stand-in commands finish at once, so patch_engine measures its own overhead, not poll sleeps
+    "ENGINE_POLL_MIN_SECONDS": "0",
+}
+
+SCENARIOS = {}
+
+def scenario(name):
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+    return register
+
+# Mixed severities so risk ordering and deadline deferral have something to sort
+SEVERITIES = ["Critical", "Important", "Important", "Moderate"]
+
+def seed_cve_table(s):
+    s.dynamodb.seed(CVE_TABLE, [{
+        "PK": f"OS#{os_name}",
+        "SK": f"CVE#CVE-2025-{kb}",
+        "cveNumber": f"CVE-2025-{kb}",
+        "product": os_name,
+        "severity": SEVERITIES[int(kb) % len(SEVERITIES)],
+        "baseScore": str(9.8 - int(kb) % len(SEVERITIES)),
+        "impact": "Remote Code Execution" if int(kb) % 2 else "Elevation of Privilege",
+        "kbArticle": kb,
+        "supercedence": s.fleet.supersedes.get(kb, ""),
+        "fixedBuildNumber": s.fleet.fixed_build(kb, os_name),
+        "releaseDate": "2025-07-08T07:00:00Z"
+    } for os_name, kbs in s.fleet.kbs_by_os.items() for kb in kbs])
+
+def seed_patch_progress(s):
+    now = datetime.utcnow()
+    ttl = int((now + timedelta(days=1)).timestamp())
+    statuses = ["Success", "Pending", "InProgress", "Failed"]
+    items = []
+    for instance_id in s.fleet.instance_ids:
+        kbs = s.fleet.available_kbs(instance_id)
+        for n, kb in enumerate(kbs):
+            items.append({
+                "PK": f"PATCH#{instance_id}",
+                "SK": f"KB#{kb}",
+                "Status": statuses[n % len(statuses)],
+                "UpdatedAt": (now - timedelta(seconds=n)).isoformat(),
+                "TTL": ttl,
+                "RebootRequired": False
+            })
+        items.append({"PK": f"PATCH#{instance_id}", "SK": "PROGRESS", "Total": len(kbs),
+                      "Completed": sum(1 for n in range(len(kbs)) if statuses[n % 4] in ("Success", "Failed")),
+                      "Statuses": {kb: statuses[n % len(statuses)] for n, kb in enumerate(kbs)},
+                      "TTL": ttl})
+    s.dynamodb.seed(PATCH_TABLE, items)
+
+def inventory_results(s):
+    ssm = s.clients["ssm"]
+    results = []
+    for i in range(0, len(s.fleet.instance_ids), 50):
+        batch = s.fleet.instance_ids[i:i + 50]
+        command_id = ssm.send_command(InstanceIds=batch, Parameters={"commands": ["INSTALLED_KBS AVAILABLE_KBS"]})["Command"]["CommandId"]
+        results.extend({
+            "status": "sent",
+            "instance_id": instance_id,
+            "command_id": command_id,
+            "kb_list": s.fleet.kbs_by_os[s.fleet.os_by_instance[instance_id]],
+            "superseded_by": s.fleet.superseded_by(s.fleet.os_by_instance[instance_id])
+        } for instance_id in batch)
+    s.log.reset()
+    return results
+
+def patch_results(s):
+    return [{
+        "InstanceId": instance_id,
+        "installedKBs": s.fleet.installed_kbs(instance_id),
+        "availableKBs": s.fleet.available_kbs(instance_id),
+        "skippedKBs": []
+    } for instance_id in s.fleet.instance_ids]
+
+@scenario("fetch_os_info")
+def fetch_os_info(s):
+    return {}
+
+@scenario("get_patch_status")
+def get_patch_status(s):
+    seed_patch_progress(s)
+    return {"instance_ids": s.fleet.instance_ids}
+
+@scenario("get_target_instances_and_kbs")
+def get_target_instances_and_kbs(s):
+    seed_cve_table(s)
+    return {"instance_ids": s.fleet.instance_ids}
+
+@scenario("parse_cve")
+def parse_cve(s):
+    seed_cve_table(s)
+    return {"os_versions": sorted(s.fleet.kbs_by_os)}
+
+@scenario("patch_engine")
+def patch_engine(s):
+    return {"servers": [dict(r, installMode="batch") for r in patch_results(s)], "maxConcurrency": 50}
+
+@scenario("patch_progress_socket")
+def patch_progress_socket(s):
+    return {
+        "requestContext": {"routeKey": "subscribe", "connectionId": "bench-connection"},
+        "body": '{"action": "subscribe", "instance_ids": [%s]}' % ", ".join(f'"{i}"' for i in s.fleet.instance_ids)
+    }
+
+@scenario("poll_command_status")
+def poll_command_status(s):
+    instance_id = s.fleet.instance_ids[0]
+    kbs = s.fleet.available_kbs(instance_id)
+    script = "$kbs = @(%s)\nKB_RESULT" % ", ".join(f'"{kb}"' for kb in kbs)
+    command_id = s.clients["ssm"].send_command(InstanceIds=[instance_id], Parameters={"commands": [script]})["Command"]["CommandId"]
+    s.log.reset()
+    return {"InstanceId": instance_id, "CommandId": command_id, "KBs": kbs}
+
+@scenario("poll_get_KB_command_result")
+def poll_get_kb_command_result(s):
+    return {"results": inventory_results(s)}
+
+@scenario("prestage_updates")
+def prestage_updates(s):
+    return {"action": "plan", "results": patch_results(s), "config": {"maxDownloadsPerSubnet": 5}}
+
+@scenario("publish_patch_progress")
+def publish_patch_progress(s):
+    s.dynamodb.seed(CONNECTIONS_TABLE, [
+        {"PK": f"INSTANCE#{instance_id}", "SK": f"CONN#operator-{n}"}
+        for instance_id in s.fleet.instance_ids for n in range(s.watchers)
+    ])
+    serialize = TypeSerializer().serialize
+    records = []
+    for instance_id in s.fleet.instance_ids:
+        kb = s.fleet.available_kbs(instance_id)[0]
+        old = {"PK": f"PATCH#{instance_id}", "SK": f"KB#{kb}", "Status": "InProgress", "UpdatedAt": "2025-07-01T08:10:00"}
+        new = dict(old, Status="Success", UpdatedAt="2025-07-01T08:15:00")
+        records.append({"eventName": "MODIFY", "dynamodb": {
+            "OldImage": {k: serialize(v) for k, v in old.items()},
+            "NewImage": {k: serialize(v) for k, v in new.items()}
+        }})
+    return {"Records": records}
+
+@scenario("reboot_EC2")
+def reboot_ec2(s):
+    return {"instance_ids": s.fleet.instance_ids}
+
+@scenario("reboot_orchestrator")
+def reboot_orchestrator(s):
+    # Whole fleet rebooted five minutes ago and pinging again
+    rebooted_at = (datetime.utcnow() - timedelta(minutes=5)).isoformat() + "Z"
+    return {"action": "check", "reboots": {
+        "queue": [],
+        "rebooting": {instance_id: rebooted_at for instance_id in s.fleet.instance_ids},
+        "offline": [],
+        "rebooted": [],
+        "failed": [],
+        "concurrency": len(s.fleet.instance_ids),
+        "waitSeconds": 15
+    }}
+
+@scenario("run_patch")
+def run_patch(s):
+    instance_id = s.fleet.instance_ids[0]
+    return {"InstanceId": instance_id, "KBs": s.fleet.available_kbs(instance_id)}
+
+@scenario("schedule_patch_waves")
+def schedule_patch_waves(s):
+    return {"action": "plan", "results": patch_results(s), "config": {"maxConcurrency": 20}}
+
+@scenario("ssm_command_callback")
+def ssm_command_callback(s):
+    instance_id = s.fleet.instance_ids[0]
+    command_id = s.clients["ssm"].send_command(InstanceIds=[instance_id], Parameters={"commands": ["PATCH"]})["Command"]["CommandId"]
+    s.log.reset()
+    return {"TaskToken": "bench-token", "CommandId": command_id, "InstanceId": instance_id}
+
+@scenario("start_patch")
+def start_patch(s):
+    return {"instance_ids": s.fleet.instance_ids}
+
+@scenario("start_patch_single_KB")
+def start_patch_single_kb(s):
+    return {"instance_id": s.fleet.instance_ids[0], "kb": s.fleet.available_kbs(s.fleet.instance_ids[0])[0]}
+
+@scenario("summarize_SNS")
+def summarize_sns(s):
+    results = patch_results(s)
+    overview = [[{"status": "ok", "InstanceId": r["InstanceId"], "KB": kb, "newStatus": "Success"}
+                 for kb in r["availableKBs"]] for r in results]
+    return {"summary": {"results": results, "overview": overview}}
+
+@scenario("update_full_cve_data")
+def update_full_cve_data(s):
+    return {"instanceIds": s.fleet.instance_ids}
+
+@scenario("update_patch_status")
+def update_patch_status(s):
+    return {"Records": [
+        {"InstanceId": instance_id, "KB": kb, "Status": "Pending"}
+        for instance_id in s.fleet.instance_ids for kb in s.fleet.available_kbs(instance_id)
+    ]}
@@ -0,0 +1,514 @@
+"""In-memory stand-ins for the AWS services and the MSRC API used by the Lambdas.
+
+Each stand-in counts its calls per operation and sleeps for the injected latency, so
+handlers keep their real concurrency behaviour without touching the network.
+"""
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+OS_PRODUCTS = ["Windows Server 2016", "Windows Server 2019", "Windows Server 2022"]
+KBS_PER_OS = 20
+OS_BUILDS = {"Windows Server 2016": "14393", "Windows Server 2019": "17763", "Windows Server 2022": "20348"}
+# Instances spread round-robin over this many subnets
+SUBNET_COUNT = 4
+
+class CallLog:
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, service, operation):
+        with self.lock:
+            self.counts[f"{service}.{operation}"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(sorted(self.counts.items()))
+
+def make_exceptions(*names):
+    return SimpleNamespace(**{name: type(name, (Exception,), {}) for name in names})
+
+class Fleet:
+    """Deterministic EC2 fleet: OS tag, AMI and KB lists cycle through OS_PRODUCTS."""
+
+    def __init__(self, size):
+        self.instance_ids = [f"i-{n:017x}" for n in range(size)]
+        self.os_by_instance = {i: OS_PRODUCTS[n % len(OS_PRODUCTS)] for n, i in enumerate(self.instance_ids)}
+        self.subnet_by_instance = {i: f"subnet-{n % SUBNET_COUNT:017x}" for n, i in enumerate(self.instance_ids)}
+        self.image_by_os = {os_name: f"ami-{n:017x}" for n, os_name in enumerate(OS_PRODUCTS)}
+        self.kbs_by_os = {
+            os_name: [str(5030000 + n * 100 + k) for k in range(KBS_PER_OS)]
+            for n, os_name in enumerate(OS_PRODUCTS)
+        }
+        # Fixed build per KB: each available KB moves the UBR by one; the last quarter of the
+        # catalogue was rolled into updates that are already installed
+        self.fixed_ubr = {
+            kbs[k]: 6001 + (k if k < KBS_PER_OS * 3 // 4 else k - KBS_PER_OS * 3 // 4)
+            for kbs in self.kbs_by_os.values() for k in range(KBS_PER_OS)
+        }
+        # Cumulative updates: every third KB replaces the one released before it
+        self.supersedes = {
+            kbs[k]: kbs[k - 1] for kbs in self.kbs_by_os.values() for k in range(1, KBS_PER_OS) if k % 3 == 2
+        }
+
+    def installed_kbs(self, instance_id):
+        # A quarter of the catalogue is already installed, half is offered by Windows Update
+        kbs = self.kbs_by_os[self.os_by_instance[instance_id]]
+        return kbs[:KBS_PER_OS // 4]
+
+    def available_kbs(self, instance_id):
+        kbs = self.kbs_by_os[self.os_by_instance[instance_id]]
+        return kbs[KBS_PER_OS // 4:KBS_PER_OS * 3 // 4]
+
+    def superseded_by(self, os_name):
+        # Same shape as get_target_instances_and_kbs passes to poll_get_KB_command_result
+        return {old_kb: [kb] for kb, old_kb in self.supersedes.items() if kb in self.kbs_by_os[os_name]}
+
+    def fixed_build(self, kb, os_name):
+        return f"10.0.{OS_BUILDS[os_name]}.{self.fixed_ubr[kb]}"
+
+    def os_build(self, instance_id):
+        # CurrentBuild.UBR: the update build revision of the newest installed update
+        ubr = max((self.fixed_ubr[kb] for kb in self.installed_kbs(instance_id)), default=6000)
+        return f"{OS_BUILDS[self.os_by_instance[instance_id]]}.{ubr}"
+
+class StandIn:
+    service = None
+    exceptions = make_exceptions()
+
+    def __init__(self, log, latency):
+        self.log = log
+        self.latency = latency
+
+    def _call(self, operation):
+        self.log.record(self.service, operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_paginator(self, operation):
+        return Paginator(getattr(self, operation))
+
+class Paginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.method(**kwargs, NextToken=token) if token else self.method(**kwargs)
+            yield page
+            token = page.get("NextToken")
+            if not token:
+                return
+
+def page_of(items, token, size):
+    start = int(token or 0)
+    end = start + size
+    return items[start:end], (str(end) if end < len(items) else None)
+
+class SSMStandIn(StandIn):
+    service = "ssm"
+    exceptions = make_exceptions("InvocationDoesNotExist")
+
+    def __init__(self, log, latency, fleet):
+        super().__init__(log, latency)
+        self.fleet = fleet
+        self.commands = {}
+
+    def describe_instance_information(self, NextToken=None, Filters=None, **kwargs):
+        self._call("DescribeInstanceInformation")
+        wanted = next((set(f["Values"]) for f in Filters or [] if f["Key"] == "InstanceIds"), None)
+        instance_ids = [i for i in self.fleet.instance_ids if wanted is None or i in wanted]
+        page, token = page_of(instance_ids, NextToken, 50)
+        response = {"InstanceInformationList": [{
+            "InstanceId": instance_id,
+            "PlatformName": "Microsoft Windows Server",
+            "PlatformVersion": f"10.0.{OS_BUILDS[self.fleet.os_by_instance[instance_id]]}",
+            "PingStatus": "Online",
+            "LastPingDateTime": datetime.now(timezone.utc),
+            "IPAddress": "10.0.0.1"
+        } for instance_id in page]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def send_command(self, InstanceIds, Parameters, **kwargs):
+        self._call("SendCommand")
+        command_id = str(uuid.uuid4())
+        self.commands[command_id] = {"instance_ids": list(InstanceIds), "script": Parameters["commands"][0]}
+        return {"Command": {"CommandId": command_id}}
+
+    def output_for(self, command_id, instance_id):
+        script = self.commands[command_id]["script"]
+        if "INSTALLED_KBS" in script:
+            installed = ",".join(f"KB{kb}" for kb in self.fleet.installed_kbs(instance_id))
+            available = ",".join(f"KB{kb}" for kb in self.fleet.available_kbs(instance_id))
+            return f"INSTALLED_KBS={installed}\nAVAILABLE_KBS={available}\nOS_BUILD={self.fleet.os_build(instance_id)}\n"
+        if "STAGE_RESULT" in script:
+            kbs = re.findall(r"\d+", re.search(r"\$kbs = @\((.*)\)", script).group(1))
+            return "".join(f"STAGE_RESULT|{kb}|Staged\n" for kb in kbs)
+        if "KB_RESULT" in script:
+            kbs = re.findall(r"\d+", re.search(r"\$kbs = @\((.*)\)", script).group(1))
+            return "".join(f"KB_RESULT|KB{kb}|Success|NO_REBOOT\n" for kb in kbs)
+        return "PATCH_SUCCESS\n"
+
+    def get_command_invocation(self, CommandId, InstanceId, **kwargs):
+        self._call("GetCommandInvocation")
+        if CommandId not in self.commands:
+            raise self.exceptions.InvocationDoesNotExist(CommandId)
+        return {
+            "CommandId": CommandId,
+            "InstanceId": InstanceId,
+            "Status": "Success",
+            "ResponseCode": 0,
+            "StandardOutputContent": self.output_for(CommandId, InstanceId),
+            "StandardErrorContent": ""
+        }
+
+    def list_command_invocations(self, CommandId, NextToken=None, **kwargs):
+        self._call("ListCommandInvocations")
+        page, token = page_of(self.commands[CommandId]["instance_ids"], NextToken, 50)
+        response = {"CommandInvocations": [{
+            "CommandId": CommandId,
+            "InstanceId": instance_id,
+            "Status": "Success",
+            "CommandPlugins": [{"Output": self.output_for(CommandId, instance_id)}]
+        } for instance_id in page]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+class EC2StandIn(StandIn):
+    service = "ec2"
+
+    def __init__(self, log, latency, fleet):
+        super().__init__(log, latency)
+        self.fleet = fleet
+
+    def describe_instances(self, Filters=None, InstanceIds=None, NextToken=None, **kwargs):
+        self._call("DescribeInstances")
+        wanted = InstanceIds or next(f["Values"] for f in Filters if f["Name"] == "instance-id")
+        known = [i for i in wanted if i in self.fleet.os_by_instance]
+        return {"Reservations": [{"Instances": [{
+            "InstanceId": instance_id,
+            "ImageId": self.fleet.image_by_os[self.fleet.os_by_instance[instance_id]],
+            "Platform": "windows",
+            "SubnetId": self.fleet.subnet_by_instance[instance_id],
+            "Tags": [{"Key": "OS", "Value": self.fleet.os_by_instance[instance_id]}]
+        } for instance_id in known]}]}
+
+    def describe_images(self, Filters, **kwargs):
+        self._call("DescribeImages")
+        wanted = next(f["Values"] for f in Filters if f["Name"] == "image-id")
+        names = {image_id: f"{os_name.replace(' ', '_')}-English-Full-Base"
+                 for os_name, image_id in self.fleet.image_by_os.items()}
+        return {"Images": [{"ImageId": i, "Name": names[i]} for i in wanted if i in names]}
+
+    def reboot_instances(self, InstanceIds, **kwargs):
+        self._call("RebootInstances")
+        return {}
+
+class SNSStandIn(StandIn):
+    service = "sns"
+
+    def publish(self, **kwargs):
+        self._call("Publish")
+        return {"MessageId": str(uuid.uuid4())}
+
+class StepFunctionsStandIn(StandIn):
+    service = "stepfunctions"
+    exceptions = make_exceptions("TaskTimedOut", "InvalidToken", "TaskDoesNotExist")
+
+    def start_execution(self, stateMachineArn, **kwargs):
+        self._call("StartExecution")
+        return {"executionArn": f"{stateMachineArn}:{uuid.uuid4()}"}
+
+    def send_task_success(self, **kwargs):
+        self._call("SendTaskSuccess")
+        return {}
+
+class ApiGatewayManagementStandIn(StandIn):
+    service = "apigatewaymanagementapi"
+    exceptions = make_exceptions("GoneException")
+
+    def post_to_connection(self, **kwargs):
+        self._call("PostToConnection")
+        return {}
+
+# --- DynamoDB -------------------------------------------------------------
+
+COMPARATORS = {
+    "Equals": lambda v, a: v == a[0],
+    "BeginsWith": lambda v, a: str(v).startswith(a[0]),
+    "GreaterThan": lambda v, a: v > a[0],
+    "GreaterThanEquals": lambda v, a: v >= a[0],
+    "LessThan": lambda v, a: v < a[0],
+    "LessThanEquals": lambda v, a: v <= a[0],
+    "Between": lambda v, a: a[0] <= v <= a[1],
+}
+
+def matches(condition, item):
+    name = type(condition).__name__
+    if name == "And":
+        return all(matches(c, item) for c in condition._values)
+    key, *args = condition._values
+    value = item.get(key.name)
+    return value is not None and COMPARATORS[name](value, args)
+
+def condition_holds(expression, item, names=None, values=None):
+    # attribute_exists/attribute_not_exists and numeric comparisons joined by AND/OR (AND binds tighter)
+    if not expression:
+        return True
+    names, values = names or {}, values or {}
+
+    def term_holds(term):
+        found = re.fullmatch(r"(attribute_exists|attribute_not_exists)\((\S+)\)", term)
+        if found:
+            exists = item is not None and names.get(found.group(2), found.group(2)) in item
+            return exists == (found.group(1) == "attribute_exists")
+        attr, op, value = term.split()
+        if item is None or names.get(attr, attr) not in item:
+            return False
+        left, right = item[names.get(attr, attr)], values[value]
+        return {">": left > right, "<=": left <= right, "<": left < right, ">=": left >= right, "=": left == right}[op]
+
+    return any(all(term_holds(t.strip()) for t in group.split(" AND ")) for group in expression.split(" OR "))
+
+def key_names(condition):
+    if type(condition).__name__ == "And":
+        return [n for c in condition._values for n in key_names(c)]
+    return [condition._values[0].name]
+
+class DynamoDBStandIn:
+    """Resource-shaped stand-in: Table(name) plus meta.client for the batch APIs."""
+
+    def __init__(self, log, latency):
+        self.log = log
+        self.latency = latency
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.meta = SimpleNamespace(client=DynamoDBClientStandIn(self))
+
+    def _call(self, operation):
+        self.log.record("dynamodb", operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def store(self, name):
+        with self.lock:
+            return self.tables.setdefault(name, {})
+
+    def Table(self, name):
+        return TableStandIn(self, name)
+
+    def seed(self, name, items):
+        store = self.store(name)
+        for item in items:
+            store[(item["PK"], item["SK"])] = dict(item)
+
+class DynamoDBClientStandIn:
+    exceptions = make_exceptions("ConditionalCheckFailedException")
+
+    def __init__(self, db):
+        self.db = db
+
+    def batch_get_item(self, RequestItems):
+        self.db._call("BatchGetItem")
+        responses = {}
+        for name, request in RequestItems.items():
+            store = self.db.store(name)
+            responses[name] = [dict(store[(k["PK"], k["SK"])]) for k in request["Keys"] if (k["PK"], k["SK"]) in store]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def batch_write_item(self, RequestItems):
+        self.db._call("BatchWriteItem")
+        for name, requests in RequestItems.items():
+            store = self.db.store(name)
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    store[(item["PK"], item["SK"])] = dict(item)
+                else:
+                    key = request["DeleteRequest"]["Key"]
+                    store.pop((key["PK"], key["SK"]), None)
+        return {"UnprocessedItems": {}}
+
+class TableStandIn:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    @property
+    def items(self):
+        return self.db.store(self.name)
+
+    def get_item(self, Key, **kwargs):
+        self.db._call("GetItem")
+        item = self.items.get((Key["PK"], Key["SK"]))
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self.db._call("PutItem")
+        key = (Item["PK"], Item["SK"])
+        if not condition_holds(ConditionExpression, self.items.get(key), ExpressionAttributeNames, ExpressionAttributeValues):
+            raise self.db.meta.client.exceptions.ConditionalCheckFailedException(key)
+        self.items[key] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, ReturnValues=None, **kwargs):
+        self.db._call("DeleteItem")
+        old = self.items.pop((Key["PK"], Key["SK"]), None)
+        return {"Attributes": old} if old and ReturnValues == "ALL_OLD" else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ReturnValues=None, **kwargs):
+        # SET (attributes and one level of map entries) and ADD (numbers, sets) cover every update
+        self.db._call("UpdateItem")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        key = (Key["PK"], Key["SK"])
+        old = self.items.get(key)
+        if not condition_holds(kwargs.get("ConditionExpression"), old, names, values):
+            raise self.db.meta.client.exceptions.ConditionalCheckFailedException(key)
+        item = dict(old or Key)
+        updated_old = {}
+
+        for action, clause in re.findall(r"\b(SET|ADD)\b(.*?)(?=\b(?:SET|ADD)\b|$)", UpdateExpression):
+            for part in clause.split(","):
+                if action == "SET":
+                    attr, _, value = part.partition("=")
+                    path = [names.get(p, p) for p in attr.strip().split(".")]
+                    if len(path) == 2:
+                        entries = item[path[0]] = dict(item[path[0]])
+                        if path[1] in entries:
+                            updated_old.setdefault(path[0], {})[path[1]] = entries[path[1]]
+                        entries[path[1]] = values[value.strip()]
+                    else:
+                        if path[0] in item:
+                            updated_old[path[0]] = item[path[0]]
+                        item[path[0]] = values[value.strip()]
+                else:
+                    attr, value = part.split()
+                    attr = names.get(attr, attr)
+                    if isinstance(values[value], set):
+                        item[attr] = set(item.get(attr, set())) | values[value]
+                    else:
+                        item[attr] = item.get(attr, 0) + values[value]
+
+        self.items[key] = item
+        if old and ReturnValues == "ALL_OLD":
+            return {"Attributes": dict(old)}
+        if updated_old and ReturnValues == "UPDATED_OLD":
+            return {"Attributes": updated_old}
+        return {}
+
+    def query(self, KeyConditionExpression, IndexName=None, ExclusiveStartKey=None, Limit=None,
+              ScanIndexForward=True, **kwargs):
+        self.db._call("Query")
+        keys = key_names(KeyConditionExpression)
+        sort_attr = keys[1] if len(keys) > 1 else ("SK" if not IndexName else None)
+
+        found = [dict(i) for i in self.items.values() if matches(KeyConditionExpression, i)]
+        if sort_attr:
+            found.sort(key=lambda i: str(i.get(sort_attr, "")), reverse=not ScanIndexForward)
+
+        start = ExclusiveStartKey["offset"] if ExclusiveStartKey else 0
+        end = start + Limit if Limit else len(found)
+        response = {"Items": found[start:end], "Count": len(found[start:end])}
+        if end < len(found):
+            response["LastEvaluatedKey"] = {"offset": end}
+        return response
+
+    def batch_writer(self, **kwargs):
+        return BatchWriterStandIn(self)
+
+class BatchWriterStandIn:
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def put_item(self, Item):
+        self.pending.append({"PutRequest": {"Item": Item}})
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.pending.append({"DeleteRequest": {"Key": Key}})
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.table.db.meta.client.batch_write_item(RequestItems={self.table.name: self.pending})
+            self.pending = []
+
+# --- MSRC -----------------------------------------------------------------
+
+class MSRCStandIn:
+    """requests.Session stand-in serving the affectedProduct feed in pages of 500."""
+
+    def __init__(self, log, latency, record_count):
+        self.log = log
+        self.latency = latency
+        now = time.gmtime()
+        release = f"{now.tm_year:04d}-{now.tm_mon:02d}-01T08:00:00Z"
+        products = OS_PRODUCTS + ["Windows 11 Version 23H2", "Microsoft Office 2019"]
+        severities = ["Critical", "Important", "Moderate"]
+        self.records = [{
+            "product": products[n % len(products)],
+            "cveNumber": f"CVE-2025-{10000 + n}",
+            "severity": severities[n % len(severities)],
+            "impact": "Remote Code Execution",
+            "releaseDate": release,
+            "baseScore": "8.8",
+            "kbArticles": [{"articleName": str(5030000 + n % 300), "rebootRequired": "Yes"}]
+        } for n in range(record_count)]
+
+    def get(self, url, **kwargs):
+        self.log.record("msrc", "GET")
+        if self.latency:
+            time.sleep(self.latency)
+        skip = int(re.search(r"\$skip=(\d+)", url).group(1))
+        page = self.records[skip:skip + 500]
+        body = {"value": page}
+        if skip + 500 < len(self.records):
+            body["@odata.nextLink"] = url.replace(f"$skip={skip}", f"$skip={skip + 500}")
+        return SimpleNamespace(status_code=200, json=lambda: body, raise_for_status=lambda: None)
+
+class StandIns:
+    """All stand-ins for one benchmark run, wired in place of autopatch_common.aws clients."""
+
+    def __init__(self, fleet_size, latency_ms, msrc_records, watchers=5):
+        latency = latency_ms / 1000.0
+        self.watchers = watchers
+        self.log = CallLog()
+        self.fleet = Fleet(fleet_size)
+        self.dynamodb = DynamoDBStandIn(self.log, latency)
+        self.clients = {
+            "ssm": SSMStandIn(self.log, latency, self.fleet),
+            "ec2": EC2StandIn(self.log, latency, self.fleet),
+            "sns": SNSStandIn(self.log, latency),
+            "stepfunctions": StepFunctionsStandIn(self.log, latency),
+            "apigatewaymanagementapi": ApiGatewayManagementStandIn(self.log, latency),
+        }
+        self.msrc = MSRCStandIn(self.log, latency, msrc_records)
+
+    def install(self, aws):
+        aws.get_client = lambda service, **kwargs: self.clients[service]
+        aws.get_resource = lambda service, **kwargs: self.dynamodb
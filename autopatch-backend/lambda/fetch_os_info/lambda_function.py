@@ -1,66 +1,49 @@
-import boto3
 import json
 import logging
+import os
+import time
 from datetime import datetime
+from autopatch_common import aws
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Create clients
-ssm_client = boto3.client('ssm')
-ec2_client = boto3.client('ec2')
+ssm_client = aws.client('ssm')
+ec2_client = aws.client('ec2')
+
+# EC2 filters accept at most 200 values per call
+DESCRIBE_BATCH_SIZE = 200
+AMI_CACHE_TTL_SECONDS = int(os.environ.get('AMI_CACHE_TTL_SECONDS', '3600'))
+
+# ImageId -> (AmiName, expires_at); module level so it survives warm invocations
+_ami_name_cache = {}
 
 def lambda_handler(event, context):
     try:
-        # Step 1. Describe instance information from SSM
-        ssm_response = ssm_client.describe_instance_information()
-        instance_info_list = ssm_response.get('InstanceInformationList', [])
-        results = []
+        # Step 1. Describe instance information from SSM (all pages)
+        instance_info_list = list_managed_instances()
 
-        # Step 2. For each instance, call EC2 DescribeInstances to get AMI info
+        # Step 2. Resolve ImageId for all instances in batches, then AMI names once per image
+        image_ids = get_image_ids([i.get('InstanceId') for i in instance_info_list])
+        ami_names = get_ami_names(set(image_ids.values()))
+
+        results = []
         for instance in instance_info_list:
             instance_id = instance.get('InstanceId')
             platform_name = instance.get('PlatformName')
-            platform_version = instance.get('PlatformVersion')
-            ip_address = instance.get('IPAddress')
-
-            # Describe EC2 instance to get ImageId
-            ec2_response = ec2_client.describe_instances(InstanceIds=[instance_id])
-            reservations = ec2_response.get('Reservations', [])
-            if reservations:
-                ec2_instance = reservations[0]['Instances'][0]
-                image_id = ec2_instance.get('ImageId')
-                # Get AMI name from DescribeImages
-                ami_response = ec2_client.describe_images(ImageIds=[image_id])
-                ami_name = ami_response['Images'][0].get('Name') if ami_response['Images'] else "Unknown"
-            else:
-                image_id = "Unknown"
-                ami_name = "Unknown"
-
-            # Determine edition normalization
-            if '2016' in ami_name:
-                os_version = 'Windows Server 2016'
-            elif '2019' in ami_name:
-                os_version = 'Windows Server 2019'
-            elif '2022' in ami_name:
-                os_version = 'Windows Server 2022'
-            else:
-                os_version = platform_name  # fallback
-
-            if 'Core' in ami_name:
-                normalized = f"{os_version} (Server Core installation)"
-            else:
-                normalized = os_version
+            image_id = image_ids.get(instance_id, "Unknown")
+            ami_name = ami_names.get(image_id, "Unknown")
 
             info = {
                 'InstanceId': instance_id,
                 'PlatformName': platform_name,
-                'PlatformVersion': platform_version,
-                'IPAddress': ip_address,
+                'PlatformVersion': instance.get('PlatformVersion'),
+                'IPAddress': instance.get('IPAddress'),
                 'ImageId': image_id,
                 'AmiName': ami_name,
-                'NormalizedOS': normalized,
+                'NormalizedOS': normalize_os(ami_name, platform_name),
                 'FetchedAt': datetime.utcnow().isoformat() + 'Z'
             }
 
@@ -78,3 +61,69 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+
+def list_managed_instances():
+    instances = []
+    paginator = ssm_client.get_paginator('describe_instance_information')
+    for page in paginator.paginate():
+        instances.extend(page.get('InstanceInformationList', []))
+    logger.info(f"Found {len(instances)} managed instances in SSM")
+    return instances
+
+def get_image_ids(instance_ids):
+    # Hybrid (mi-) nodes are not EC2 instances and have no AMI
+    ec2_ids = [i for i in instance_ids if i and i.startswith('i-')]
+    image_ids = {}
+
+    # Use a filter instead of InstanceIds so one terminated instance does not fail the batch
+    paginator = ec2_client.get_paginator('describe_instances')
+    for i in range(0, len(ec2_ids), DESCRIBE_BATCH_SIZE):
+        batch = ec2_ids[i:i + DESCRIBE_BATCH_SIZE]
+        pages = paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}])
+        for page in pages:
+            for reservation in page.get('Reservations', []):
+                for ec2_instance in reservation.get('Instances', []):
+                    image_ids[ec2_instance['InstanceId']] = ec2_instance.get('ImageId', "Unknown")
+
+    return image_ids
+
+def get_ami_names(image_ids):
+    now = time.time()
+    names = {}
+    missing = []
+
+    for image_id in image_ids:
+        cached = _ami_name_cache.get(image_id)
+        if cached and cached[1] > now:
+            names[image_id] = cached[0]
+        elif image_id != "Unknown":
+            missing.append(image_id)
+
+    logger.info(f"AMI cache: {len(names)} hit(s), {len(missing)} to resolve")
+
+    for i in range(0, len(missing), DESCRIBE_BATCH_SIZE):
+        batch = missing[i:i + DESCRIBE_BATCH_SIZE]
+        response = ec2_client.describe_images(Filters=[{'Name': 'image-id', 'Values': batch}])
+        found = {image['ImageId']: image.get('Name') or "Unknown" for image in response.get('Images', [])}
+
+        # Deregistered or shared-then-revoked AMIs are cached as Unknown too
+        for image_id in batch:
+            names[image_id] = found.get(image_id, "Unknown")
+            _ami_name_cache[image_id] = (names[image_id], now + AMI_CACHE_TTL_SECONDS)
+
+    return names
+
+def normalize_os(ami_name, platform_name):
+    # Determine edition normalization
+    if '2016' in ami_name:
+        os_version = 'Windows Server 2016'
+    elif '2019' in ami_name:
+        os_version = 'Windows Server 2019'
+    elif '2022' in ami_name:
+        os_version = 'Windows Server 2022'
+    else:
+        os_version = platform_name  # fallback
+
+    if 'Core' in ami_name:
+        return f"{os_version} (Server Core installation)"
+    return os_version
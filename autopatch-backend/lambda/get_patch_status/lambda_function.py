@@ -1,48 +1,63 @@
-import boto3
 import os
 import json
-from boto3.dynamodb.conditions import Key
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from autopatch_common import aws
 
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(os.environ['PATCH_TABLE'])
+TABLE_NAME = os.environ['PATCH_TABLE']
+table = aws.table(TABLE_NAME)
+
+# GSI on PatchProgress: PK (hash) + UpdatedAt (range), so delta reads only touch changed rows
+UPDATED_AT_INDEX = os.environ.get("UPDATED_AT_INDEX", "UpdatedAtIndex")
+
+# The GSI is eventually consistent; re-read this much before the cursor so late rows are not missed
+CURSOR_OVERLAP_SECONDS = int(os.environ.get("STATUS_CURSOR_OVERLAP_SECONDS", "5"))
+
+# Warm containers answer repeated polls from memory for a few seconds
+STATUS_CACHE_SECONDS = int(os.environ.get("STATUS_CACHE_SECONDS", "5"))
+STATUS_CACHE_MAX_ENTRIES = 256
+_status_cache = {}
+
+QUERY_MAX_WORKERS = int(os.environ.get("STATUS_QUERY_WORKERS", "8"))
+
+COMPLETED_STATUSES = ["Success", "Already Installed", "Failed", "Not Available", "Superseded", "Deferred"]
+
+# Progress summary kept by update_patch_status (PK PATCH#<id>, SK PROGRESS)
+PROGRESS_SK = "PROGRESS"
 
 def lambda_handler(event, context):
+    if "instance_ids" in event:
+        return get_bulk_status(event)
+
     instance_id = event.get("instance_id")
-    
+
     if not instance_id:
         return {
             "statusCode": 400,
             "body": json.dumps({"error": "Missing instance_id"})
         }
 
-    pk = f"PATCH#{instance_id}"
-
     try:
-        response = table.query(
-            KeyConditionExpression=Key("PK").eq(pk)
-        )
+        result = {"instance_id": instance_id}
+        progress = get_progress(instance_id)
+        items = None
 
-        items = response.get("Items", [])
+        # The summary counters answer the percentage; KB rows only when asked for (or no summary)
+        if progress is None or event.get("include_details"):
+            items = query_instance(instance_id)
+        if progress is None:
+            progress = (len(items), sum(1 for i in items if i.get("Status") in COMPLETED_STATUSES))
 
-        total = len(items)
-        completed = sum(1 for i in items if i.get("Status") in ["Success", "Already Installed", "Failed", "Not Available"])
-        percentage = round((completed / total) * 100) if total else 0
-
-        result = {
-            "instance_id": instance_id,
+        total, completed = progress
+        result.update({
             "total": total,
             "completed": completed,
-            "percentage": percentage,
-            "details": [
-                {
-                    "KB": i.get("SK", "").replace("KB#", ""),
-                    "Status": i.get("Status", "Unknown"),
-                    "LastUpdated": i.get("UpdatedAt", "-"),
-                    "RebootRequired": i.get("RebootRequired", False)
-                }
-                for i in sorted(items, key=lambda x: x.get("UpdatedAt", ""))
-            ]
-        }
+            "percentage": round((completed / total) * 100) if total else 0
+        })
+        if items is not None:
+            result["details"] = [to_detail(i) for i in sorted(items, key=lambda x: x.get("UpdatedAt", ""))]
 
         return {
             "statusCode": 200,
@@ -53,4 +68,144 @@ def lambda_handler(event, context):
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+        }
+
+def get_bulk_status(event):
+    instance_ids = sorted(set(event.get("instance_ids") or []))
+    since = event.get("since")
+    etag = event.get("etag")
+
+    if not instance_ids:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Missing instance_ids"})
+        }
+
+    cache_key = (tuple(instance_ids), since)
+    cached = _status_cache.get(cache_key)
+    if cached and cached[0] > time.time():
+        result = cached[1]
+    else:
+        try:
+            # Every status write moves its server's PROGRESS row, so an unchanged poll is answered
+            # from one BatchGetItem per 100 servers before any KB rows are queried
+            current_etag = build_etag(instance_ids, get_change_markers(instance_ids))
+            if etag and etag == current_etag:
+                return not_modified(since, etag)
+            result = read_status(instance_ids, since, current_etag)
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+        cache_result(cache_key, result)
+
+    if etag and etag == result["etag"]:
+        return not_modified(result["cursor"], etag)
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(result)
+    }
+
+def not_modified(cursor, etag):
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"notModified": True, "cursor": cursor, "etag": etag, "instances": {}})
+    }
+
+def read_status(instance_ids, since, etag):
+    if since:
+        lower = (datetime.fromisoformat(since) - timedelta(seconds=CURSOR_OVERLAP_SECONDS)).isoformat()
+        read = lambda instance_id: query_instance_since(instance_id, lower)
+    else:
+        read = query_instance
+
+    with ThreadPoolExecutor(max_workers=min(QUERY_MAX_WORKERS, len(instance_ids))) as executor:
+        items_by_instance = dict(zip(instance_ids, executor.map(read, instance_ids)))
+
+    cursor = since or ""
+    instances = {}
+    for instance_id, items in items_by_instance.items():
+        items = sorted(items, key=lambda x: x.get("UpdatedAt", ""))
+        if items:
+            cursor = max(cursor, items[-1].get("UpdatedAt", ""))
+
+        # Delta reads return changed rows only; the client merges them by KB
+        if since and not items:
+            continue
+        instances[instance_id] = {"instance_id": instance_id, "details": [to_detail(i) for i in items]}
+        if not since:
+            completed = sum(1 for i in items if i.get("Status") in COMPLETED_STATUSES)
+            instances[instance_id].update({
+                "total": len(items),
+                "completed": completed,
+                "percentage": round((completed / len(items)) * 100) if items else 0
+            })
+
+    return {
+        "full": not since,
+        "notModified": False,
+        "cursor": cursor or None,
+        "etag": etag,
+        "instances": instances
+    }
+
+def get_progress(instance_id):
+    item = table.get_item(Key={"PK": f"PATCH#{instance_id}", "SK": PROGRESS_SK}).get("Item")
+    # TTL deletion lags; an expired summary means the run's rows are gone too
+    if not item or int(item.get("TTL", 0)) <= int(time.time()):
+        return None
+    return int(item.get("Total", 0)), int(item.get("Completed", 0))
+
+def get_change_markers(instance_ids):
+    # {instance_id: [ChangedAt, Total, Completed]} for the servers with a live summary
+    now = int(time.time())
+    markers = {}
+    keys = [{"PK": f"PATCH#{x}", "SK": PROGRESS_SK} for x in instance_ids]
+    for item in aws.batch_get(TABLE_NAME, keys, "PK, ChangedAt, Total, Completed, #ttl", {"#ttl": "TTL"}):
+        if int(item.get("TTL", 0)) > now:
+            markers[item["PK"].replace("PATCH#", "", 1)] = [
+                item.get("ChangedAt", ""), int(item.get("Total", 0)), int(item.get("Completed", 0))
+            ]
+    return markers
+
+def query_instance(instance_id):
+    kwargs = {"KeyConditionExpression": aws.key("PK").eq(f"PATCH#{instance_id}") & aws.key("SK").begins_with("KB#")}
+    return query_all(table, kwargs)
+
+def query_instance_since(instance_id, lower):
+    kwargs = {
+        "IndexName": UPDATED_AT_INDEX,
+        "KeyConditionExpression": aws.key("PK").eq(f"PATCH#{instance_id}") & aws.key("UpdatedAt").gt(lower)
+    }
+    return query_all(table, kwargs)
+
+def query_all(source, kwargs):
+    items = []
+    while True:
+        response = source.query(**kwargs)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return items
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def to_detail(item):
+    return {
+        "KB": item.get("SK", "").replace("KB#", ""),
+        "Status": item.get("Status", "Unknown"),
+        "LastUpdated": item.get("UpdatedAt", "-"),
+        "RebootRequired": item.get("RebootRequired", False)
+    }
+
+def build_etag(instance_ids, markers):
+    # Independent of the cursor: the same summaries mean no KB row changed since the last response
+    state = [[instance_id, markers.get(instance_id)] for instance_id in instance_ids]
+    return hashlib.sha256(json.dumps(state, separators=(",", ":")).encode("utf-8")).hexdigest()[:32]
+
+def cache_result(cache_key, result):
+    now = time.time()
+    if len(_status_cache) >= STATUS_CACHE_MAX_ENTRIES:
+        for key in [k for k, v in _status_cache.items() if v[0] <= now] or list(_status_cache)[:1]:
+            _status_cache.pop(key, None)
+    _status_cache[cache_key] = (now + STATUS_CACHE_SECONDS, result)
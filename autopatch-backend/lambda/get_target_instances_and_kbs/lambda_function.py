@@ -1,90 +1,266 @@
-import boto3
 import os
 import logging
+from datetime import datetime
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
+from autopatch_common import aws
+from autopatch_common.applicability import BuildCatalog, parse_build
+from autopatch_common.inventory import INVENTORY_MAX_AGE_MINUTES, InventoryStore, is_fresh, patched_since_scan
+from autopatch_common.risk import RiskIndex
+from autopatch_common.supersedence import SupersedenceIndex
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-smm = boto3.client('ssm')
-ec2 = boto3.client('ec2')
+dynamodb = aws.resource('dynamodb')
+smm = aws.client('ssm')
+ec2 = aws.client('ec2')
 
 DDB_TABLE_NAME = os.environ.get("TABLE_NAME")
+inventory = InventoryStore(os.environ["PATCH_TABLE"])
+
+# EC2 filters accept at most 200 values, SendCommand and the SSM InstanceIds filter at most 50
+DESCRIBE_BATCH_SIZE = 200
+SEND_COMMAND_BATCH_SIZE = 50
+
+# First KB poll after a scan was sent; with every server served from a snapshot there is nothing to wait for
+INVENTORY_FIRST_POLL_SECONDS = 20
+
+# PowerShell script chuẩn hóa output
+INVENTORY_SCRIPT = """
+    $installed = Get-HotFix | Select-Object -ExpandProperty HotFixID
+    $available = Get-WindowsUpdate -MicrosoftUpdate -AcceptAll -IgnoreReboot | ForEach-Object {
+        $_.KBArticleIDs | ForEach-Object { 'KB' + $_ }
+    }
+
+    $cv = Get-ItemProperty 'HKLM:\\SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion'
+
+    Write-Output "INSTALLED_KBS=$($installed -join ',')"
+    Write-Output "AVAILABLE_KBS=$($available -join ',')"
+    Write-Output "OS_BUILD=$($cv.CurrentBuild).$($cv.UBR)"
+"""
 
 def lambda_handler(event, context):
     instance_ids = event.get("instance_ids", [])
     if not instance_ids:
         return {"status": "error", "message": "Missing instance_ids"}
+    instance_ids = list(dict.fromkeys(instance_ids))
+    config = event.get("config") or {}
+    max_age_minutes = int(config.get("inventoryMaxAgeMinutes", INVENTORY_MAX_AGE_MINUTES))
 
-    results = []
+    # Step 1. OS tags for the whole fleet in batched describe_instances calls
+    os_by_instance = get_os_for_instances(instance_ids)
 
-    for instance_id in instance_ids:
+    # Step 2. KB list in risk order, supersedence graph and fixed builds once per distinct OS
+    kb_lists = {}
+    critical = {}
+    superseded = {}
+    catalogs = {}
+    for os_product in sorted(set(os_by_instance.values())):
         try:
-            os_product = get_os_from_instance(instance_id)
-            if not os_product:
-                results.append({
-                    "instance_id": instance_id,
-                    "error": f"OS not found in tags for {instance_id}"
-                })
-                continue
-
-            table = dynamodb.Table(DDB_TABLE_NAME)
-            response = table.query(
-                KeyConditionExpression=Key('PK').eq(f"OS#{os_product}")
-            )
-            kb_list = list(set([item["kbArticle"] for item in response.get("Items", [])]))
-
-            logger.info(f"[{instance_id}] Found {len(kb_list)} KBs from DynamoDB")
-
-            # PowerShell script chuẩn hóa output
-            script = """
-                $installed = Get-HotFix | Select-Object -ExpandProperty HotFixID
-                $available = Get-WindowsUpdate -MicrosoftUpdate -AcceptAll -IgnoreReboot | ForEach-Object {
-                    $_.KBArticleIDs | ForEach-Object { 'KB' + $_ }
-                }
-
-                Write-Output "INSTALLED_KBS=$($installed -join ',')"
-                Write-Output "AVAILABLE_KBS=$($available -join ',')"
-            """
-
-            ssm_response = smm.send_command(
-                InstanceIds=[instance_id],
-                DocumentName="AWS-RunPowerShellScript",
-                Parameters={'commands': [script]},
-                TimeoutSeconds=180
-            )
-
-            command_id = ssm_response["Command"]["CommandId"]
-
-            results.append({
-                "status": "sent",
+            rows = get_kb_rows(os_product)
+            supersedence = SupersedenceIndex(rows)
+            risk = RiskIndex(rows, supersedence)
+            kb_lists[os_product] = risk.order({row["kbArticle"] for row in rows})
+            critical[os_product] = risk.critical(kb_lists[os_product])
+            superseded[os_product] = supersedence.superseded_by(kb_lists[os_product])
+            catalogs[os_product] = BuildCatalog(rows)
+            logger.info(f"[{os_product}] Found {len(kb_lists[os_product])} KBs from DynamoDB, "
+                        f"{len(critical[os_product])} critical, "
+                        f"{len(superseded[os_product])} superseded by a newer KB in the list")
+        except Exception as e:
+            logger.error(f"[{os_product}] Error querying KBs: {e}")
+            kb_lists[os_product] = e
+
+    results = {}
+    targets = []
+    for instance_id in instance_ids:
+        os_product = os_by_instance.get(instance_id)
+        if not os_product:
+            results[instance_id] = {
                 "instance_id": instance_id,
-                "command_id": command_id,
-                "kb_list": kb_list
-            })
+                "error": f"OS not found in tags for {instance_id}"
+            }
+        elif isinstance(kb_lists[os_product], Exception):
+            results[instance_id] = {
+                "instance_id": instance_id,
+                "error": str(kb_lists[os_product])
+            }
+        else:
+            targets.append(instance_id)
 
+    # inventoryMaxAgeMinutes 0 forces a Windows Update scan on every server
+    snapshots = {}
+    platform_versions = {}
+    ssm_info, ssm_checked = get_instance_information(targets)
+    if max_age_minutes > 0:
+        try:
+            snapshots = inventory.get_snapshots(targets)
         except Exception as e:
-            logger.error(f"[{instance_id}] Error: {e}")
-            results.append({
+            logger.error(f"Error reading inventory snapshots, rescanning all: {e}")
+        platform_versions = {i: info.get('PlatformVersion') for i, info in ssm_info.items()}
+
+    # Step 3. Reuse inventory snapshots that are recent and taken after the last patch
+    now = datetime.utcnow()
+    fresh = {i: snapshot for i, snapshot in snapshots.items() if is_fresh(snapshot, now, max_age_minutes)}
+    for instance_id, snapshot in fresh.items():
+        results[instance_id] = {
+            "status": "cached",
+            "instance_id": instance_id,
+            "kb_list": kb_lists[os_by_instance[instance_id]],
+            "superseded_by": superseded[os_by_instance[instance_id]],
+            "critical_kbs": critical[os_by_instance[instance_id]],
+            "installed_kbs": snapshot.get("InstalledKBs", []),
+            "available_kbs": snapshot.get("AvailableKBs", []),
+            "os_build": snapshot.get("OsBuild"),
+            "scanned_at": snapshot.get("ScannedAt")
+        }
+    targets = [instance_id for instance_id in targets if instance_id not in fresh]
+
+    # Step 4. Decide KBs from the OS build where every KB's fixed build settles it
+    resolved = []
+    for instance_id in targets:
+        build, exact = known_build(snapshots.get(instance_id), platform_versions.get(instance_id))
+        if not build:
+            continue
+        fixed, needed, undecided = catalogs[os_by_instance[instance_id]].classify(build, exact)
+        if undecided:
+            continue
+        results[instance_id] = {
+            "status": "resolved",
+            "instance_id": instance_id,
+            "kb_list": kb_lists[os_by_instance[instance_id]],
+            "superseded_by": superseded[os_by_instance[instance_id]],
+            "critical_kbs": critical[os_by_instance[instance_id]],
+            "installed_kbs": [f"KB{kb}" for kb in fixed],
+            "available_kbs": [f"KB{kb}" for kb in needed],
+            "os_build": ".".join(str(part) for part in build[2:])
+        }
+        resolved.append(instance_id)
+    if targets:
+        logger.info(f"Build applicability settled {len(resolved)}/{len(targets)} server(s) without a scan")
+    targets = [instance_id for instance_id in targets if instance_id not in results]
+
+    # Step 5. One inventory command per batch of 50 servers left undecided. SendCommand rejects the
+    # whole call if one InstanceId is not Online in SSM, so those are reported on their own
+    sendable = []
+    for instance_id in targets:
+        ping_status = ssm_info.get(instance_id, {}).get('PingStatus')
+        if instance_id in ssm_checked and ping_status != "Online":
+            results[instance_id] = {
                 "instance_id": instance_id,
-                "error": str(e)
-            })
+                "error": f"SSM agent is {ping_status}" if ping_status else "Instance is not managed by SSM"
+            }
+        else:
+            sendable.append(instance_id)
+    if len(sendable) < len(targets):
+        logger.warning(f"{len(targets) - len(sendable)} server(s) not Online in SSM, not scanned")
+
+    for i in range(0, len(sendable), SEND_COMMAND_BATCH_SIZE):
+        send_inventory(sendable[i:i + SEND_COMMAND_BATCH_SIZE], results, kb_lists, superseded, critical, os_by_instance)
 
     return {
         "status": "done",
-        "results": results
+        "results": [results[instance_id] for instance_id in instance_ids],
+        "waitSeconds": INVENTORY_FIRST_POLL_SECONDS if sendable else 0
     }
 
-def get_os_from_instance(instance_id):
+def get_os_for_instances(instance_ids):
+    os_by_instance = {}
+    paginator = ec2.get_paginator('describe_instances')
+
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        batch = instance_ids[i:i + DESCRIBE_BATCH_SIZE]
+        try:
+            # A filter (unlike InstanceIds) does not fail the whole batch on one unknown ID
+            for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}]):
+                for res in page['Reservations']:
+                    for inst in res['Instances']:
+                        os_tag = next((tag['Value'] for tag in inst.get('Tags', []) if tag['Key'] == 'OS'), None)
+                        if os_tag:
+                            os_by_instance[inst['InstanceId']] = os_tag
+        except ClientError as e:
+            logger.error(f"EC2 describe_instances error: {e}")
+
+    return os_by_instance
+
+def send_inventory(batch, results, kb_lists, superseded, critical, os_by_instance):
     try:
-        response = ec2.describe_instances(InstanceIds=[instance_id])
-        for res in response['Reservations']:
-            for inst in res['Instances']:
-                os_tag = next((tag['Value'] for tag in inst.get('Tags', []) if tag['Key'] == 'OS'), None)
-                return os_tag
-        return None
-    except ClientError as e:
-        logger.error(f"EC2 describe_instances error: {e}")
-        return None
+        ssm_response = smm.send_command(
+            InstanceIds=batch,
+            DocumentName="AWS-RunPowerShellScript",
+            Parameters={'commands': [INVENTORY_SCRIPT]},
+            TimeoutSeconds=180
+        )
+        command_id = ssm_response["Command"]["CommandId"]
+        logger.info(f"Inventory command {command_id} sent to {len(batch)} instance(s)")
+
+        for instance_id in batch:
+            results[instance_id] = {
+                "status": "sent",
+                "instance_id": instance_id,
+                "command_id": command_id,
+                "kb_list": kb_lists[os_by_instance[instance_id]],
+                "superseded_by": superseded[os_by_instance[instance_id]],
+                "critical_kbs": critical[os_by_instance[instance_id]]
+            }
+
+    except Exception as e:
+        if len(batch) > 1 and isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") == "InvalidInstanceId":
+            # A server dropped out of SSM since the check; retry one by one so only that one fails
+            logger.warning(f"InvalidInstanceId for a batch of {len(batch)}, sending one at a time")
+            for instance_id in batch:
+                send_inventory([instance_id], results, kb_lists, superseded, critical, os_by_instance)
+            return
+        logger.error(f"Error sending inventory command to {batch}: {e}")
+        for instance_id in batch:
+            results[instance_id] = {
+                "instance_id": instance_id,
+                "error": str(e)
+            }
+
+def get_instance_information(instance_ids):
+    # ({instance_id: InstanceInformation}, instance IDs actually looked up). A server missing from
+    # the information list is not managed by SSM; one in a failed lookup is simply tried
+    info_by_instance = {}
+    checked = set()
+    paginator = smm.get_paginator('describe_instance_information')
+
+    for i in range(0, len(instance_ids), SEND_COMMAND_BATCH_SIZE):
+        batch = instance_ids[i:i + SEND_COMMAND_BATCH_SIZE]
+        try:
+            for page in paginator.paginate(Filters=[{'Key': 'InstanceIds', 'Values': batch}]):
+                for info in page.get('InstanceInformationList', []):
+                    info_by_instance[info['InstanceId']] = info
+            checked.update(batch)
+        except ClientError as e:
+            # Without a build the server is simply scanned
+            logger.error(f"SSM describe_instance_information error: {e}")
+
+    return info_by_instance, checked
+
+def known_build(snapshot, platform_version):
+    # The last scanned build is exact until the server is patched again, then only a lower
+    # bound; PlatformVersion (10.0.<CurrentBuild>, no UBR) is always just a lower bound
+    build, _ = parse_build(platform_version)
+    exact = False
+    if snapshot and snapshot.get("OsBuild"):
+        scanned_build, scanned_exact = parse_build(snapshot["OsBuild"])
+        if scanned_build and (not build or scanned_build >= build):
+            build, exact = scanned_build, scanned_exact and not patched_since_scan(snapshot)
+    return build, exact
+
+def get_kb_rows(os_product):
+    # One row per CVE; a KB fixing several CVEs shows up once per CVE
+    table = dynamodb.Table(DDB_TABLE_NAME)
+    kwargs = {
+        'KeyConditionExpression': aws.key('PK').eq(f"OS#{os_product}"),
+        'ProjectionExpression': 'kbArticle, supercedence, fixedBuildNumber, severity, baseScore, impact'
+    }
+    rows = []
+
+    while True:
+        response = table.query(**kwargs)
+        rows.extend(item for item in response.get("Items", []) if item.get("kbArticle"))
+        if 'LastEvaluatedKey' not in response:
+            return rows
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,10 +1,8 @@
-import boto3 
 import os
 import json
-from boto3.dynamodb.conditions import Key
+from autopatch_common import aws
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['TABLE_NAME'])
+table = aws.table(os.environ['TABLE_NAME'])
 
 def lambda_handler(event, context):
     os_versions = event.get("os_versions", [])
@@ -22,7 +20,7 @@ def lambda_handler(event, context):
         pk_value = f"OS#{os_version}"
 
         response = table.query(
-            KeyConditionExpression=Key('PK').eq(pk_value)
+            KeyConditionExpression=aws.key('PK').eq(pk_value)
         )
 
         for item in response.get('Items', []):
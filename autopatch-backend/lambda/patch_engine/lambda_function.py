@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from autopatch_common import aws
+from autopatch_common.patch_commands import send_patch, send_patch_batch
+from autopatch_common.patch_status import PatchStatusWriter, expand_records
+from autopatch_common.ssm_results import poll_patch_result, with_kb_results
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ssm = aws.client('ssm')
+writer = PatchStatusWriter(os.environ['PATCH_TABLE'])
+
+# In-flight SSM commands across the wave, and per server (Windows Update runs one job at a time)
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_MAX_PER_SERVER = 1
+
+# boto3 is blocking, so its calls run on a thread pool sized like the client connection pool
+ENGINE_IO_WORKERS = int(os.environ.get("ENGINE_IO_WORKERS", "32"))
+
+# Per-command poll interval, backing off while the install keeps running
+POLL_MIN_SECONDS = float(os.environ.get("ENGINE_POLL_MIN_SECONDS", "10"))
+POLL_MAX_SECONDS = float(os.environ.get("ENGINE_POLL_MAX_SECONDS", "60"))
+POLL_BACKOFF = 1.5
+
+# Near the Lambda timeout: stop sending new commands, then stop polling and hand back the rest
+START_MARGIN_SECONDS = int(os.environ.get("ENGINE_START_MARGIN_SECONDS", "180"))
+RETURN_MARGIN_SECONDS = int(os.environ.get("ENGINE_RETURN_MARGIN_SECONDS", "30"))
+
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    # servers: a wave from schedule_patch_waves, or the servers of a previous "continue" result
+    servers = event.get("servers", [])
+    config = event.get("config") or {}
+    max_concurrency = max(1, int(event.get("maxConcurrency") or config.get("maxConcurrency", DEFAULT_MAX_CONCURRENCY)))
+    max_per_server = max(1, int(config.get("maxPerServer", DEFAULT_MAX_PER_SERVER)))
+
+    # No context: running as a long-lived worker without a deadline
+    remaining_ms = context.get_remaining_time_in_millis if context else None
+    engine = PatchEngine(max_concurrency, max_per_server, remaining_ms)
+    asyncio.run(engine.run(servers))
+
+    unfinished = [s["InstanceId"] for s in servers if not s.get("done")]
+    if unfinished:
+        logger.info(f"Deadline near, {len(unfinished)} server(s) left for the next invocation: {unfinished}")
+        return {"status": "continue", "servers": servers}
+
+    # Same shape as the PatchWave Map output, one list of KB results per server
+    return {"status": "done", "overview": [s["overview"] for s in servers]}
+
+class PatchEngine:
+    def __init__(self, max_concurrency, max_per_server, remaining_ms=None):
+        self.max_concurrency = max_concurrency
+        self.max_per_server = max_per_server
+        self.remaining_ms = remaining_ms
+
+    def remaining_seconds(self):
+        return self.remaining_ms() / 1000 if self.remaining_ms else float("inf")
+
+    def can_start(self):
+        return self.remaining_seconds() > START_MARGIN_SECONDS
+
+    def must_return(self):
+        return self.remaining_seconds() <= RETURN_MARGIN_SECONDS
+
+    async def run(self, servers):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=ENGINE_IO_WORKERS))
+        self.fleet_slots = asyncio.Semaphore(self.max_concurrency)
+
+        logger.info(f"Patching {len(servers)} server(s), maxConcurrency={self.max_concurrency}, "
+                    f"maxPerServer={self.max_per_server}")
+        await asyncio.gather(*(self.patch_server(server) for server in servers if not server.get("done")))
+
+    async def call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def patch_server(self, server):
+        instance_id = server["InstanceId"]
+        server.setdefault("overview", [])
+        server.setdefault("inFlight", [])
+
+        if not server.get("marked"):
+            # MarkInitialStatuses
+            await self.call(writer.update_bulk, expand_records({
+                "InstanceId": instance_id,
+                "StatusGroups": [
+                    {"Status": "Not Available", "KBs": server.get("skippedKBs", [])},
+                    {"Status": "Already Installed", "KBs": server.get("installedKBs", [])},
+                    {"Status": "Pending", "KBs": server.get("availableKBs", [])}
+                ]
+            }))
+            server["marked"] = True
+
+        server_slots = asyncio.Semaphore(self.max_per_server)
+        jobs = [self.resume_job(server, server_slots, job) for job in list(server["inFlight"])]
+
+        kbs = list(server.setdefault("availableKBs", []))
+        if server.get("installMode") == "batch" and kbs:
+            jobs.append(self.run_job(server, server_slots, kbs, batch=True))
+        else:
+            jobs.extend(self.run_job(server, server_slots, [kb]) for kb in kbs)
+
+        await asyncio.gather(*jobs)
+        server["done"] = not server["availableKBs"] and not server["inFlight"]
+
+    async def run_job(self, server, server_slots, kbs, batch=False):
+        instance_id = server["InstanceId"]
+        async with server_slots, self.fleet_slots:
+            if not self.can_start():
+                return
+
+            staged_kbs = {str(kb).replace("KB", "") for kb in server.get("stagedKBs") or []}
+            staged = any(str(kb).replace("KB", "") in staged_kbs for kb in kbs)
+            try:
+                if batch:
+                    await self.call(writer.update_bulk, [
+                        {"InstanceId": instance_id, "KB": kb, "Status": "InProgress"} for kb in kbs
+                    ])
+                    command_id = await self.call(send_patch_batch, ssm, instance_id, kbs, staged)
+                else:
+                    await self.call(writer.update_one, instance_id, kbs[0], "InProgress")
+                    command_id = await self.call(send_patch, ssm, instance_id, kbs[0], staged)
+            except Exception as e:
+                logger.error(f"[{instance_id}] Error sending patch command for {kbs}: {str(e)}")
+                server["availableKBs"] = [kb for kb in server["availableKBs"] if kb not in kbs]
+                await self.record_result(server, kbs if batch else kbs[0], {"Status": "Failed", "ErrorMessage": str(e)})
+                return
+
+            logger.info(f"[{instance_id}] Command {command_id} sent for {kbs}")
+            job = {"CommandId": command_id, "KBs": kbs} if batch else {"CommandId": command_id, "KB": kbs[0]}
+            server["availableKBs"] = [kb for kb in server["availableKBs"] if kb not in kbs]
+            server["inFlight"].append(job)
+            await self.wait_job(server, job)
+
+    async def resume_job(self, server, server_slots, job):
+        # A command sent by the previous invocation: only poll it to completion
+        async with server_slots, self.fleet_slots:
+            await self.wait_job(server, job)
+
+    async def wait_job(self, server, job):
+        instance_id = server["InstanceId"]
+        kbs = job.get("KBs")
+        delay = POLL_MIN_SECONDS
+
+        while True:
+            await asyncio.sleep(delay)
+            if self.must_return():
+                return
+
+            try:
+                _, result = await self.call(poll_patch_result, ssm, job["CommandId"], instance_id, kbs)
+            except Exception as e:
+                logger.error(f"[{instance_id}] Error polling {job['CommandId']}: {str(e)}")
+                result = {"Status": "Failed", "RebootRequired": False, "ErrorMessage": str(e)}
+
+            if result["Status"] != "InProgress":
+                break
+            delay = min(POLL_MAX_SECONDS, delay * POLL_BACKOFF)
+
+        server["inFlight"].remove(job)
+        await self.record_result(server, kbs or job["KB"], result)
+
+    async def record_result(self, server, kb_or_kbs, result):
+        instance_id = server["InstanceId"]
+        if isinstance(kb_or_kbs, list):
+            # MarkBatchResults
+            if "Results" not in result:
+                result = with_kb_results(result, instance_id, kb_or_kbs)
+            response = await self.call(writer.update_bulk, result["Results"])
+            server["overview"].extend(response["results"])
+            return
+
+        # MarkSuccess / MarkFailed
+        status = "Success" if result["Status"] == "Success" else "Failed"
+        response = await self.call(writer.update_one, instance_id, kb_or_kbs, status,
+                                   result.get("RebootRequired", False) if status == "Success" else False)
+        server["overview"].append(response)
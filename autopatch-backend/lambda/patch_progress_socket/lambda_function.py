@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from autopatch_common import aws
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+table = aws.table(os.environ['CONNECTIONS_TABLE'])
+
+# API Gateway closes WebSocket connections after 2 hours
+CONNECTION_TTL_HOURS = 3
+MAX_SUBSCRIBED_INSTANCES = 1000
+
+def lambda_handler(event, context):
+    request_context = event.get("requestContext", {})
+    route = request_context.get("routeKey")
+    connection_id = request_context.get("connectionId")
+    logger.info(f"WebSocket {route} from {connection_id}")
+
+    if route == "$connect":
+        return {"statusCode": 200}
+    if route == "$disconnect":
+        unsubscribe(connection_id, remove_all=True)
+        return {"statusCode": 200}
+    if route == "subscribe":
+        try:
+            body = json.loads(event.get("body") or "{}")
+        except ValueError:
+            return {"statusCode": 400, "body": "Invalid JSON"}
+        return subscribe(connection_id, body.get("instance_ids") or [])
+
+    return {"statusCode": 400, "body": f"Unknown route: {route}"}
+
+def subscribe(connection_id, instance_ids):
+    instance_ids = list(dict.fromkeys(instance_ids))
+    if len(instance_ids) > MAX_SUBSCRIBED_INSTANCES:
+        return {"statusCode": 400, "body": f"At most {MAX_SUBSCRIBED_INSTANCES} instances per connection"}
+
+    # A new subscribe replaces the previous selection
+    current = unsubscribe(connection_id, keep=set(instance_ids))
+    ttl = int((datetime.utcnow() + timedelta(hours=CONNECTION_TTL_HOURS)).timestamp())
+
+    with table.batch_writer() as batch:
+        for instance_id in instance_ids:
+            if instance_id in current:
+                continue
+            # Both directions: fan-out looks up by instance, disconnect cleans up by connection
+            batch.put_item(Item={"PK": f"INSTANCE#{instance_id}", "SK": f"CONN#{connection_id}", "TTL": ttl})
+            batch.put_item(Item={"PK": f"CONN#{connection_id}", "SK": f"INSTANCE#{instance_id}", "TTL": ttl})
+
+    logger.info(f"{connection_id} watching {len(instance_ids)} instance(s)")
+    return {"statusCode": 200, "body": json.dumps({"subscribed": len(instance_ids)})}
+
+def unsubscribe(connection_id, keep=frozenset(), remove_all=False):
+    subscribed = []
+    kwargs = {"KeyConditionExpression": aws.key("PK").eq(f"CONN#{connection_id}")}
+    while True:
+        response = table.query(**kwargs)
+        subscribed.extend(item["SK"].replace("INSTANCE#", "", 1) for item in response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    removed = [i for i in subscribed if remove_all or i not in keep]
+    with table.batch_writer() as batch:
+        for instance_id in removed:
+            batch.delete_item(Key={"PK": f"INSTANCE#{instance_id}", "SK": f"CONN#{connection_id}"})
+            batch.delete_item(Key={"PK": f"CONN#{connection_id}", "SK": f"INSTANCE#{instance_id}"})
+
+    return set(subscribed) - set(removed)
@@ -1,71 +1,48 @@
-import boto3
 import logging
 import json
+from autopatch_common import aws
+from autopatch_common.ssm_results import poll_patch_result, with_kb_results
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ssm = boto3.client('ssm')
+ssm = aws.client('ssm')
 
 def lambda_handler(event, context):
     logger.info(f"Received event: {event}")
 
     instance_id = event.get("InstanceId")
     command_id = event.get("CommandId")
+    kbs = event.get("KBs")
 
     if not instance_id or not command_id:
-        return {
+        result = {
             "Status": "Failed",
             "ErrorMessage": "Missing InstanceId or CommandId"
         }
+        return with_kb_results(result, instance_id, kbs) if kbs else result
 
     try:
-        response = ssm.get_command_invocation(
-            CommandId=command_id,
-            InstanceId=instance_id,
-            PluginName='aws:runPowerShellScript'
-        )
+        response, result = poll_patch_result(ssm, command_id, instance_id, kbs)
 
         status = response.get("Status")
-        stdout = response.get("StandardOutputContent", "")
-        stderr = response.get("StandardErrorContent", "")
-        response_code = response.get("ResponseCode")
+        logger.info(f"SSM Status: {status}, ExitCode: {response.get('ResponseCode')}")
+        logger.info(f"Output: {response.get('StandardOutputContent', '')}")
+        logger.info(f"Error: {response.get('StandardErrorContent', '')}")
 
-        logger.info(f"SSM Status: {status}, ExitCode: {response_code}")
-        logger.info(f"Output: {stdout}")
-        logger.info(f"Error: {stderr}")
+        if result["Status"] == "InProgress":
+            return result
 
-        if status in ["InProgress", "Pending", "Delayed"]:
-            return {
-                "Status": "InProgress",
-                "RebootRequired": False,
-                "Output": stdout.strip(),
-                "ErrorOutput": stderr.strip()
-            }
-
-        # Parse output on success or general failure
-        patch_success = "PATCH_SUCCESS" in stdout
-        reboot_required = "REBOOT_REQUIRED" in stdout
-
-        if patch_success:
-            return {
-                "Status": "Success",
-                "RebootRequired": reboot_required,
-                "Output": stdout.strip(),
-                "ErrorOutput": stderr.strip()
-            }
-        else:
-            return {
-                "Status": "Failed",
-                "ExitCode": response_code,
-                "Output": stdout.strip(),
-                "ErrorOutput": stderr.strip()
-            }
+        if kbs:
+            succeeded = sum(1 for r in result["Results"] if r["Status"] == "Success")
+            logger.info(f"Batch results: {succeeded}/{len(kbs)} KB(s) succeeded")
+        return result
 
     except Exception as e:
         logger.error(f"Exception: {str(e)}")
-        return {
+        result = {
             "Status": "Failed",
             "RebootRequired": False,
             "ErrorMessage": str(e)
         }
+        return with_kb_results(result, instance_id, kbs) if kbs else result
@@ -1,85 +1,234 @@
-import boto3
 import logging
+import os
 from botocore.exceptions import ClientError
+from autopatch_common import aws
+from autopatch_common.inventory import InventoryStore
+from autopatch_common.ssm_results import PENDING_STATUSES
+from autopatch_common.supersedence import SUPERSEDED_STATUS, covering_set
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ssm = boto3.client('ssm')
+ssm = aws.client('ssm')
+inventory = InventoryStore(os.environ['PATCH_TABLE'])
 
-def lambda_handler(event, context):
-    results = event.get("results", [])
-    final_results = []
+# Adaptive backoff between polls (seconds), reset to the minimum while instances keep finishing
+KB_POLL_MIN_WAIT = int(os.environ.get("KB_POLL_MIN_WAIT", "20"))
+KB_POLL_MAX_WAIT = int(os.environ.get("KB_POLL_MAX_WAIT", "120"))
+KB_POLL_MAX_ATTEMPTS = int(os.environ.get("KB_POLL_MAX_ATTEMPTS", "40"))
+KB_POLL_BACKOFF = 1.5
+
+# How the installed/available lists were obtained, per GetTargetsAndKBs status
+INVENTORY_SOURCES = {"cached": "cached", "resolved": "build"}
 
-    for item in results:
+# list_command_invocations truncates plugin output to 2500 characters
+DETAILS_OUTPUT_LIMIT = 2500
+
+def lambda_handler(event, context):
+    # First call receives GetTargetsAndKBs output directly; the poll loop passes pending/results back in
+    if "pending" in event:
+        pending = event.get("pending", [])
+        final_results = list(event.get("results", []))
+    else:
+        pending = event.get("results", [])
+        final_results = []
+
+    attempt = event.get("attempt", 0) + 1
+    wait_seconds = event.get("waitSeconds", KB_POLL_MIN_WAIT)
+    still_pending = []
+    scanned = []
+
+    by_command = {}
+    for item in pending:
         instance_id = item.get("instance_id")
         command_id = item.get("command_id")
-        kb_list = item.get("kb_list", [])
+
+        # Fresh snapshot or build applicability in GetTargetsAndKBs, no scan was sent
+        if item.get("status") in ("cached", "resolved"):
+            final_results.append(compare_kbs(item, item.get("installed_kbs", []), item.get("available_kbs", []),
+                                             item.get("os_build")))
+            continue
 
         if not instance_id or not command_id:
             final_results.append({
                 "InstanceId": instance_id,
-                "Error": "Missing instance_id or command_id"
+                "Error": item.get("error") or "Missing instance_id or command_id"
             })
             continue
 
-        try:
-            # Gọi kết quả từ SSM
-            invocation = ssm.get_command_invocation(
-                CommandId=command_id,
-                InstanceId=instance_id,
-                PluginName='aws:runPowerShellScript'
-            )
-
-            output_lines = invocation.get("StandardOutputContent", "").splitlines()
-
-            if len(output_lines) < 2:
-                raise Exception("Unexpected command output format")
-
-            installed_kbs = [kb.strip() for kb in output_lines[0].split(',') if kb.strip()]
-            available_kbs = [kb.strip() for kb in output_lines[1].split(',') if kb.strip()]
-
-            logger.info(f"[{instance_id}] Installed KBs: {installed_kbs}")
-            logger.info(f"[{instance_id}] Available KBs: {available_kbs}")
+        by_command.setdefault(command_id, []).append(item)
 
-            kb_list = [kb if kb.startswith("KB") else f"KB{kb}" for kb in kb_list]
+    for command_id, items in by_command.items():
+        try:
+            invocations = list_invocations(command_id)
+        except ClientError as e:
+            logger.error(f"[{command_id}] ClientError: {str(e)}")
+            for item in items:
+                final_results.append({
+                    "InstanceId": item["instance_id"],
+                    "Error": str(e)
+                })
+            continue
 
-            result_available = []
-            result_skipped = []
-            result_installed = []
+        for item in items:
+            instance_id = item["instance_id"]
+            invocation = invocations.get(instance_id)
+
+            # Invocations can show up a moment after SendCommand returns
+            if not invocation or invocation.get("Status") in PENDING_STATUSES:
+                still_pending.append(item)
+                continue
+
+            try:
+                result, snapshot = build_result(item, invocation)
+                final_results.append(result)
+                scanned.append(snapshot)
+            except ClientError as e:
+                logger.error(f"[{instance_id}] ClientError: {str(e)}")
+                final_results.append({
+                    "InstanceId": instance_id,
+                    "Error": str(e)
+                })
+            except Exception as e:
+                logger.error(f"[{instance_id}] Error: {str(e)}")
+                final_results.append({
+                    "InstanceId": instance_id,
+                    "Error": str(e)
+                })
+
+    if scanned:
+        try:
+            inventory.put(scanned)
+        except Exception as e:
+            # The run goes on; the next one just rescans these servers
+            logger.error(f"Error storing {len(scanned)} inventory snapshot(s): {str(e)}")
 
-            for kb in kb_list:
-                if kb in installed_kbs:
-                    result_installed.append(kb.replace("KB", ""))
-                elif kb in available_kbs:
-                    result_available.append(kb.replace("KB", ""))
-                else:
-                    result_skipped.append({
-                        "KB": kb.replace("KB", ""),
-                        "status": "Not Available"
-                    })
+    newly_ready = len(pending) - len(still_pending)
+    logger.info(f"Poll #{attempt}: {newly_ready} ready, {len(still_pending)} still pending")
 
+    if still_pending and attempt >= KB_POLL_MAX_ATTEMPTS:
+        for item in still_pending:
             final_results.append({
-                "InstanceId": instance_id,
-                "installedKBs": result_installed,
-                "availableKBs": result_available,
-                "skippedKBs": result_skipped
+                "InstanceId": item["instance_id"],
+                "Error": f"Inventory command still running after {attempt} polls"
             })
+        still_pending = []
 
-        except ClientError as e:
-            logger.error(f"[{instance_id}] ClientError: {str(e)}")
-            final_results.append({
-                "InstanceId": instance_id,
-                "Error": str(e)
-            })
-        except Exception as e:
-            logger.error(f"[{instance_id}] Error: {str(e)}")
-            final_results.append({
-                "InstanceId": instance_id,
-                "Error": str(e)
-            })
+    if not still_pending:
+        return {
+            "status": "done",
+            "results": final_results
+        }
+
+    # Keep polling fast while instances are finishing, back off while nothing changes
+    if newly_ready:
+        wait_seconds = KB_POLL_MIN_WAIT
+    else:
+        wait_seconds = min(KB_POLL_MAX_WAIT, int(wait_seconds * KB_POLL_BACKOFF))
 
     return {
-        "status": "done",
-        "results": final_results
-    }
\ No newline at end of file
+        "status": "pending",
+        "results": final_results,
+        "pending": still_pending,
+        "attempt": attempt,
+        "waitSeconds": wait_seconds
+    }
+
+def list_invocations(command_id):
+    invocations = {}
+    paginator = ssm.get_paginator('list_command_invocations')
+    for page in paginator.paginate(CommandId=command_id, Details=True):
+        for invocation in page.get("CommandInvocations", []):
+            invocations[invocation["InstanceId"]] = invocation
+    return invocations
+
+def get_output(command_id, instance_id, invocation):
+    plugins = invocation.get("CommandPlugins", [])
+    output = plugins[0].get("Output", "") if plugins else ""
+
+    # Fall back to the full invocation when the listed output was cut off
+    if len(output) >= DETAILS_OUTPUT_LIMIT or "--output truncated--" in output:
+        response = ssm.get_command_invocation(
+            CommandId=command_id,
+            InstanceId=instance_id,
+            PluginName='aws:runPowerShellScript'
+        )
+        output = response.get("StandardOutputContent", "")
+
+    return output
+
+def parse_kb_lines(output):
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    installed_line = next((line for line in lines if line.startswith("INSTALLED_KBS=")), None)
+    available_line = next((line for line in lines if line.startswith("AVAILABLE_KBS=")), None)
+    build_line = next((line for line in lines if line.startswith("OS_BUILD=")), None)
+
+    if installed_line is None or available_line is None:
+        if len(lines) < 2:
+            raise Exception("Unexpected command output format")
+        installed_line, available_line = lines[0], lines[1]
+
+    installed_kbs = [kb.strip() for kb in installed_line.split('=', 1)[-1].split(',') if kb.strip()]
+    available_kbs = [kb.strip() for kb in available_line.split('=', 1)[-1].split(',') if kb.strip()]
+    os_build = build_line.split('=', 1)[-1].strip() if build_line else None
+    return installed_kbs, available_kbs, os_build or None
+
+def build_result(item, invocation):
+    instance_id = item["instance_id"]
+    output = get_output(item["command_id"], instance_id, invocation)
+    installed_kbs, available_kbs, os_build = parse_kb_lines(output)
+
+    logger.info(f"[{instance_id}] Installed KBs: {installed_kbs}")
+    logger.info(f"[{instance_id}] Available KBs: {available_kbs}")
+
+    snapshot = {
+        "InstanceId": instance_id,
+        "InstalledKBs": installed_kbs,
+        "AvailableKBs": available_kbs,
+        "OsBuild": os_build,
+        "CommandId": item["command_id"]
+    }
+    return compare_kbs(item, installed_kbs, available_kbs, os_build), snapshot
+
+def compare_kbs(item, installed_kbs, available_kbs, os_build=None):
+    kb_list = [kb if kb.startswith("KB") else f"KB{kb}" for kb in item.get("kb_list", [])]
+
+    result_available = []
+    result_skipped = []
+    result_installed = []
+
+    for kb in kb_list:
+        if kb in installed_kbs:
+            result_installed.append(kb.replace("KB", ""))
+        elif kb in available_kbs:
+            result_available.append(kb.replace("KB", ""))
+        else:
+            result_skipped.append({
+                "KB": kb.replace("KB", ""),
+                "status": "Not Available"
+            })
+
+    # Cumulative updates: install only the newest KB of each supersedence chain
+    result_available, superseded = covering_set(result_available, result_installed, item.get("superseded_by") or {})
+    for kb, newer_kb in superseded.items():
+        result_skipped.append({
+            "KB": kb,
+            "status": SUPERSEDED_STATUS,
+            "SupersededBy": newer_kb
+        })
+    if superseded:
+        logger.info(f"[{item['instance_id']}] Skipping {len(superseded)} superseded KB(s): {superseded}")
+
+    result = {
+        "InstanceId": item["instance_id"],
+        "installedKBs": result_installed,
+        "availableKBs": result_available,
+        "skippedKBs": result_skipped,
+        "inventory": INVENTORY_SOURCES.get(item.get("status"), "scanned")
+    }
+    if os_build:
+        result["osBuild"] = os_build
+    # schedule_patch_waves never defers these past the window deadline
+    critical = {str(kb).replace("KB", "") for kb in item.get("critical_kbs") or []}
+    result["criticalKBs"] = [kb for kb in result_available if kb in critical]
+    return result
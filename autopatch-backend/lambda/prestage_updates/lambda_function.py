@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+from botocore.exceptions import ClientError
+from autopatch_common import aws
+from autopatch_common.patch_commands import DOWNLOAD_TIMEOUT_SECONDS, send_download
+from autopatch_common.ssm_results import PENDING_STATUSES, parse_stage_results
+from autopatch_common.staging import StagingStore
+from autopatch_common.timestamps import event_now, parse_time
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ssm = aws.client('ssm')
+ec2 = aws.client('ec2')
+staging = StagingStore(os.environ['PATCH_TABLE'])
+
+# Downloads running at the same time per subnet, so staging does not saturate the NAT/WAN link
+DEFAULT_MAX_PER_SUBNET = 5
+PRESTAGE_POLL_SECONDS = int(os.environ.get("PRESTAGE_POLL_SECONDS", "60"))
+
+DESCRIBE_BATCH_SIZE = 200
+UNKNOWN_SUBNET = "unknown"
+
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    now = event_now(event)
+    action = event.get("action")
+    if action == "plan":
+        return plan_downloads(event.get("results", []), event.get("config") or {}, now)
+    if action == "check":
+        return check_downloads(event.get("state", {}), now)
+
+    raise ValueError(f"Unknown action: {action}")
+
+def plan_downloads(results, config, now):
+    servers = [r for r in results if "Error" not in r and r.get("availableKBs")]
+    instance_ids = [server["InstanceId"] for server in servers]
+
+    # KBs staged by an earlier run are still in the cache; only the rest is downloaded
+    staged = staging.get_staged(instance_ids)
+    subnets = get_subnets(instance_ids)
+    max_per_subnet = max(1, int(config.get("maxDownloadsPerSubnet") or DEFAULT_MAX_PER_SUBNET))
+
+    queues = {}
+    already_staged = []
+    for server in servers:
+        instance_id = server["InstanceId"]
+        done = set(staged.get(instance_id, []))
+        kbs = [kb for kb in server["availableKBs"] if str(kb).replace("KB", "") not in done]
+        if not kbs:
+            already_staged.append(instance_id)
+            continue
+        queues.setdefault(subnets.get(instance_id, UNKNOWN_SUBNET), []).append({"InstanceId": instance_id, "KBs": kbs})
+
+    logger.info(f"{sum(len(q) for q in queues.values())}/{len(servers)} server(s) to stage in {len(queues)} subnet(s), "
+                f"{max_per_subnet} download(s) per subnet, {len(already_staged)} already staged")
+
+    state = {
+        "queues": queues,
+        "downloading": {},
+        "staged": already_staged,
+        "failed": [],
+        "stagedKBs": 0,
+        "maxPerSubnet": max_per_subnet,
+        "waitSeconds": PRESTAGE_POLL_SECONDS
+    }
+    start_downloads(state, now)
+    return with_status(state)
+
+def check_downloads(state, now):
+    downloading = state.get("downloading", {})
+
+    for instance_id, download in list(downloading.items()):
+        started = parse_time(download.get("startedAt"))
+        if started and (now - started).total_seconds() > DOWNLOAD_TIMEOUT_SECONDS:
+            # SSM has given up on it by now; free the subnet slot instead of polling forever
+            downloading.pop(instance_id)
+            logger.warning(f"[{instance_id}] Download {download['CommandId']} not finished after {DOWNLOAD_TIMEOUT_SECONDS} s")
+            state["failed"].append({"InstanceId": instance_id, "KBs": download["KBs"], "Error": "Download timed out"})
+            continue
+
+        try:
+            response = ssm.get_command_invocation(
+                CommandId=download["CommandId"],
+                InstanceId=instance_id,
+                PluginName='aws:runPowerShellScript'
+            )
+        except ssm.exceptions.InvocationDoesNotExist:
+            # Not registered yet right after SendCommand
+            continue
+        except ClientError as e:
+            logger.error(f"[{instance_id}] SSM get_command_invocation error: {e}")
+            continue
+        if response.get("Status") in PENDING_STATUSES:
+            continue
+
+        downloading.pop(instance_id)
+        staged_kbs, failed_kbs = parse_stage_results(response.get("StandardOutputContent", ""))
+        if staged_kbs:
+            try:
+                staging.mark_staged(instance_id, staged_kbs)
+                state["stagedKBs"] += len(staged_kbs)
+            except Exception as e:
+                logger.error(f"[{instance_id}] Error recording staged KBs {staged_kbs}: {str(e)}")
+                staged_kbs = []
+
+        if staged_kbs and not failed_kbs:
+            state["staged"].append(instance_id)
+        else:
+            # Whatever did not stage is simply downloaded by the install in the window
+            error = response.get("StandardErrorContent", "").strip() or f"Command {response.get('Status')}"
+            logger.warning(f"[{instance_id}] Staged {staged_kbs}, not staged {failed_kbs or download['KBs']}: {error}")
+            state["failed"].append({"InstanceId": instance_id, "KBs": failed_kbs or download["KBs"], "Error": error[:500]})
+
+    start_downloads(state, now)
+    return with_status(state)
+
+def start_downloads(state, now):
+    # Fill every subnet up to its limit; the next server starts as soon as one finishes
+    running = {}
+    for download in state["downloading"].values():
+        running[download["Subnet"]] = running.get(download["Subnet"], 0) + 1
+
+    for subnet, queue in state["queues"].items():
+        while queue and running.get(subnet, 0) < state["maxPerSubnet"]:
+            server = queue.pop(0)
+            instance_id = server["InstanceId"]
+            try:
+                command_id = send_download(ssm, instance_id, server["KBs"])
+                state["downloading"][instance_id] = {
+                    "CommandId": command_id,
+                    "Subnet": subnet,
+                    "KBs": server["KBs"],
+                    "startedAt": now.isoformat()
+                }
+                running[subnet] = running.get(subnet, 0) + 1
+                logger.info(f"[{instance_id}] Download sent for {len(server['KBs'])} KB(s) in {subnet}: {command_id}")
+            except ClientError as e:
+                logger.error(f"[{instance_id}] Error sending download command: {str(e)}")
+                state["failed"].append({"InstanceId": instance_id, "KBs": server["KBs"], "Error": str(e)})
+
+    state["queues"] = {subnet: queue for subnet, queue in state["queues"].items() if queue}
+
+def get_subnets(instance_ids):
+    subnets = {}
+    paginator = ec2.get_paginator('describe_instances')
+
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        batch = instance_ids[i:i + DESCRIBE_BATCH_SIZE]
+        try:
+            for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}]):
+                for res in page['Reservations']:
+                    for inst in res['Instances']:
+                        subnets[inst['InstanceId']] = inst.get('SubnetId', UNKNOWN_SUBNET)
+        except ClientError as e:
+            # Servers without a subnet share one download limit
+            logger.error(f"EC2 describe_instances error: {e}")
+
+    return subnets
+
+def with_status(state):
+    state["status"] = "waiting" if state["downloading"] or state["queues"] else "done"
+    return state
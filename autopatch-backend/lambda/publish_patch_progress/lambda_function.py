@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from autopatch_common import aws
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+table = aws.table(os.environ['CONNECTIONS_TABLE'])
+
+# https://<api-id>.execute-api.<region>.amazonaws.com/<stage>, or the local stand-in
+apigw = aws.client('apigatewaymanagementapi', endpoint_url=os.environ['WEBSOCKET_ENDPOINT'])
+
+POST_MAX_WORKERS = int(os.environ.get("WS_POST_WORKERS", "16"))
+# Keeps each WebSocket message well under the 128 KB API Gateway limit
+CHANGES_PER_MESSAGE = 200
+
+def lambda_handler(event, context):
+    changes = collect_changes(event.get("Records", []))
+    if not changes:
+        return {"status": "ok", "changes": 0, "connections": 0}
+
+    # One watcher lookup per instance in the batch, however many KBs changed on it
+    instance_ids = sorted({change["instance_id"] for change in changes})
+    with ThreadPoolExecutor(max_workers=min(POST_MAX_WORKERS, len(instance_ids))) as executor:
+        watchers = dict(zip(instance_ids, executor.map(get_watchers, instance_ids)))
+
+    by_connection = {}
+    for change in changes:
+        for connection_id in watchers[change["instance_id"]]:
+            by_connection.setdefault(connection_id, []).append(change)
+
+    if by_connection:
+        with ThreadPoolExecutor(max_workers=min(POST_MAX_WORKERS, len(by_connection))) as executor:
+            list(executor.map(lambda c: send_changes(c, by_connection[c]), by_connection))
+
+    logger.info(f"Published {len(changes)} change(s) for {len(instance_ids)} instance(s) "
+                f"to {len(by_connection)} connection(s)")
+    return {"status": "ok", "changes": len(changes), "connections": len(by_connection)}
+
+def collect_changes(records):
+    changes = {}
+    for record in records:
+        # REMOVE is TTL cleanup, not a status transition
+        if record.get("eventName") not in ("INSERT", "MODIFY"):
+            continue
+        ddb = record.get("dynamodb", {})
+        new = to_item(ddb.get("NewImage"))
+        old = to_item(ddb.get("OldImage"))
+        pk, sk = new.get("PK", ""), new.get("SK", "")
+        if not pk.startswith("PATCH#"):
+            continue
+        instance_id = pk.replace("PATCH#", "", 1)
+
+        if sk.startswith("KB#") and new.get("Status") != old.get("Status"):
+            changes[(instance_id, sk)] = {
+                "type": "status",
+                "instance_id": instance_id,
+                "KB": sk.replace("KB#", "", 1),
+                "Status": new.get("Status", "Unknown"),
+                "LastUpdated": new.get("UpdatedAt", "-"),
+                "RebootRequired": new.get("RebootRequired", False)
+            }
+        elif sk == "PROGRESS" and (new.get("Total"), new.get("Completed")) != (old.get("Total"), old.get("Completed")):
+            total, completed = int(new.get("Total", 0)), int(new.get("Completed", 0))
+            changes[(instance_id, sk)] = {
+                "type": "progress",
+                "instance_id": instance_id,
+                "total": total,
+                "completed": completed,
+                "percentage": round((completed / total) * 100) if total else 0
+            }
+
+    # Later records in the batch overwrite earlier ones for the same row
+    return list(changes.values())
+
+def to_item(image):
+    return {k: aws.deserialize(v) for k, v in (image or {}).items()}
+
+def get_watchers(instance_id):
+    connections = []
+    kwargs = {"KeyConditionExpression": aws.key("PK").eq(f"INSTANCE#{instance_id}")}
+    while True:
+        response = table.query(**kwargs)
+        connections.extend(item["SK"].replace("CONN#", "", 1) for item in response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return connections
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def send_changes(connection_id, changes):
+    try:
+        for i in range(0, len(changes), CHANGES_PER_MESSAGE):
+            apigw.post_to_connection(
+                ConnectionId=connection_id,
+                Data=json.dumps({"changes": changes[i:i + CHANGES_PER_MESSAGE]}).encode("utf-8")
+            )
+    except apigw.exceptions.GoneException:
+        logger.info(f"Connection {connection_id} is gone, dropping its subscriptions")
+        drop_connection(connection_id)
+    except Exception as e:
+        # A slow or broken client must not make the stream retry the batch for everyone
+        logger.error(f"Error posting to {connection_id}: {str(e)}")
+
+def drop_connection(connection_id):
+    kwargs = {"KeyConditionExpression": aws.key("PK").eq(f"CONN#{connection_id}")}
+    with table.batch_writer() as batch:
+        while True:
+            response = table.query(**kwargs)
+            for item in response.get("Items", []):
+                instance_key = item["SK"]
+                batch.delete_item(Key={"PK": instance_key, "SK": f"CONN#{connection_id}"})
+                batch.delete_item(Key={"PK": f"CONN#{connection_id}", "SK": instance_key})
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
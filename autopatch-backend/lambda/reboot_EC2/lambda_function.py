@@ -1,12 +1,12 @@
-import boto3
 import json
 import logging
+from autopatch_common import aws
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ec2 = boto3.client('ec2')
+ec2 = aws.client('ec2')
 
 def lambda_handler(event, context):
     logger.info("Received event: %s", json.dumps(event))
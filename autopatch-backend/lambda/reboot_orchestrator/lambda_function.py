@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+from datetime import timedelta, timezone
+from botocore.exceptions import ClientError
+from autopatch_common import aws
+from autopatch_common.reboots import RebootStore
+from autopatch_common.timestamps import event_now, parse_time
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ssm = aws.client('ssm')
+ec2 = aws.client('ec2')
+reboots = RebootStore(os.environ['PATCH_TABLE'])
+
+# Servers rebooting at the same time; the next one starts as soon as one is back online
+DEFAULT_REBOOT_CONCURRENCY = 10
+REBOOT_POLL_SECONDS = int(os.environ.get("REBOOT_POLL_SECONDS", "15"))
+REBOOT_TIMEOUT_MINUTES = int(os.environ.get("REBOOT_TIMEOUT_MINUTES", "30"))
+
+# A ping this soon after the reboot call may come from the agent before it went down
+REBOOT_MIN_SECONDS = int(os.environ.get("REBOOT_MIN_SECONDS", "60"))
+
+# The SSM InstanceIds filter accepts at most 50 values
+PING_BATCH_SIZE = 50
+ONLINE = "Online"
+
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    now = event_now(event)
+    action = event.get("action")
+    if action == "plan":
+        return plan_reboots(event.get("servers", []), event.get("config") or {}, now)
+    if action == "check":
+        return check_reboots(event.get("reboots", {}), now)
+
+    raise ValueError(f"Unknown action: {action}")
+
+def plan_reboots(servers, config, now):
+    if config.get("autoReboot") is False:
+        return {"status": "done", "queue": [], "rebooting": {}, "rebooted": [], "failed": []}
+
+    # One reboot per server after its last KB, whatever number of KBs asked for it
+    instance_ids = [server["InstanceId"] for server in servers if server.get("InstanceId")]
+    pending = reboots.get_pending(instance_ids)
+    concurrency = max(1, int(config.get("rebootConcurrency") or config.get("maxConcurrency") or DEFAULT_REBOOT_CONCURRENCY))
+    logger.info(f"{len(pending)}/{len(instance_ids)} server(s) need a reboot, {concurrency} at a time: {pending}")
+
+    state = {
+        "queue": [i for i in instance_ids if i in pending],
+        "rebooting": {},
+        "offline": [],
+        "rebooted": [],
+        "failed": [],
+        "concurrency": concurrency,
+        "waitSeconds": REBOOT_POLL_SECONDS
+    }
+    start_reboots(state, now)
+    return with_status(state)
+
+def check_reboots(state, now):
+    rebooting = state.get("rebooting", {})
+    pings = get_ping_status(list(rebooting))
+    offline = set(state.get("offline", []))
+
+    ready = []
+    for instance_id, rebooted_at in list(rebooting.items()):
+        rebooted_at = parse_time(rebooted_at)
+        ping_status, last_ping = pings.get(instance_id, (None, None))
+
+        if ping_status != ONLINE:
+            offline.add(instance_id)
+        elif instance_id in offline or (last_ping and last_ping >= rebooted_at + timedelta(seconds=REBOOT_MIN_SECONDS)):
+            # Seen going down and back, or pinging again well after the reboot call
+            ready.append(instance_id)
+            continue
+
+        if now - rebooted_at > timedelta(minutes=REBOOT_TIMEOUT_MINUTES):
+            logger.error(f"[{instance_id}] Not back online {REBOOT_TIMEOUT_MINUTES} min after reboot (PingStatus={ping_status})")
+            state["failed"].append({"InstanceId": instance_id, "Error": f"Not back online after {REBOOT_TIMEOUT_MINUTES} min"})
+            rebooting.pop(instance_id)
+            offline.discard(instance_id)
+
+    for instance_id in ready:
+        rebooting.pop(instance_id)
+        offline.discard(instance_id)
+        state["rebooted"].append(instance_id)
+    if ready:
+        logger.info(f"Back online: {ready}")
+        try:
+            reboots.clear(ready)
+        except Exception as e:
+            logger.error(f"Error clearing pending reboots for {ready}: {str(e)}")
+
+    state["offline"] = sorted(offline)
+    start_reboots(state, now)
+    return with_status(state)
+
+def start_reboots(state, now):
+    slots = state["concurrency"] - len(state["rebooting"])
+    batch, state["queue"] = state["queue"][:max(0, slots)], state["queue"][max(0, slots):]
+    if not batch:
+        return
+
+    try:
+        ec2.reboot_instances(InstanceIds=batch)
+        logger.info(f"Reboot sent to {batch}")
+        for instance_id in batch:
+            state["rebooting"][instance_id] = now.isoformat()
+    except ClientError as e:
+        logger.error(f"Error rebooting {batch}: {str(e)}")
+        state["failed"].extend({"InstanceId": instance_id, "Error": str(e)} for instance_id in batch)
+
+def get_ping_status(instance_ids):
+    pings = {}
+    paginator = ssm.get_paginator('describe_instance_information')
+
+    for i in range(0, len(instance_ids), PING_BATCH_SIZE):
+        batch = instance_ids[i:i + PING_BATCH_SIZE]
+        try:
+            for page in paginator.paginate(Filters=[{'Key': 'InstanceIds', 'Values': batch}]):
+                for info in page.get('InstanceInformationList', []):
+                    last_ping = info.get('LastPingDateTime')
+                    if last_ping and last_ping.tzinfo is None:
+                        last_ping = last_ping.replace(tzinfo=timezone.utc)
+                    pings[info['InstanceId']] = (info.get('PingStatus'), last_ping)
+        except ClientError as e:
+            # Counted as not back yet; the next poll asks again
+            logger.error(f"SSM describe_instance_information error: {e}")
+
+    return pings
+
+def with_status(state):
+    state["status"] = "waiting" if state["rebooting"] or state["queue"] else "done"
+    return state
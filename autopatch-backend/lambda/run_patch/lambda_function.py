@@ -1,33 +1,23 @@
-import boto3
 import logging
 import json
+from autopatch_common import aws
+from autopatch_common.patch_commands import send_patch, send_patch_batch
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ssm = boto3.client('ssm')
-
-POWERSHELL_SCRIPT = '''
-$kb = "{kb}"
-
-try {{
-    Install-WindowsUpdate -KBArticleID $kb -AcceptAll -IgnoreReboot -ErrorAction Stop -Verbose -Confirm:$false
-    Write-Output "PATCH_SUCCESS"
-
-    if (Test-Path "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WindowsUpdate\\Auto Update\\RebootRequired") {{
-        Write-Output "REBOOT_REQUIRED"
-    }}
-}} catch {{
-    Write-Error "PATCH_FAILED: $_"
-    exit 1
-}}
-'''
+ssm = aws.client('ssm')
 
 def lambda_handler(event, context):
     logger.info(f"Received event: {json.dumps(event)}")
 
     instance_id = event.get("InstanceId")
     kb = event.get("KB")
+    # KBs the pre-stage run already downloaded to this server (schedule_patch_waves)
+    staged_kbs = {str(k).replace("KB", "") for k in event.get("stagedKBs") or []}
+
+    if event.get("KBs"):
+        return run_batch(instance_id, event["KBs"], staged_kbs)
 
     if not instance_id or not kb:
         return {
@@ -36,18 +26,10 @@ def lambda_handler(event, context):
         }
 
     try:
-        script = POWERSHELL_SCRIPT.format(kb=kb)
+        staged = str(kb).replace("KB", "") in staged_kbs
+        logger.info(f"Sending {'install-only' if staged else 'patch'} command to {instance_id} for {kb}")
 
-        logger.info(f"Sending patch command to {instance_id} for {kb}")
-
-        response = ssm.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunPowerShellScript",
-            Parameters={'commands': [script]},
-            TimeoutSeconds=900,
-        )
-
-        command_id = response['Command']['CommandId']
+        command_id = send_patch(ssm, instance_id, kb, staged=staged)
         logger.info(f"Command sent: {command_id}")
 
         return {
@@ -63,3 +45,33 @@ def lambda_handler(event, context):
             "status": "error",
             "message": str(e)
         }
+
+def run_batch(instance_id, kbs, staged_kbs=()):
+    if not instance_id:
+        return {
+            "status": "error",
+            "message": "Missing InstanceId"
+        }
+
+    try:
+        # Any staged KB: install what is cached, download only the rest
+        staged = any(str(kb).replace("KB", "") in staged_kbs for kb in kbs)
+        logger.info(f"Sending batch patch command to {instance_id} for {len(kbs)} KB(s): {kbs}"
+                    f"{' (install-only for staged KBs)' if staged else ''}")
+
+        command_id = send_patch_batch(ssm, instance_id, kbs, staged=staged)
+        logger.info(f"Command sent: {command_id}")
+
+        return {
+            "status": "ok",
+            "InstanceId": instance_id,
+            "KBs": kbs,
+            "CommandId": command_id
+        }
+
+    except Exception as e:
+        logger.error(f"Error sending batch patch command: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
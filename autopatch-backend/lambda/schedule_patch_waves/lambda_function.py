@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import uuid
+from datetime import timedelta
+from autopatch_common.patch_runs import PatchRunStore
+from autopatch_common.staging import StagingStore
+from autopatch_common.timestamps import event_now, parse_time
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+staging = StagingStore(os.environ['PATCH_TABLE'])
+runs = PatchRunStore(os.environ['PATCH_TABLE'])
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_CANARY_SIZE = 1
+DEFAULT_MAX_FAILURE_RATE = 0.2
+
+# Install time assumed per KB when fitting a wave into the window deadline
+DEFAULT_KB_MINUTES = 15
+DEFERRED_STATUS = "Deferred"
+
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    action = event.get("action")
+    now = event_now(event)
+    if action == "plan":
+        # runId: $$.Execution.Name, the key of this run's waves and results in PatchProgress
+        run_id = event.get("runId") or str(uuid.uuid4())
+        return plan_waves(event.get("results", []), event.get("config") or {}, now,
+                          parse_time(event.get("startedAt")), run_id)
+    if action == "advance":
+        return advance_wave(event.get("state", {}), now)
+
+    raise ValueError(f"Unknown action: {action}")
+
+def plan_waves(results, config, now, started_at=None, run_id=None):
+    max_concurrency = max(1, int(config.get("maxConcurrency", DEFAULT_MAX_CONCURRENCY)))
+    canary_size = max(0, int(config.get("canarySize", DEFAULT_CANARY_SIZE)))
+    wave_size = max(1, int(config.get("waveSize", max_concurrency)))
+    max_failure_rate = float(config.get("maxFailureRate", DEFAULT_MAX_FAILURE_RATE))
+
+    install_mode = config.get("installMode", "sequential")
+    engine = bool(config.get("engine", False))
+
+    # windowDeadline (ISO 8601) or windowMinutes from the start of the execution
+    deadline = parse_time(config.get("windowDeadline"))
+    if not deadline and config.get("windowMinutes"):
+        deadline = (started_at or now) + timedelta(minutes=float(config["windowMinutes"]))
+    kb_minutes = float(config.get("kbMinutes", DEFAULT_KB_MINUTES))
+
+    # Servers whose inventory failed have nothing to patch and would break the Map ItemSelector
+    servers = [dict(r, installMode=install_mode) for r in results if "Error" not in r]
+    errored = [r for r in results if "Error" in r]
+
+    # KBs downloaded ahead of the window by prestage_updates: run_patch installs them from the cache
+    staged = get_staged([server["InstanceId"] for server in servers])
+    for server in servers:
+        cached = set(staged.get(server["InstanceId"], []))
+        server["stagedKBs"] = [kb for kb in server.get("availableKBs", []) if str(kb).replace("KB", "") in cached]
+
+    waves = []
+    if canary_size:
+        waves.append(servers[:canary_size])
+    rest = servers[canary_size:]
+    waves.extend(rest[i:i + wave_size] for i in range(0, len(rest), wave_size))
+    waves = [wave for wave in waves if wave]
+
+    logger.info(f"Planned {len(waves)} wave(s) for {len(servers)} server(s): "
+                f"sizes={[len(w) for w in waves]}, maxConcurrency={max_concurrency}, "
+                f"maxFailureRate={max_failure_rate}, installMode={install_mode}, engine={engine}, "
+                f"staged={sum(1 for server in servers if server['stagedKBs'])}")
+
+    # Later waves and every finished server live in PatchProgress; the state stays one wave big
+    run_id = run_id or str(uuid.uuid4())
+    runs.save_results(run_id, errored, [[] for _ in errored])
+    runs.save_waves(run_id, waves[1:], first_wave=2)
+
+    state = {
+        "runId": run_id,
+        "status": "running" if waves else "done",
+        "currentWave": waves[0] if waves else [],
+        "waveNumber": 1,
+        "waveCount": len(waves),
+        "maxConcurrency": max_concurrency,
+        "maxFailureRate": max_failure_rate,
+        "engine": engine,
+        "windowDeadline": deadline.isoformat() if deadline else None,
+        "kbMinutes": kb_minutes,
+        "deferredKBs": 0,
+        "patchedServers": 0,
+        "failedServers": 0
+    }
+    if not waves:
+        return finish(state)
+    fit_to_deadline(state, now)
+    return state
+
+def get_staged(instance_ids):
+    try:
+        return staging.get_staged(instance_ids)
+    except Exception as e:
+        # Without the staging records every KB is simply downloaded and installed
+        logger.error(f"Error reading staged downloads: {str(e)}")
+        return {}
+
+def advance_wave(state, now):
+    wave = state.get("currentWave", [])
+    wave_overview = state.get("waveOverview", [])
+
+    # A server that did not come back from its reboot counts as failed for the circuit breaker
+    reboots = state.pop("reboots", None) or {}
+    rebooted = set(reboots.get("rebooted", []))
+    reboot_failed = {f["InstanceId"]: f.get("Error") for f in reboots.get("failed", [])}
+    for server in wave:
+        if server["InstanceId"] in rebooted:
+            server["rebootStatus"] = "Rebooted"
+        elif server["InstanceId"] in reboot_failed:
+            server["rebootStatus"] = f"Failed: {reboot_failed[server['InstanceId']]}"
+    state["rebootedServers"] = state.get("rebootedServers", 0) + len(rebooted)
+
+    failed = sum(1 for server, kb_results in zip(wave, wave_overview)
+                 if server_failed(kb_results) or server["InstanceId"] in reboot_failed)
+    state["patchedServers"] += len(wave)
+    state["failedServers"] += failed
+    runs.save_results(state["runId"], wave, wave_overview)
+
+    failure_rate = state["failedServers"] / state["patchedServers"] if state["patchedServers"] else 0
+    logger.info(f"Wave {state['waveNumber']} done: {failed}/{len(wave)} failed, "
+                f"overall failure rate {failure_rate:.0%}")
+
+    pending_waves = range(state["waveNumber"] + 1, state["waveCount"] + 1)
+    if pending_waves and failure_rate > state["maxFailureRate"]:
+        # Circuit breaker: leave the remaining servers untouched and report them
+        halted = [server for number in pending_waves for server in runs.get_wave(state["runId"], number)]
+        logger.warning(f"Failure rate {failure_rate:.0%} above {state['maxFailureRate']:.0%}, "
+                       f"halting {len(halted)} server(s) in {len(pending_waves)} wave(s)")
+        runs.save_results(state["runId"], [dict(server, waveStatus="Halted") for server in halted],
+                          [[] for _ in halted])
+        state["status"] = "halted"
+        state["haltedServers"] = len(halted)
+        return finish(state)
+
+    if not pending_waves:
+        state["status"] = "done"
+        return finish(state)
+
+    state["waveNumber"] += 1
+    state["currentWave"] = runs.get_wave(state["runId"], state["waveNumber"])
+    state.pop("waveOverview", None)
+    state.pop("engineResult", None)
+    fit_to_deadline(state, now)
+    return state
+
+def fit_to_deadline(state, now):
+    # KBs arrive highest risk first; defer the tail that would still be installing at the
+    # deadline to the next window. Critical KBs are installed regardless.
+    deadline = parse_time(state.get("windowDeadline"))
+    if not deadline:
+        return
+    fits = max(0, int((deadline - now).total_seconds() // (state["kbMinutes"] * 60)))
+
+    deferred_total = 0
+    for server in state["currentWave"]:
+        critical = set(server.get("criticalKBs") or [])
+        keep, deferred = [], []
+        for kb in server.get("availableKBs", []):
+            (keep if kb in critical or len(keep) < fits else deferred).append(kb)
+        if deferred:
+            server["availableKBs"] = keep
+            server["skippedKBs"] = server.get("skippedKBs", []) + [
+                {"KB": kb, "status": DEFERRED_STATUS} for kb in deferred
+            ]
+            deferred_total += len(deferred)
+
+    if deferred_total:
+        logger.warning(f"Wave {state['waveNumber']}: {fits} KB(s) per server fit before {deadline.isoformat()}, "
+                       f"deferring {deferred_total} KB(s) to the next window")
+    state["deferredKBs"] = state.get("deferredKBs", 0) + deferred_total
+
+def server_failed(kb_results):
+    return any(
+        isinstance(r, dict) and (r.get("newStatus") == "Failed" or r.get("status") == "error")
+        for r in kb_results or []
+    )
+
+def finish(state):
+    # Only what SendSummaryEmail needs; it reads the per-server results by runId
+    return {
+        "status": state["status"],
+        "runId": state["runId"],
+        "waves": {
+            "completed": state["waveNumber"] if state["patchedServers"] else 0,
+            "patchedServers": state["patchedServers"],
+            "failedServers": state["failedServers"],
+            "haltedServers": state.get("haltedServers", 0),
+            "rebootedServers": state.get("rebootedServers", 0),
+            "deferredKBs": state.get("deferredKBs", 0)
+        }
+    }
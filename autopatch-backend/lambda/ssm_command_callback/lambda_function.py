@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from autopatch_common import aws
+from autopatch_common.ssm_results import PENDING_STATUSES, build_patch_result
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ssm = aws.client('ssm')
+sfn = aws.client('stepfunctions')
+table = aws.table(os.environ['PATCH_TABLE'])
+
+# Tokens outlive the longest batch install (2 h execution timeout) before TTL removes them
+TOKEN_TTL_HOURS = 3
+
+def lambda_handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+
+    # EventBridge: "EC2 Command Invocation Status-change Notification"
+    if event.get("source") == "aws.ssm":
+        detail = event.get("detail", {})
+        return handle_status_change(detail.get("command-id"), detail.get("instance-id"), detail.get("status"))
+
+    # Step Functions: lambda:invoke.waitForTaskToken from the patch flows
+    return register_task_token(event)
+
+def register_task_token(event):
+    task_token = event.get("TaskToken")
+    command_id = event.get("CommandId")
+    instance_id = event.get("InstanceId")
+
+    if not task_token or not command_id or not instance_id:
+        raise ValueError("Missing TaskToken, CommandId or InstanceId")
+
+    item = {
+        "PK": f"CMD#{command_id}",
+        "SK": f"INSTANCE#{instance_id}",
+        "TaskToken": task_token,
+        "TTL": token_ttl()
+    }
+    if event.get("KBs"):
+        item["KBs"] = event["KBs"]
+    table.put_item(Item=item)
+    logger.info(f"Registered task token for {command_id} on {instance_id}")
+
+    # The command may have finished before the token was stored; its event then left a DONE# marker
+    done = table.get_item(Key=done_key(command_id, instance_id), ConsistentRead=True).get("Item")
+    if done:
+        complete(command_id, instance_id)
+
+    return {"status": "registered", "CommandId": command_id, "InstanceId": instance_id}
+
+def handle_status_change(command_id, instance_id, status):
+    if not command_id or not instance_id:
+        logger.warning("Status change event without command-id or instance-id")
+        return {"status": "ignored"}
+
+    if status in PENDING_STATUSES:
+        return {"status": "ignored", "Status": status}
+
+    # Marker first, then claim: a task registering in between either finds the marker or has its
+    # token claimed here. SSM is only asked once a waiting task has been claimed.
+    table.put_item(Item=dict(done_key(command_id, instance_id), Status=status, TTL=token_ttl()))
+    return complete(command_id, instance_id)
+
+def done_key(command_id, instance_id):
+    return {"PK": f"CMD#{command_id}", "SK": f"DONE#{instance_id}"}
+
+def token_ttl():
+    return int((datetime.utcnow() + timedelta(hours=TOKEN_TTL_HOURS)).timestamp())
+
+def get_invocation(command_id, instance_id):
+    try:
+        return ssm.get_command_invocation(
+            CommandId=command_id,
+            InstanceId=instance_id,
+            PluginName='aws:runPowerShellScript'
+        )
+    except ssm.exceptions.InvocationDoesNotExist:
+        logger.info(f"Invocation {command_id} on {instance_id} not visible yet")
+        return None
+
+def complete(command_id, instance_id):
+    # Deleting the token claims it, so the event and the registration check never both resume
+    response = table.delete_item(
+        Key={"PK": f"CMD#{command_id}", "SK": f"INSTANCE#{instance_id}"},
+        ReturnValues="ALL_OLD"
+    )
+    token_item = response.get("Attributes")
+    if not token_item:
+        logger.info(f"No waiting task for {command_id} on {instance_id}")
+        return {"status": "no_waiter"}
+
+    invocation = get_invocation(command_id, instance_id)
+    if not invocation or invocation.get("Status") in PENDING_STATUSES:
+        # Put the token back for the next event or the polling fallback
+        table.put_item(Item=token_item)
+        return {"status": "ignored"}
+
+    # Same shape as poll_command_status so CheckPatchStatus/MarkBatchResults work unchanged
+    result = build_patch_result(invocation, instance_id, token_item.get("KBs"))
+    try:
+        sfn.send_task_success(taskToken=token_item["TaskToken"], output=json.dumps(result))
+    except (sfn.exceptions.TaskTimedOut, sfn.exceptions.InvalidToken, sfn.exceptions.TaskDoesNotExist) as e:
+        # The waiting state already fell back to polling
+        logger.warning(f"Task for {command_id} on {instance_id} no longer waiting: {e}")
+        return {"status": "expired"}
+
+    logger.info(f"Resumed task for {command_id} on {instance_id}: {result['Status']}")
+    return {"status": "resumed", "Status": result["Status"]}
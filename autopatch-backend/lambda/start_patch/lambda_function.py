@@ -1,9 +1,16 @@
 import json
-import boto3
 import os
+from autopatch_common import aws
 
-client = boto3.client("stepfunctions")
+client = aws.client("stepfunctions")
 STATE_MACHINE_ARN = os.environ["PATCH_STATE_MACHINE_ARN"]
+# "prestage": true starts the download-only run (stepfunctions/PrestageUpdates.json) instead
+PRESTAGE_STATE_MACHINE_ARN = os.environ.get("PRESTAGE_STATE_MACHINE_ARN")
+
+# Patch flow settings passed through to the execution input
+PATCH_OPTIONS = ["maxConcurrency", "canarySize", "waveSize", "maxFailureRate", "installMode", "engine", "maxPerServer",
+                 "inventoryMaxAgeMinutes", "windowDeadline", "windowMinutes", "kbMinutes",
+                 "autoReboot", "rebootConcurrency", "maxDownloadsPerSubnet"]
 
 def lambda_handler(event, context):
     try:
@@ -22,9 +29,21 @@ def lambda_handler(event, context):
                 "body": json.dumps({ "error": "Missing instance_ids" })
             }
 
+        state_machine_arn = STATE_MACHINE_ARN
+        if body.get("prestage"):
+            if not PRESTAGE_STATE_MACHINE_ARN:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({ "error": "Pre-stage state machine not configured" })
+                }
+            state_machine_arn = PRESTAGE_STATE_MACHINE_ARN
+
+        execution_input = { "instance_ids": instance_ids }
+        execution_input.update({ k: body[k] for k in PATCH_OPTIONS if body.get(k) is not None })
+
         response = client.start_execution(
-            stateMachineArn=STATE_MACHINE_ARN,
-            input=json.dumps({ "instance_ids": instance_ids })
+            stateMachineArn=state_machine_arn,
+            input=json.dumps(execution_input)
         )
 
         return {
@@ -1,8 +1,8 @@
 import json
-import boto3
 import os
+from autopatch_common import aws
 
-client = boto3.client("stepfunctions")
+client = aws.client("stepfunctions")
 STATE_MACHINE_ARN = os.environ["RETRY_SINGLE_KB_STATE_MACHINE_ARN"]
 
 def lambda_handler(event, context):
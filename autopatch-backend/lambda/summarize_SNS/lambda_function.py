@@ -1,27 +1,45 @@
-import boto3
 import os
 import json
 import logging
 from datetime import datetime
 from collections import defaultdict
+from autopatch_common import aws
+from autopatch_common.patch_runs import PatchRunStore
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sns = boto3.client('sns')
+sns = aws.client('sns')
 topic_arn = os.environ['SNS_TOPIC_ARN']
+runs = PatchRunStore(os.environ['PATCH_TABLE'])
 
 def lambda_handler(event, context):
     logger.info("Received event: %s", json.dumps(event))
     
-    summary = event
+    summary = event.get("summary", event)
     results = summary.get("results", [])
     overview = summary.get("overview", [])
+    if summary.get("runId") and not results:
+        # The patch flow keeps per-server results in PatchProgress, not in the execution state
+        results, overview = runs.get_results(summary["runId"])
 
     message_lines = []
     message_lines.append("📋 Patch Summary Report")
-    message_lines.append(f"🕒 Time: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
+    message_lines.append(f"🕒 Time: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}")
+
+    waves = summary.get("waves")
+    if waves:
+        message_lines.append(f"🌊 Waves: {waves.get('completed', 0)} completed, "
+                             f"{waves.get('failedServers', 0)}/{waves.get('patchedServers', 0)} server(s) failed")
+        if waves.get("rebootedServers"):
+            message_lines.append(f"🔁 {waves['rebootedServers']} server(s) rebooted after patching")
+        if waves.get("deferredKBs"):
+            message_lines.append(f"⏭️ {waves['deferredKBs']} KB(s) deferred to the next window (deadline)")
+    if summary.get("status") == "halted":
+        halted = f"{waves['haltedServers']} server(s) in the " if waves and waves.get("haltedServers") else ""
+        message_lines.append(f"⛔ {halted}Remaining waves halted: failure rate above the circuit breaker limit")
+    message_lines.append("")
 
     for idx, instance in enumerate(results):
         instance_id = instance.get("InstanceId", "Unknown")
@@ -32,6 +50,15 @@ def lambda_handler(event, context):
 
         message_lines.append(f"🖥️ Instance: {instance_id}")
 
+        if instance.get("Error"):
+            message_lines.append(f"  ❌ Error: {instance.get('Error')}")
+
+        if instance.get("waveStatus") == "Halted":
+            message_lines.append(f"  ⛔ Not patched: wave halted by circuit breaker")
+
+        if instance.get("rebootStatus"):
+            message_lines.append(f"  🔁 Reboot: {instance.get('rebootStatus')}")
+
         if installed:
             message_lines.append(f"  ✅ Already Installed: {', '.join(installed)}")
         
@@ -41,7 +68,8 @@ def lambda_handler(event, context):
         if skipped:
             message_lines.append(f"  ⚠️ Skipped KBs:")
             for s in skipped:
-                message_lines.append(f"    - KB {s.get('KB')}: {s.get('status')}")
+                superseded_by = f" by KB {s.get('SupersededBy')}" if s.get("SupersededBy") else ""
+                message_lines.append(f"    - KB {s.get('KB')}: {s.get('status')}{superseded_by}")
         
         if overview_items:
             message_lines.append(f"  📌 Patch Results:")
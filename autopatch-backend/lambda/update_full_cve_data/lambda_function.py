@@ -1,30 +1,65 @@
-import boto3
+import hashlib
 import json
 import logging
 import os
+import random
 import requests
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from autopatch_common import aws
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['TABLE_NAME'])
-
-def get_os_name_from_instance(instance_id):
-    ec2 = boto3.client('ec2')
-    try:
-        response = ec2.describe_instances(InstanceIds=[instance_id])
-        tags = response['Reservations'][0]['Instances'][0].get('Tags', [])
-        for tag in tags:
-            if tag['Key'] == 'OS':
-                return tag['Value']
-    except ClientError as e:
-        logger.error(f"Error fetching EC2 instance tags for {instance_id}: {e}")
-    return None
+dynamodb = aws.resource('dynamodb')
+TABLE_NAME = os.environ['TABLE_NAME']
+table = aws.table(TABLE_NAME)
+ec2 = aws.client('ec2')
+
+# MSRC paging: pages of 500 records, a bounded number of $skip pages in flight
+MSRC_PAGE_SIZE = 500
+MSRC_MAX_IN_FLIGHT = int(os.environ.get('MSRC_MAX_IN_FLIGHT', '4'))
+
+# Backfill: months processed in parallel, each with its own window of pages in flight
+BACKFILL_MAX_WORKERS = int(os.environ.get('BACKFILL_MAX_WORKERS', '3'))
+BACKFILL_MIN_REMAINING_MS = 120000
+
+# Pooled keep-alive session reused by every page request and warm invocation
+http = requests.Session()
+http.mount('https://', HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=MSRC_MAX_IN_FLIGHT * BACKFILL_MAX_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+# EC2 filters accept at most 200 values per call
+DESCRIBE_BATCH_SIZE = 200
+
+def get_os_names_for_instances(instance_ids):
+    os_names = {}
+    paginator = ec2.get_paginator('describe_instances')
+
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        batch = instance_ids[i:i + DESCRIBE_BATCH_SIZE]
+        try:
+            pages = paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}])
+            for page in pages:
+                for reservation in page.get('Reservations', []):
+                    for instance in reservation.get('Instances', []):
+                        for tag in instance.get('Tags', []):
+                            if tag['Key'] == 'OS':
+                                os_names[instance['InstanceId']] = tag['Value']
+        except ClientError as e:
+            logger.error(f"Error fetching EC2 instance tags for {batch}: {e}")
+
+    return os_names
 
 def build_msrc_api_url(start_date, end_date, skip=0):
     base_url = "https://api.msrc.microsoft.com/sug/v2.0/sugodata/v2.0/vi-VN/affectedProduct"
@@ -40,127 +75,358 @@ def build_msrc_api_url(start_date, end_date, skip=0):
     query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
     return f"{base_url}?{query_string}"
 
-def fetch_cve_data_for_month(start_date, end_date):
-    all_data = []
-    skip = 0
-    batch_size = 500
+def fetch_cve_page(start_date, end_date, skip):
+    url = build_msrc_api_url(start_date, end_date, skip)
+    logger.info(f"Fetching data from: {url}")
+    response = http.get(url, timeout=30)
+    response.raise_for_status()
+    return response.json()
 
-    while True:
-        try:
-            url = build_msrc_api_url(start_date, end_date, skip)
-            logger.info(f"Fetching data from: {url}")
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+def iter_cve_pages(start_date, end_date, stats=None):
+    # Pages are yielded in $skip order while later pages are still downloading
+    executor = ThreadPoolExecutor(max_workers=MSRC_MAX_IN_FLIGHT)
+    in_flight = deque()
+    next_skip = 0
+
+    def submit():
+        nonlocal next_skip
+        in_flight.append(executor.submit(fetch_cve_page, start_date, end_date, next_skip))
+        next_skip += MSRC_PAGE_SIZE
+
+    try:
+        # Only the first page is requested until the feed says there is more
+        submit()
+        while in_flight:
+            try:
+                data = in_flight.popleft().result()
+            except Exception as e:
+                logger.error(f"Error fetching CVE data: {e}")
+                if stats is not None:
+                    stats['fetchError'] = str(e)
+                break
 
             value = data.get('value', [])
             if not value:
                 logger.info("No more CVE records from API.")
                 break
 
-            all_data.extend(value)
-            logger.info(f"Fetched {len(value)} records, total so far: {len(all_data)}")
+            yield value
 
             # Nếu không còn trang tiếp theo → dừng
             if '@odata.nextLink' not in data:
                 break
 
-            # Nếu còn, skip sang trang sau
-            skip += batch_size
-            import time
-            time.sleep(0.1)
-
-        except Exception as e:
-            logger.error(f"Error fetching CVE data: {e}")
-            break
+            # Nếu còn, giữ cửa sổ các trang tiếp theo đang tải
+            while len(in_flight) < MSRC_MAX_IN_FLIGHT:
+                submit()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    return all_data
+def iter_cve_records(start_date, end_date, stats):
+    for page in iter_cve_pages(start_date, end_date, stats):
+        stats['pages'] += 1
+        stats['records'] += len(page)
+        logger.info(f"Fetched {len(page)} records, total so far: {stats['records']}")
+        yield from page
 
 def process_cve_data(cve_data, os_name_filter=None):
-    processed_items = {}
+    os_names = [os_name_filter] if os_name_filter else None
+    items_by_os = process_cve_data_by_os(cve_data, os_names)
+    return [item for items in items_by_os.values() for item in items]
+
+def process_cve_data_by_os(cve_data, os_names=None, since=None):
+    # One pass over the feed for every requested OS; os_names=None keeps all products.
+    # since maps product -> releaseDate watermark, older records of that product are skipped
+    wanted = set(os_names) if os_names is not None else None
+    since = since or {}
+    processed_items = {os_name: {} for os_name in wanted or []}
     target_severities = ["Critical", "Important"]
 
     for item in cve_data:
         product = item.get('product', '')
         severity = item.get('severity', '')
 
-        if os_name_filter and product != os_name_filter:
+        if wanted is not None and product not in wanted:
             continue
         if severity not in target_severities:
             continue
+        if product in since and item.get('releaseDate', '') < since[product]:
+            continue
 
         try:
-            cve_number = item.get('cveNumber', '')
-            if not cve_number or not product:
+            db_item = build_cve_item(item)
+            if not db_item:
                 continue
 
-            pk = f"OS#{product}"
-            sk = f"CVE#{cve_number}"
-            unique_key = f"{pk}#{sk}"
-
-            release_date = item.get('releaseDate', '')
-            try:
-                parsed_date = datetime.fromisoformat(release_date.replace('Z', '+00:00'))
-                ttl = int((parsed_date + timedelta(days=365)).timestamp())
-            except:
-                ttl = int((datetime.utcnow() + timedelta(days=365)).timestamp())
-
-            kb = item.get('kbArticles', [{}])[0]
-            db_item = {
-                'PK': pk,
-                'SK': sk,
-                'GSI1PK': f"DATE#{parsed_date.strftime('%Y-%m')}",
-                'GSI1SK': f"CVE#{cve_number}",
-                'cveNumber': cve_number,
-                'product': product,
-                'severity': severity,
-                'impact': item.get('impact', ''),
-                'releaseDate': release_date,
-                'baseScore': item.get('baseScore', ''),
-                'temporalScore': item.get('temporalScore', ''),
-                'vectorString': item.get('vectorString', ''),
-                'cweList': item.get('cweList', []),
-                'architecture': item.get('architecture', ''),
-                'productFamily': item.get('productFamily', ''),
-                'kbArticle': kb.get('articleName', ''),
-                'kbUrl': kb.get('articleUrl', ''),
-                'downloadUrl': kb.get('downloadUrl', ''),
-                'rebootRequired': kb.get('rebootRequired', ''),
-                'fixedBuildNumber': kb.get('fixedBuildNumber', ''),
-                'supercedence': kb.get('supercedence', ''),
-                'TTL': ttl,
-                'lastUpdated': datetime.utcnow().isoformat() + 'Z'
-            }
-
-            processed_items[unique_key] = db_item
+            unique_key = f"{db_item['PK']}#{db_item['SK']}"
+            processed_items.setdefault(product, {})[unique_key] = db_item
 
         except Exception as e:
             logger.warning(f"Error processing CVE: {e}")
             continue
 
-    return list(processed_items.values())
+    return {product: list(items.values()) for product, items in processed_items.items()}
+
+def build_cve_item(item):
+    product = item.get('product', '')
+    cve_number = item.get('cveNumber', '')
+    if not cve_number or not product:
+        return None
+
+    release_date = item.get('releaseDate', '')
+    try:
+        parsed_date = datetime.fromisoformat(release_date.replace('Z', '+00:00'))
+        ttl = int((parsed_date + timedelta(days=365)).timestamp())
+    except:
+        ttl = int((datetime.utcnow() + timedelta(days=365)).timestamp())
+
+    kb = item.get('kbArticles', [{}])[0]
+    db_item = {
+        'PK': f"OS#{product}",
+        'SK': f"CVE#{cve_number}",
+        'GSI1PK': f"DATE#{parsed_date.strftime('%Y-%m')}",
+        'GSI1SK': f"CVE#{cve_number}",
+        'cveNumber': cve_number,
+        'product': product,
+        'severity': item.get('severity', ''),
+        'impact': item.get('impact', ''),
+        'releaseDate': release_date,
+        'baseScore': item.get('baseScore', ''),
+        'temporalScore': item.get('temporalScore', ''),
+        'vectorString': item.get('vectorString', ''),
+        'cweList': item.get('cweList', []),
+        'architecture': item.get('architecture', ''),
+        'productFamily': item.get('productFamily', ''),
+        'kbArticle': kb.get('articleName', ''),
+        'kbUrl': kb.get('articleUrl', ''),
+        'downloadUrl': kb.get('downloadUrl', ''),
+        'rebootRequired': kb.get('rebootRequired', ''),
+        'fixedBuildNumber': kb.get('fixedBuildNumber', ''),
+        'supercedence': kb.get('supercedence', ''),
+        'TTL': ttl,
+        'lastUpdated': datetime.utcnow().isoformat() + 'Z'
+    }
+    db_item['contentHash'] = content_hash(db_item)
+    return db_item
+
+def content_hash(db_item):
+    # lastUpdated changes on every run and must not count as a content change
+    content = {k: v for k, v in db_item.items() if k not in ('lastUpdated', 'contentHash')}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def filter_changed_items(items):
+    # BatchWriteItem cannot carry a ConditionExpression, so compare hashes with one batched read
+    stored = aws.batch_get(TABLE_NAME, [{'PK': item['PK'], 'SK': item['SK']} for item in items], 'PK, SK, contentHash')
+    stored_hashes = {(row['PK'], row['SK']): row.get('contentHash') for row in stored}
+    return [item for item in items if stored_hashes.get((item['PK'], item['SK'])) != item['contentHash']]
+
+def get_watermarks(os_names):
+    keys = [{'PK': f"SYNC#{os_name}", 'SK': 'WATERMARK'} for os_name in os_names]
+    rows = aws.batch_get(TABLE_NAME, keys, 'PK, releaseDate') if keys else []
+    return {row['PK'].replace('SYNC#', '', 1): row['releaseDate'] for row in rows if row.get('releaseDate')}
+
+def save_watermark(os_name, release_date):
+    table.put_item(Item={
+        'PK': f"SYNC#{os_name}",
+        'SK': 'WATERMARK',
+        'releaseDate': release_date,
+        'lastUpdated': datetime.utcnow().isoformat() + 'Z'
+    })
+
+def parse_release_date(release_date):
+    return datetime.fromisoformat(release_date.replace('Z', '+00:00')).replace(tzinfo=None)
+
+# BatchWriteItem accepts at most 25 put requests per call
+WRITE_BATCH_SIZE = 25
+WRITE_MAX_WORKERS = int(os.environ.get('DDB_WRITE_WORKERS', '8'))
+WRITE_MAX_RETRIES = 6
+THROTTLE_ERROR_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
 
 def save_to_dynamodb(items):
+    started = time.monotonic()
+    batches = [items[i:i + WRITE_BATCH_SIZE] for i in range(0, len(items), WRITE_BATCH_SIZE)]
+
     saved_count = 0
     error_count = 0
-    batch_size = 25
+    throttle_count = 0
+
+    if batches:
+        # The low-level client is thread-safe, the Table resource is not
+        with ThreadPoolExecutor(max_workers=min(WRITE_MAX_WORKERS, len(batches))) as executor:
+            for saved, errors, throttled in executor.map(write_batch, batches):
+                saved_count += saved
+                error_count += errors
+                throttle_count += throttled
+
+    elapsed = time.monotonic() - started
+    items_per_second = round(saved_count / elapsed, 1) if elapsed > 0 else float(saved_count)
+    logger.info(f"Saved {saved_count} item(s), {error_count} error(s), {throttle_count} throttle(s) "
+                f"in {elapsed:.2f}s ({items_per_second} items/s)")
+
+    return {
+        'saved': saved_count,
+        'errors': error_count,
+        'throttled': throttle_count,
+        'itemsPerSecond': items_per_second
+    }
+
+def write_batch(batch):
+    client = dynamodb.meta.client
+    pending = [{'PutRequest': {'Item': item}} for item in batch]
+    throttled = 0
+
+    for attempt in range(WRITE_MAX_RETRIES + 1):
+        try:
+            response = client.batch_write_item(RequestItems={TABLE_NAME: pending})
+            pending = response.get('UnprocessedItems', {}).get(TABLE_NAME, [])
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLE_ERROR_CODES:
+                logger.error(f"Error saving batch of {len(pending)} item(s): {e}")
+                break
+        if not pending:
+            break
+
+        # Unprocessed items are DynamoDB pushing back on capacity
+        throttled += 1
+        if attempt < WRITE_MAX_RETRIES:
+            time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
 
-    for i in range(0, len(items), batch_size):
-        batch = items[i:i + batch_size]
-        for item in batch:
+    if pending:
+        logger.error(f"Giving up on {len(pending)} unprocessed item(s) after {WRITE_MAX_RETRIES} retries")
+
+    return len(batch) - len(pending), len(pending), throttled
+
+def month_range(from_month, to_month):
+    # 'YYYY-MM' inclusive range -> [(label, start, end, complete)]; the current month ends now
+    # and is not complete until its last second has passed
+    now = datetime.utcnow()
+    year, month = map(int, from_month.split('-'))
+    last_year, last_month = map(int, to_month.split('-'))
+    months = []
+
+    while (year, month) <= (last_year, last_month):
+        start = datetime(year, month, 1)
+        next_start = datetime(year + month // 12, month % 12 + 1, 1)
+        month_end = next_start - timedelta(seconds=1)
+        end = min(month_end, now)
+        if start > now:
+            break
+        months.append((start.strftime('%Y-%m'), start, end, end == month_end))
+        year, month = next_start.year, next_start.month
+
+    return months
+
+def get_backfilled_os_names(month_label, month_end):
+    # Completion markers live next to the month's CVE rows in its GSI1 partition. A marker
+    # written before the month was over only covered part of it and does not count.
+    done = set()
+    kwargs = {
+        'IndexName': 'GSI1',
+        'KeyConditionExpression': aws.key('GSI1PK').eq(f"DATE#{month_label}") & aws.key('GSI1SK').begins_with('BACKFILL#'),
+        'ProjectionExpression': 'GSI1SK, completedAt'
+    }
+    while True:
+        response = table.query(**kwargs)
+        done.update(item['GSI1SK'].replace('BACKFILL#', '', 1) for item in response.get('Items', [])
+                    if item.get('completedAt', '') > month_end.isoformat())
+        if 'LastEvaluatedKey' not in response:
+            return done
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def save_backfill_marker(month_label, month_end, os_name, item_count):
+    table.put_item(Item={
+        'PK': f"SYNC#{os_name}",
+        'SK': f"BACKFILL#{month_label}",
+        'GSI1PK': f"DATE#{month_label}",
+        'GSI1SK': f"BACKFILL#{os_name}",
+        'product': os_name,
+        'itemCount': item_count,
+        'completedAt': datetime.utcnow().isoformat() + 'Z',
+        # Expire together with the month's CVE rows so a later rebuild is not skipped
+        'TTL': int((month_end + timedelta(days=365)).timestamp())
+    })
+
+def backfill_month(month_label, start_date, end_date, os_names, context, complete=True):
+    # The current month is read again on every backfill until it is over
+    done = get_backfilled_os_names(month_label, end_date) if complete else set()
+    pending = sorted(set(os_names) - done)
+    if not pending:
+        logger.info(f"[{month_label}] Already backfilled for {os_names}, skipping")
+        return {'month': month_label, 'status': 'SKIPPED'}
+
+    if context and context.get_remaining_time_in_millis() < BACKFILL_MIN_REMAINING_MS:
+        logger.info(f"[{month_label}] Not enough time left, deferring to the next run")
+        return {'month': month_label, 'status': 'DEFERRED', 'pending': pending}
+
+    fetch_stats = {'pages': 0, 'records': 0}
+    items_by_os = process_cve_data_by_os(iter_cve_records(start_date, end_date, fetch_stats), pending)
+
+    result = {'month': month_label, 'status': 'COMPLETED', 'totalFetched': fetch_stats['records'], 'os': {}}
+    if 'fetchError' in fetch_stats:
+        result['status'] = 'FAILED'
+        result['reason'] = fetch_stats['fetchError']
+    for os_name in pending:
+        items = items_by_os[os_name]
+        changed_items = filter_changed_items(items)
+        stats = save_to_dynamodb(changed_items)
+        stats['unchanged'] = len(items) - len(changed_items)
+        result['os'][os_name] = stats
+
+        # A month only counts as done for an OS when the whole feed was read and every write landed
+        if stats['errors'] != 0 or 'fetchError' in fetch_stats:
+            result['status'] = 'FAILED'
+        elif complete:
+            save_backfill_marker(month_label, end_date, os_name, len(items))
+
+    if not complete and result['status'] != 'FAILED':
+        # No marker for the current month: CVEs published later this month still have to be read
+        result['status'] = 'IN_PROGRESS'
+
+    logger.info(f"[{month_label}] Backfill {result['status']}: {result['os']}")
+    return result
+
+def backfill_handler(event, context):
+    from_month = event.get('fromMonth')
+    to_month = event.get('toMonth') or datetime.utcnow().strftime('%Y-%m')
+    if not from_month:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Missing fromMonth (YYYY-MM) in input'})}
+
+    # Onboarding a new OS can name it directly instead of going through instance tags
+    os_names = event.get('osNames') or sorted(set(get_os_names_for_instances(event.get('instanceIds', [])).values()))
+    if not os_names:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Missing osNames or tagged instanceIds in input'})}
+
+    months = month_range(from_month, to_month)
+    logger.info(f"Backfilling {len(months)} month(s) {from_month}..{to_month} for {os_names}")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(BACKFILL_MAX_WORKERS, len(months)))) as executor:
+        futures = [executor.submit(backfill_month, label, start, end, os_names, context, complete)
+                   for label, start, end, complete in months]
+        for (label, _, _, _), future in zip(months, futures):
             try:
-                table.put_item(Item=item)
-                saved_count += 1
+                results.append(future.result())
             except Exception as e:
-                logger.error(f"Error saving item: {e}")
-                error_count += 1
-                continue
+                logger.error(f"[{label}] Backfill failed: {e}")
+                results.append({'month': label, 'status': 'FAILED', 'reason': str(e)})
 
-    return saved_count, error_count
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'mode': 'backfill',
+            'osNames': os_names,
+            'months': results,
+            'remaining': [r['month'] for r in results if r['status'] in ('FAILED', 'DEFERRED', 'IN_PROGRESS')]
+        })
+    }
 
 def lambda_handler(event, context):
+    if event.get('mode') == 'backfill':
+        return backfill_handler(event, context)
+
     logger.info("=== START Lambda: update_cve_for_instances ===")
     instance_ids = event.get('instanceIds', [])
+    incremental = event.get('mode') == 'incremental'
 
     if not instance_ids:
         return {'statusCode': 400, 'body': json.dumps({'error': 'Missing instanceIds array in input'})}
@@ -169,46 +435,83 @@ def lambda_handler(event, context):
     start_date = datetime(now.year, now.month, 1)
     end_date = now
 
-    summary_list = []
-
-    for instance_id in instance_ids:
-        logger.info(f"Processing instance: {instance_id}")
+    # Step 1. Resolve every instance's OS tag up front and group instances by OS
+    os_by_instance = get_os_names_for_instances(instance_ids)
+    os_names = sorted(set(os_by_instance.values()))
+    logger.info(f"Resolved {len(os_by_instance)}/{len(instance_ids)} instances to {len(os_names)} OS: {os_names}")
+
+    # Incremental mode only asks MSRC for records at or after the oldest per-OS watermark
+    watermarks = get_watermarks(os_names)
+    since = {}
+    if incremental and os_names and all(os_name in watermarks for os_name in os_names):
+        since = {os_name: watermarks[os_name] for os_name in os_names}
+        start_date = min(parse_release_date(w) for w in since.values())
+    logger.info(f"Sync mode: {'incremental' if since else 'full'}, from {start_date.isoformat()}")
+
+    # Step 2. Stream the feed once and build items for every OS in one pass
+    fetch_stats = {'pages': 0, 'records': 0}
+    cve_records = iter_cve_records(start_date, end_date, fetch_stats) if os_names else []
+    items_by_os = process_cve_data_by_os(cve_records, os_names, since=since)
+
+    # Step 3. Save once per OS, not once per instance, and only rows whose content changed
+    os_results = {}
+    for os_name in os_names:
         try:
-            os_name = get_os_name_from_instance(instance_id)
-            if not os_name:
-                summary_list.append({
-                    'instanceId': instance_id,
-                    'status': 'FAILED',
-                    'reason': 'OS tag not found'
-                })
-                continue
-
-            cve_data = fetch_cve_data_for_month(start_date, end_date)
-            processed_items = process_cve_data(cve_data, os_name_filter=os_name)
-            saved_count, error_count = save_to_dynamodb(processed_items)
+            items = items_by_os[os_name]
+            changed_items = filter_changed_items(items)
+            os_results[os_name] = save_to_dynamodb(changed_items)
+            os_results[os_name]['unchanged'] = len(items) - len(changed_items)
+
+            # Advance the watermark only when this run covered it and every write landed
+            watermark = watermarks.get(os_name)
+            covered = 'fetchError' not in fetch_stats and (watermark is None or parse_release_date(watermark) >= start_date)
+            if items and covered and os_results[os_name]['errors'] == 0:
+                newest = max(item['releaseDate'] for item in items)
+                if watermark is None or newest > watermark:
+                    save_watermark(os_name, newest)
+        except Exception as e:
+            logger.error(f"Error saving CVE data for {os_name}: {e}")
+            os_results[os_name] = {'error': str(e)}
 
+    summary_list = []
+    for instance_id in instance_ids:
+        os_name = os_by_instance.get(instance_id)
+        if not os_name:
             summary_list.append({
                 'instanceId': instance_id,
-                'osName': os_name,
-                'totalFetched': len(cve_data),
-                'filteredProcessed': len(processed_items),
-                'savedToDynamoDB': saved_count,
-                'errors': error_count,
-                'status': 'COMPLETED'
+                'status': 'FAILED',
+                'reason': 'OS tag not found'
             })
+            continue
 
-        except Exception as e:
-            logger.error(f"Error processing instance {instance_id}: {e}")
+        os_result = os_results[os_name]
+        if 'error' in os_result:
             summary_list.append({
                 'instanceId': instance_id,
                 'status': 'FAILED',
-                'reason': str(e)
+                'reason': os_result['error']
             })
+            continue
+
+        summary_list.append({
+            'instanceId': instance_id,
+            'osName': os_name,
+            'totalFetched': fetch_stats['records'],
+            'filteredProcessed': len(items_by_os[os_name]),
+            'savedToDynamoDB': os_result['saved'],
+            'unchanged': os_result['unchanged'],
+            'errors': os_result['errors'],
+            'throttled': os_result['throttled'],
+            'itemsPerSecond': os_result['itemsPerSecond'],
+            'status': 'COMPLETED'
+        })
 
     return {
         'statusCode': 200,
         'body': json.dumps({
             'summary': summary_list,
+            'mode': 'incremental' if since else 'full',
+            'msrcPages': fetch_stats['pages'],
             'timeRange': {
                 'start': start_date.isoformat(),
                 'end': end_date.isoformat()
@@ -0,0 +1 @@
+"""Shared code for the AutoPatch Lambdas, deployed as the autopatch_common layer."""
@@ -0,0 +1,65 @@
+# Build-number applicability: a cumulative update is in a server once its OS build
+# (CurrentBuild.UBR) reaches the KB's fixedBuildNumber from vpbank-cve-data. Comparing builds
+# decides most KBs without running the Windows Update scan on the host.
+import re
+from bisect import bisect_right
+
+# Windows Server builds are 10.0.<CurrentBuild>.<UBR>
+BUILD_PREFIX = (10, 0)
+
+def parse_build(value):
+    # "10.0.17763.5329", "17763.5329" (inventory script) or "10.0.17763" (SSM PlatformVersion)
+    # -> ((10, 0, 17763, 5329), exact UBR known)
+    parts = [int(p) for p in re.findall(r"\d+", str(value or ""))]
+    if len(parts) == 2:
+        parts = list(BUILD_PREFIX) + parts
+    if len(parts) == 3 and tuple(parts[:2]) == BUILD_PREFIX:
+        return tuple(parts) + (0,), False
+    if len(parts) != 4:
+        return None, False
+    return tuple(parts), True
+
+class BuildCatalog:
+    def __init__(self, rows):
+        # Several CVE rows share a KB; the highest fixed build is the one that counts
+        fixed = {}
+        self.unknown = set()
+        for row in rows:
+            kb = str(row.get("kbArticle", "")).replace("KB", "")
+            build, exact = parse_build(row.get("fixedBuildNumber"))
+            if not kb:
+                continue
+            if not build or not exact:
+                self.unknown.add(kb)
+            elif kb not in fixed or build > fixed[kb]:
+                fixed[kb] = build
+        self.unknown -= set(fixed)
+
+        # Per CurrentBuild, KBs sorted by fixed build: one bisect splits fixed from the rest
+        self.by_branch = {}
+        for kb, build in sorted(fixed.items(), key=lambda kv: kv[1]):
+            builds, kbs = self.by_branch.setdefault(build[:3], ([], []))
+            builds.append(build)
+            kbs.append(kb)
+        self._cache = {}
+
+    def classify(self, build, exact):
+        # -> (fixed KBs, needed KBs, undecided KBs). With only a lower bound on the build
+        # (patched since the last scan, or PlatformVersion without UBR) nothing is "needed".
+        key = (build, exact)
+        if key in self._cache:
+            return self._cache[key]
+
+        fixed, needed, undecided = [], [], sorted(self.unknown)
+        for branch, (builds, kbs) in self.by_branch.items():
+            if branch != build[:3]:
+                # Fixed build on another servicing branch: nothing to compare against
+                undecided.extend(kbs)
+                continue
+            split = bisect_right(builds, build)
+            fixed.extend(kbs[:split])
+            (needed if exact else undecided).extend(kbs[split:])
+
+        # Servers on the same build share one result, so the fleet costs one bisect per distinct build
+        self._cache[key] = (fixed, needed, undecided)
+        return self._cache[key]
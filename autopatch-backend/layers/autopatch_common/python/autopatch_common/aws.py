@@ -0,0 +1,121 @@
+import os
+import random
+import threading
+import time
+
+# One tuned client per (service, options) for the life of the container, created on first use.
+# Retries back off adaptively under throttling; pools are sized for the thread pools in the
+# Lambdas and TCP keepalive lets warm invocations reuse their connections.
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+MAX_ATTEMPTS = int(os.environ.get("AWS_RETRY_MAX_ATTEMPTS", "5"))
+CONNECT_TIMEOUT = int(os.environ.get("AWS_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = int(os.environ.get("AWS_READ_TIMEOUT", "60"))
+
+# BatchGetItem accepts at most 100 keys per call
+READ_BATCH_SIZE = 100
+READ_MAX_RETRIES = 6
+
+_session = None
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+def client_config(**overrides):
+    from botocore.config import Config
+
+    options = {
+        "max_pool_connections": MAX_POOL_CONNECTIONS,
+        "tcp_keepalive": True,
+        "connect_timeout": CONNECT_TIMEOUT,
+        "read_timeout": READ_TIMEOUT,
+        "retries": {"mode": "adaptive", "max_attempts": MAX_ATTEMPTS}
+    }
+    options.update(overrides)
+    return Config(**options)
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                _session = boto3.session.Session()
+    return _session
+
+def get_client(service, **kwargs):
+    key = (service, tuple(sorted(kwargs.items())))
+    if key not in _clients:
+        session = get_session()
+        with _lock:
+            if key not in _clients:
+                _clients[key] = session.client(service, config=client_config(), **kwargs)
+    return _clients[key]
+
+def get_resource(service, **kwargs):
+    key = (service, tuple(sorted(kwargs.items())))
+    if key not in _resources:
+        session = get_session()
+        with _lock:
+            if key not in _resources:
+                _resources[key] = session.resource(service, config=client_config(), **kwargs)
+    return _resources[key]
+
+class _Lazy:
+    # Stands in for a module-level client/resource/table until first attribute access
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+
+    def __getattr__(self, name):
+        if self._target is None:
+            self._target = self._factory()
+        return getattr(self._target, name)
+
+def client(service, **kwargs):
+    return _Lazy(lambda: get_client(service, **kwargs))
+
+def resource(service, **kwargs):
+    return _Lazy(lambda: get_resource(service, **kwargs))
+
+def table(name):
+    return _Lazy(lambda: get_resource("dynamodb").Table(name))
+
+# boto3.dynamodb pulls in all of boto3 (~150 ms of cold start); these import it on first use only
+_deserializer = None
+
+def key(name):
+    from boto3.dynamodb.conditions import Key
+
+    return Key(name)
+
+def deserialize(value):
+    # One attribute of a DynamoDB Streams image ({"S": ...}, {"N": ...}, ...)
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+
+        _deserializer = TypeDeserializer()
+    return _deserializer.deserialize(value)
+
+def batch_get(table_name, keys, projection=None, names=None):
+    # Every item found for the keys, 100 per BatchGetItem. Unprocessed keys are retried with backoff
+    # and raise once retries run out, so a caller never takes an unread item for a missing one
+    client = get_resource("dynamodb").meta.client
+    found = []
+    for i in range(0, len(keys), READ_BATCH_SIZE):
+        request = {table_name: {"Keys": keys[i:i + READ_BATCH_SIZE]}}
+        if projection:
+            request[table_name]["ProjectionExpression"] = projection
+        if names:
+            request[table_name]["ExpressionAttributeNames"] = names
+        for attempt in range(READ_MAX_RETRIES + 1):
+            response = client.batch_get_item(RequestItems=request)
+            found.extend(response.get("Responses", {}).get(table_name, []))
+            request = response.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            if attempt < READ_MAX_RETRIES:
+                time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
+        if request:
+            raise Exception(f"Unprocessed keys left in {table_name} after {READ_MAX_RETRIES} retries")
+    return found
@@ -0,0 +1,82 @@
+# Per-instance KB inventory snapshots (PK INVENTORY#<id>, SK SNAPSHOT) in PatchProgress.
+# poll_get_KB_command_result stores every scan, get_target_instances_and_kbs reuses snapshots
+# younger than the max age (older ones still give the OS build), and any patch attempt marks
+# the snapshot stale via LastPatchedAt.
+# No UpdatedAt attribute, so snapshots stay out of the UpdatedAt GSI and the progress stream.
+import logging
+import os
+from datetime import datetime, timedelta
+from autopatch_common import aws
+
+logger = logging.getLogger()
+
+SNAPSHOT_SK = "SNAPSHOT"
+INVENTORY_MAX_AGE_MINUTES = int(os.environ.get("INVENTORY_MAX_AGE_MINUTES", "240"))
+SNAPSHOT_TTL_DAYS = 7
+
+def snapshot_key(instance_id):
+    return {"PK": f"INVENTORY#{instance_id}", "SK": SNAPSHOT_SK}
+
+def is_fresh(item, now, max_age_minutes):
+    if not is_live(item, now):
+        return False
+    scanned_at = item.get("ScannedAt", "")
+    if scanned_at < (now - timedelta(minutes=max_age_minutes)).isoformat():
+        return False
+    return not patched_since_scan(item)
+
+def patched_since_scan(item):
+    # Installed/available lists and the OS build no longer hold
+    return item.get("LastPatchedAt", "") >= item.get("ScannedAt", "")
+
+def is_live(item, now):
+    return bool(item) and int(item.get("TTL", 0)) > int(now.timestamp())
+
+class InventoryStore:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = aws.resource('dynamodb')
+        self.table = aws.table(table_name)
+
+    def get_snapshots(self, instance_ids):
+        # Every unexpired snapshot; callers decide with is_fresh what they can reuse
+        if not instance_ids:
+            return {}
+
+        now = datetime.utcnow()
+        snapshots = {}
+        for item in aws.batch_get(self.table_name, [snapshot_key(x) for x in instance_ids]):
+            if is_live(item, now):
+                snapshots[item["PK"].replace("INVENTORY#", "", 1)] = item
+
+        logger.info(f"Inventory snapshots: {len(snapshots)}/{len(instance_ids)} found")
+        return snapshots
+
+    def put(self, snapshots):
+        # snapshots: [{"InstanceId", "InstalledKBs", "AvailableKBs", "OsBuild", "CommandId"}]
+        now = datetime.utcnow()
+        ttl = int((now + timedelta(days=SNAPSHOT_TTL_DAYS)).timestamp())
+        with self.table.batch_writer() as batch:
+            for snapshot in snapshots:
+                item = dict(snapshot_key(snapshot["InstanceId"]),
+                            InstalledKBs=snapshot["InstalledKBs"],
+                            AvailableKBs=snapshot["AvailableKBs"],
+                            ScannedAt=now.isoformat(),
+                            TTL=ttl)
+                if snapshot.get("OsBuild"):
+                    item["OsBuild"] = snapshot["OsBuild"]
+                if snapshot.get("CommandId"):
+                    item["CommandId"] = snapshot["CommandId"]
+                batch.put_item(Item=item)
+
+    def mark_patched(self, instance_id):
+        try:
+            self.table.update_item(
+                Key=snapshot_key(instance_id),
+                UpdateExpression="SET LastPatchedAt = :p",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={":p": datetime.utcnow().isoformat()}
+            )
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # Never scanned, nothing to invalidate
+            pass
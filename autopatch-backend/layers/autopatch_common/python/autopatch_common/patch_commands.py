@@ -0,0 +1,207 @@
+# Run Command scripts and SendCommand calls shared by run_patch (Step Functions) and patch_engine.
+import os
+
+# Patch installs run under a copy of AWS-RunPowerShellScript, so the SSM status-change rule
+# (eventbridge/ssm_command_status_rule.json) fires only for them, not for inventory scans or downloads
+PATCH_DOCUMENT_NAME = os.environ.get("PATCH_DOCUMENT_NAME", "AutoPatch-RunPowerShellScript")
+POWERSHELL_SCRIPT = '''
+$kb = "{kb}"
+
+try {{
+    Install-WindowsUpdate -KBArticleID $kb -AcceptAll -IgnoreReboot -ErrorAction Stop -Verbose -Confirm:$false
+    Write-Output "PATCH_SUCCESS"
+
+    if (Test-Path "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WindowsUpdate\\Auto Update\\RebootRequired") {{
+        Write-Output "REBOOT_REQUIRED"
+    }}
+}} catch {{
+    Write-Error "PATCH_FAILED: $_"
+    exit 1
+}}
+'''
+
+# Batch mode: one Install-WindowsUpdate call for the whole KB list, one result line per KB:
+# KB_RESULT|<kb>|Success or Failed|REBOOT_REQUIRED or NO_REBOOT
+BATCH_POWERSHELL_SCRIPT = '''
+$kbs = @({kbs})
+$updates = @()
+
+try {{
+    $updates = @(Install-WindowsUpdate -KBArticleID $kbs -AcceptAll -IgnoreReboot -ErrorAction Stop -Verbose -Confirm:$false)
+}} catch {{
+    Write-Error "PATCH_FAILED: $_"
+}}
+
+$rebootPending = Test-Path "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WindowsUpdate\\Auto Update\\RebootRequired"
+
+foreach ($kb in $kbs) {{
+    $id = $kb -replace '^KB', ''
+    $update = $updates | Where-Object {{ $_.KB -eq "KB$id" }} | Select-Object -Last 1
+    $status = if ($update -and $update.Result -eq 'Installed') {{ 'Success' }} else {{ 'Failed' }}
+    $reboot = if ($status -eq 'Success' -and ($update.RebootRequired -or ($update.RebootRequired -eq $null -and $rebootPending))) {{ 'REBOOT_REQUIRED' }} else {{ 'NO_REBOOT' }}
+    Write-Output "KB_RESULT|$id|$status|$reboot"
+}}
+'''
+
+# Staged KBs (downloaded by prestage_updates): install from the local Windows Update cache with
+# an offline search, so the window only pays for the install. A KB missing from the cache
+# (cleaned up since staging) falls back to Install-WindowsUpdate. Same output as POWERSHELL_SCRIPT.
+INSTALL_ONLY_POWERSHELL_SCRIPT = '''
+$kb = "{kb}"
+$id = $kb -replace '^KB', ''
+
+try {{
+    $session = New-Object -ComObject Microsoft.Update.Session
+    $searcher = $session.CreateUpdateSearcher()
+    $searcher.Online = $false
+    $updates = New-Object -ComObject Microsoft.Update.UpdateColl
+    foreach ($update in $searcher.Search("IsInstalled=0 and IsHidden=0").Updates) {{
+        if ($update.IsDownloaded -and $update.KBArticleIDs -contains $id) {{
+            if (-not $update.EulaAccepted) {{ $update.AcceptEula() }}
+            [void]$updates.Add($update)
+        }}
+    }}
+
+    if ($updates.Count -gt 0) {{
+        $installer = $session.CreateUpdateInstaller()
+        $installer.Updates = $updates
+        $result = $installer.Install()
+        if ($result.ResultCode -ne 2) {{ throw "Install from cache returned result code $($result.ResultCode)" }}
+    }} else {{
+        Install-WindowsUpdate -KBArticleID $kb -AcceptAll -IgnoreReboot -ErrorAction Stop -Verbose -Confirm:$false
+    }}
+    Write-Output "PATCH_SUCCESS"
+
+    if (Test-Path "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WindowsUpdate\\Auto Update\\RebootRequired") {{
+        Write-Output "REBOOT_REQUIRED"
+    }}
+}} catch {{
+    Write-Error "PATCH_FAILED: $_"
+    exit 1
+}}
+'''
+
+# Batch mode for staged KBs: one UpdateInstaller call for everything in the cache, then
+# Install-WindowsUpdate for the rest. Same KB_RESULT lines as BATCH_POWERSHELL_SCRIPT.
+BATCH_INSTALL_ONLY_POWERSHELL_SCRIPT = '''
+$kbs = @({kbs})
+$ids = @($kbs | ForEach-Object {{ $_ -replace '^KB', '' }})
+$cached = @{{}}
+$updates = @()
+
+try {{
+    $session = New-Object -ComObject Microsoft.Update.Session
+    $searcher = $session.CreateUpdateSearcher()
+    $searcher.Online = $false
+    $staged = New-Object -ComObject Microsoft.Update.UpdateColl
+    $stagedIds = @()
+    foreach ($update in $searcher.Search("IsInstalled=0 and IsHidden=0").Updates) {{
+        $id = @($update.KBArticleIDs | Where-Object {{ $ids -contains $_ }}) | Select-Object -First 1
+        if ($update.IsDownloaded -and $id) {{
+            if (-not $update.EulaAccepted) {{ $update.AcceptEula() }}
+            [void]$staged.Add($update)
+            $stagedIds += $id
+        }}
+    }}
+
+    if ($staged.Count -gt 0) {{
+        $installer = $session.CreateUpdateInstaller()
+        $installer.Updates = $staged
+        $result = $installer.Install()
+        for ($i = 0; $i -lt $staged.Count; $i++) {{
+            $updateResult = $result.GetUpdateResult($i)
+            $cached[$stagedIds[$i]] = @(($updateResult.ResultCode -eq 2), $updateResult.RebootRequired)
+        }}
+    }}
+
+    $rest = @($ids | Where-Object {{ -not $cached.ContainsKey($_) }} | ForEach-Object {{ "KB$_" }})
+    if ($rest.Count -gt 0) {{
+        $updates = @(Install-WindowsUpdate -KBArticleID $rest -AcceptAll -IgnoreReboot -ErrorAction Stop -Verbose -Confirm:$false)
+    }}
+}} catch {{
+    Write-Error "PATCH_FAILED: $_"
+}}
+
+$rebootPending = Test-Path "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WindowsUpdate\\Auto Update\\RebootRequired"
+
+foreach ($id in $ids) {{
+    if ($cached.ContainsKey($id)) {{
+        $status = if ($cached[$id][0]) {{ 'Success' }} else {{ 'Failed' }}
+        $reboot = if ($cached[$id][0] -and $cached[$id][1]) {{ 'REBOOT_REQUIRED' }} else {{ 'NO_REBOOT' }}
+    }} else {{
+        $update = $updates | Where-Object {{ $_.KB -eq "KB$id" }} | Select-Object -Last 1
+        $status = if ($update -and $update.Result -eq 'Installed') {{ 'Success' }} else {{ 'Failed' }}
+        $reboot = if ($status -eq 'Success' -and ($update.RebootRequired -or ($update.RebootRequired -eq $null -and $rebootPending))) {{ 'REBOOT_REQUIRED' }} else {{ 'NO_REBOOT' }}
+    }}
+    Write-Output "KB_RESULT|$id|$status|$reboot"
+}}
+'''
+
+# Pre-stage: download only, ahead of the window. The offline search afterwards reports what
+# is really in the cache, one line per KB: STAGE_RESULT|<kb>|Staged or Failed
+DOWNLOAD_POWERSHELL_SCRIPT = '''
+$kbs = @({kbs})
+
+try {{
+    Get-WindowsUpdate -KBArticleID $kbs -Download -AcceptAll -ErrorAction Stop -Verbose -Confirm:$false | Out-Null
+}} catch {{
+    Write-Error "DOWNLOAD_FAILED: $_"
+}}
+
+$searcher = (New-Object -ComObject Microsoft.Update.Session).CreateUpdateSearcher()
+$searcher.Online = $false
+$downloaded = @()
+foreach ($update in $searcher.Search("IsInstalled=0 and IsHidden=0").Updates) {{
+    if ($update.IsDownloaded) {{ $downloaded += @($update.KBArticleIDs) }}
+}}
+
+foreach ($kb in $kbs) {{
+    $id = $kb -replace '^KB', ''
+    $status = if ($downloaded -contains $id) {{ 'Staged' }} else {{ 'Failed' }}
+    Write-Output "STAGE_RESULT|$id|$status"
+}}
+'''
+
+# Long KB lists need more than the document's default execution timeout
+BATCH_EXECUTION_TIMEOUT = 7200
+# Time SSM allows for delivering a command to the instance
+DELIVERY_TIMEOUT = 900
+# A download still not finished after this is never coming back
+DOWNLOAD_TIMEOUT_SECONDS = DELIVERY_TIMEOUT + BATCH_EXECUTION_TIMEOUT
+
+def send_patch(ssm, instance_id, kb, staged=False):
+    script = INSTALL_ONLY_POWERSHELL_SCRIPT if staged else POWERSHELL_SCRIPT
+    response = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName=PATCH_DOCUMENT_NAME,
+        Parameters={'commands': [script.format(kb=kb)]},
+        TimeoutSeconds=DELIVERY_TIMEOUT,
+    )
+    return response['Command']['CommandId']
+
+def send_patch_batch(ssm, instance_id, kbs, staged=False):
+    template = BATCH_INSTALL_ONLY_POWERSHELL_SCRIPT if staged else BATCH_POWERSHELL_SCRIPT
+    script = template.format(kbs=", ".join(f'"{kb}"' for kb in kbs))
+    response = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName=PATCH_DOCUMENT_NAME,
+        Parameters={
+            'commands': [script],
+            'executionTimeout': [str(BATCH_EXECUTION_TIMEOUT)]
+        },
+        TimeoutSeconds=DELIVERY_TIMEOUT,
+    )
+    return response['Command']['CommandId']
+
+def send_download(ssm, instance_id, kbs):
+    script = DOWNLOAD_POWERSHELL_SCRIPT.format(kbs=", ".join(f'"{kb}"' for kb in kbs))
+    response = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunPowerShellScript",
+        Parameters={
+            'commands': [script],
+            'executionTimeout': [str(BATCH_EXECUTION_TIMEOUT)]
+        },
+        TimeoutSeconds=DELIVERY_TIMEOUT,
+    )
+    return response['Command']['CommandId']
@@ -0,0 +1,73 @@
+# Wave plan and per-server results of one patch execution (PK RUN#<execution name>) in
+# PatchProgress, so the Step Functions state only carries the current wave and the counters:
+#   SK WAVE#<wave>#<position>  one server of a planned wave, written by schedule_patch_waves plan
+#   SK RESULT#<instance>       the server once its wave is done (or halted), with its KB results
+# summarize_SNS reads the RESULT# rows. Same key per server, so a retried Lambda just overwrites.
+# No UpdatedAt attribute and outside the PATCH# prefix, so stream and GSI ignore these rows.
+# Servers are stored as JSON strings: no float/Decimal conversion on the way in or out.
+import json
+import logging
+from datetime import datetime, timedelta
+from autopatch_common import aws
+
+logger = logging.getLogger()
+
+RUN_TTL_DAYS = 7
+
+def run_pk(run_id):
+    return f"RUN#{run_id}"
+
+def wave_prefix(wave_number):
+    return f"WAVE#{wave_number:04d}#"
+
+class PatchRunStore:
+    def __init__(self, table_name):
+        self.table = aws.table(table_name)
+
+    def ttl(self):
+        return int((datetime.utcnow() + timedelta(days=RUN_TTL_DAYS)).timestamp())
+
+    def save_waves(self, run_id, waves, first_wave=1):
+        ttl = self.ttl()
+        with self.table.batch_writer() as batch:
+            for number, wave in enumerate(waves, first_wave):
+                for position, server in enumerate(wave):
+                    batch.put_item(Item={
+                        "PK": run_pk(run_id),
+                        "SK": f"{wave_prefix(number)}{position:05d}",
+                        "Server": json.dumps(server),
+                        "TTL": ttl
+                    })
+
+    def get_wave(self, run_id, wave_number):
+        items = self.query(run_id, wave_prefix(wave_number))
+        return [json.loads(item["Server"]) for item in items]
+
+    def save_results(self, run_id, servers, overviews):
+        ttl = self.ttl()
+        overviews = list(overviews) + [[]] * (len(servers) - len(overviews))
+        with self.table.batch_writer() as batch:
+            for server, overview in zip(servers, overviews):
+                batch.put_item(Item={
+                    "PK": run_pk(run_id),
+                    "SK": f"RESULT#{server.get('InstanceId', 'Unknown')}",
+                    "Server": json.dumps(server),
+                    "Overview": json.dumps(overview or []),
+                    "TTL": ttl
+                })
+
+    def get_results(self, run_id):
+        # -> (servers, overviews) in instance order, the shape summarize_SNS prints
+        items = self.query(run_id, "RESULT#")
+        return [json.loads(item["Server"]) for item in items], [json.loads(item.get("Overview", "[]")) for item in items]
+
+    def query(self, run_id, prefix):
+
+        kwargs = {"KeyConditionExpression": aws.key("PK").eq(run_pk(run_id)) & aws.key("SK").begins_with(prefix)}
+        items = []
+        while True:
+            response = self.table.query(**kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
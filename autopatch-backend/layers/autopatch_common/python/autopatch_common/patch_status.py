@@ -0,0 +1,286 @@
+# PatchProgress status writes shared by update_patch_status (Step Functions) and patch_engine.
+# Every write also moves the per-instance progress summary (PK PATCH#<id>, SK PROGRESS), which keeps
+# the last status of each KB next to the Total/Completed counters.
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from autopatch_common import aws
+from autopatch_common.inventory import InventoryStore
+from autopatch_common.reboots import RebootStore
+
+logger = logging.getLogger()
+
+# Bulk mode: 25 puts per BatchWriteItem, batches spread over a small thread pool
+WRITE_BATCH_SIZE = 25
+WRITE_MAX_WORKERS = int(os.environ.get('DDB_WRITE_WORKERS', '8'))
+WRITE_MAX_RETRIES = 6
+
+STATUS_TTL_MINUTES = 5
+PROGRESS_SK = "PROGRESS"
+# The summary outlives a whole patch run (a single KB install can take far longer than the status
+# rows live); every write pushes it out again, so it only expires once the server has gone quiet
+PROGRESS_TTL_HOURS = 24
+COMPLETED_STATUSES = ["Success", "Already Installed", "Failed", "Not Available", "Superseded", "Deferred"]
+# A KB entering these statuses means a patch attempt, which makes the inventory snapshot stale
+PATCHING_STATUSES = ["Pending", "InProgress"]
+
+def expand_records(event):
+    # Records inherit a top-level InstanceId; StatusGroups expand {Status, KBs} into records
+    default_instance = event.get("InstanceId")
+    records = [dict(r) for r in event.get("Records") or []]
+
+    for group in event.get("StatusGroups") or []:
+        for kb in group.get("KBs") or []:
+            if isinstance(kb, dict):
+                records.append({
+                    "KB": kb.get("KB"),
+                    "Status": kb.get("Status") or kb.get("status") or group.get("Status"),
+                    "RebootRequired": kb.get("RebootRequired", False)
+                })
+            else:
+                records.append({"KB": kb, "Status": group.get("Status")})
+
+    for record in records:
+        record.setdefault("InstanceId", default_instance)
+        record.setdefault("RebootRequired", False)
+    return records
+
+class PatchStatusWriter:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = aws.resource('dynamodb')
+        self.table = aws.table(table_name)
+        self.inventory = InventoryStore(table_name)
+        self.reboots = RebootStore(table_name)
+
+    def update_one(self, instance_id, kb, status, reboot_required=False):
+        now = datetime.utcnow()
+        ttl = int((now + timedelta(minutes=STATUS_TTL_MINUTES)).timestamp())
+
+        try:
+            logger.info(f"Updating patch status: InstanceId={instance_id}, KB={kb}, Status={status}, TTL={ttl}")
+            self.table.update_item(
+                Key={
+                    "PK": f"PATCH#{instance_id}",
+                    "SK": f"KB#{kb}"
+                },
+                UpdateExpression="SET #s = :s, UpdatedAt = :u, #ttl = :ttl, RebootRequired = :r",
+                ExpressionAttributeNames={
+                    "#s": "Status",
+                    "#ttl": "TTL"
+                },
+                ExpressionAttributeValues={
+                    ":s": status,
+                    ":u": now.isoformat(),
+                    ":ttl": ttl,
+                    ":r": reboot_required
+                }
+            )
+            changes = self.update_progress(instance_id, {str(kb): status}, now)
+            self.invalidate_inventory(instance_id, changes)
+            if status == "Success" and reboot_required:
+                self.record_reboot(instance_id, [kb])
+
+            logger.info(f"Patch status updated successfully: {instance_id} | {kb} -> {status}")
+            return {
+                "status": "ok",
+                "InstanceId": instance_id,
+                "KB": kb,
+                "newStatus": status
+            }
+
+        except Exception as e:
+            logger.error(f"Error updating patch status for {instance_id} | {kb}: {str(e)}")
+            return {
+                "status": "error",
+                "message": str(e)
+            }
+
+    def update_bulk(self, records):
+        now = datetime.utcnow()
+        ttl = int((now + timedelta(minutes=STATUS_TTL_MINUTES)).timestamp())
+
+        outcomes = []
+        items = {}
+        for record in records:
+            instance_id, kb, status = record.get("InstanceId"), record.get("KB"), record.get("Status")
+            if not instance_id or not kb or not status:
+                outcomes.append({"status": "error", "InstanceId": instance_id, "KB": kb,
+                                 "message": "Missing required fields"})
+                continue
+
+            # One batch cannot hold the same key twice; the last record for a KB wins
+            items[(instance_id, str(kb))] = {
+                "PK": f"PATCH#{instance_id}",
+                "SK": f"KB#{kb}",
+                "Status": status,
+                "UpdatedAt": now.isoformat(),
+                "TTL": ttl,
+                "RebootRequired": record.get("RebootRequired", False)
+            }
+
+        item_list = list(items.values())
+        batches = [item_list[i:i + WRITE_BATCH_SIZE] for i in range(0, len(item_list), WRITE_BATCH_SIZE)]
+        logger.info(f"Bulk updating {len(item_list)} status row(s) in {len(batches)} batch(es)")
+
+        # One pool for the batches and then the per-server follow-ups; a single batch for a single
+        # server (patch_engine) stays on the calling thread
+        pool_size = min(WRITE_MAX_WORKERS, max(len(batches), len({item["PK"] for item in item_list})))
+        with ThreadPoolExecutor(max_workers=pool_size) if pool_size > 1 else nullcontext() as executor:
+            run = executor.map if executor else map
+            for batch_outcomes in run(self.write_batch, batches):
+                outcomes.extend(batch_outcomes)
+
+            # Only rows that were actually written move the counters
+            transitions = {}
+            reboot_kbs = {}
+            for outcome in outcomes:
+                if outcome["status"] == "ok":
+                    transitions.setdefault(outcome["InstanceId"], {})[outcome["KB"]] = outcome["newStatus"]
+                    if outcome["newStatus"] == "Success" and items[(outcome["InstanceId"], outcome["KB"])]["RebootRequired"]:
+                        reboot_kbs.setdefault(outcome["InstanceId"], []).append(outcome["KB"])
+
+            # Summaries, inventory snapshots and reboot records are per server, so they go out in parallel too
+            list(run(lambda instance_id: self.finish_instance(instance_id, transitions[instance_id],
+                                                                       reboot_kbs.get(instance_id), now),
+                              transitions))
+
+        failed = sum(1 for o in outcomes if o["status"] != "ok")
+        logger.info(f"Bulk update done: {len(outcomes) - failed} ok, {failed} failed")
+        return {
+            "status": "ok" if not failed else "error",
+            "updated": len(outcomes) - failed,
+            "failed": failed,
+            "results": outcomes
+        }
+
+    def finish_instance(self, instance_id, statuses, reboot_kbs, now):
+        self.invalidate_inventory(instance_id, self.update_progress(instance_id, statuses, now))
+        if reboot_kbs:
+            self.record_reboot(instance_id, reboot_kbs)
+
+    def write_batch(self, batch):
+        client = self.dynamodb.meta.client
+        pending = [{"PutRequest": {"Item": item}} for item in batch]
+        error = None
+
+        for attempt in range(WRITE_MAX_RETRIES + 1):
+            try:
+                response = client.batch_write_item(RequestItems={self.table_name: pending})
+                pending = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                error = "Unprocessed after retries" if pending else None
+            except Exception as e:
+                logger.error(f"Error writing status batch: {str(e)}")
+                error = str(e)
+                break
+            if not pending:
+                break
+            if attempt < WRITE_MAX_RETRIES:
+                time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
+
+        failed_keys = {(r["PutRequest"]["Item"]["PK"], r["PutRequest"]["Item"]["SK"]) for r in pending}
+        outcomes = []
+        for item in batch:
+            outcome = {
+                "status": "error" if (item["PK"], item["SK"]) in failed_keys else "ok",
+                "InstanceId": item["PK"].replace("PATCH#", "", 1),
+                "KB": item["SK"].replace("KB#", "", 1),
+                "newStatus": item["Status"]
+            }
+            if outcome["status"] == "error":
+                outcome["message"] = error
+            outcomes.append(outcome)
+        return outcomes
+
+    def invalidate_inventory(self, instance_id, changes):
+        # Once per patch attempt: MarkInProgress after MarkInitialStatuses (Pending) is the same attempt
+        if not any(new_status in PATCHING_STATUSES and old_status != "Pending" for old_status, new_status in changes):
+            return
+        try:
+            self.inventory.mark_patched(instance_id)
+        except Exception as e:
+            logger.error(f"Error marking inventory snapshot stale for {instance_id}: {str(e)}")
+
+    def record_reboot(self, instance_id, kbs):
+        # Read by reboot_orchestrator after the wave; a lost write only means no automatic reboot
+        try:
+            self.reboots.mark_pending(instance_id, kbs)
+        except Exception as e:
+            logger.error(f"Error recording pending reboot for {instance_id}: {str(e)}")
+
+    def update_progress(self, instance_id, statuses, now):
+        # statuses: {KB: new status}. Returns [(previous status or None, new status)].
+        key = {"PK": f"PATCH#{instance_id}", "SK": PROGRESS_SK}
+        try:
+            previous = self.swap_statuses(key, statuses, now)
+            if previous is not None:
+                total_delta = sum(1 for kb in statuses if kb not in previous)
+                completed_delta = sum(int(status in COMPLETED_STATUSES) - int(previous.get(kb) in COMPLETED_STATUSES)
+                                      for kb, status in statuses.items())
+                if total_delta or completed_delta:
+                    self.add_counts(key, total_delta, completed_delta)
+        except Exception as e:
+            logger.error(f"Error updating progress summary for {instance_id}: {str(e)}")
+            previous = None
+        return [((previous or {}).get(kb), status) for kb, status in statuses.items()]
+
+    def swap_statuses(self, key, statuses, now):
+        # UPDATED_OLD hands each KB's previous status to exactly one writer, so concurrent updates never
+        # count a transition twice, and a KB row gone to its 5-minute TTL is still known as seen.
+        # Returns None when the summary was (re)created with the counters already set.
+        ttl = int((now + timedelta(hours=PROGRESS_TTL_HOURS)).timestamp())
+        names = {"#m": "Statuses", "#ttl": "TTL"}
+        values = {":ttl": ttl, ":now": int(now.timestamp()), ":u": now.isoformat()}
+        assignments = []
+        for n, (kb, status) in enumerate(statuses.items()):
+            names[f"#k{n}"] = kb
+            values[f":s{n}"] = status
+            assignments.append(f"#m.#k{n} = :s{n}")
+
+        conditional_check_failed = self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException
+        for attempt in range(2):
+            try:
+                # No UpdatedAt on the summary so it stays out of the UpdatedAt GSI; ChangedAt is the
+                # marker get_patch_status builds its ETag from
+                response = self.table.update_item(
+                    Key=key,
+                    UpdateExpression=f"SET {', '.join(assignments)}, #ttl = :ttl, ChangedAt = :u",
+                    ConditionExpression="attribute_exists(#m) AND #ttl > :now",
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values,
+                    ReturnValues="UPDATED_OLD"
+                )
+                return response.get("Attributes", {}).get("Statuses", {})
+            except conditional_check_failed:
+                pass
+            try:
+                # Missing summary, or one expired after a day without writes: no run is using it any more
+                self.table.put_item(
+                    Item=dict(key, Statuses=dict(statuses), Total=len(statuses),
+                              Completed=sum(1 for status in statuses.values() if status in COMPLETED_STATUSES),
+                              ChangedAt=values[":u"], TTL=ttl),
+                    ConditionExpression="attribute_not_exists(#m) OR #ttl <= :now",
+                    ExpressionAttributeNames={"#m": "Statuses", "#ttl": "TTL"},
+                    ExpressionAttributeValues={":now": values[":now"]}
+                )
+                return None
+            except conditional_check_failed:
+                # Another writer created it first; set the statuses on that one
+                continue
+        raise Exception("Progress summary kept changing while updating it")
+
+    def add_counts(self, key, total_delta, completed_delta):
+        try:
+            self.table.update_item(
+                Key=key,
+                UpdateExpression="ADD Total :t, Completed :c",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={":t": total_delta, ":c": completed_delta}
+            )
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # Deleted by TTL in between; the next write starts a new summary
+            pass
@@ -0,0 +1,42 @@
+# Pending reboots (PK REBOOT#<id>, SK PENDING) in PatchProgress. PatchStatusWriter adds every KB
+# that succeeded with RebootRequired; reboot_orchestrator reboots the server once after its last
+# KB and clears the item. Outlives the 5-minute status rows, and stays out of the PATCH# stream.
+import logging
+from datetime import datetime, timedelta
+from autopatch_common import aws
+
+logger = logging.getLogger()
+
+PENDING_SK = "PENDING"
+REBOOT_TTL_HOURS = 24
+
+def reboot_key(instance_id):
+    return {"PK": f"REBOOT#{instance_id}", "SK": PENDING_SK}
+
+class RebootStore:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.table = aws.table(table_name)
+
+    def mark_pending(self, instance_id, kbs):
+        ttl = int((datetime.utcnow() + timedelta(hours=REBOOT_TTL_HOURS)).timestamp())
+        self.table.update_item(
+            Key=reboot_key(instance_id),
+            UpdateExpression="SET #ttl = :ttl ADD KBs :kbs",
+            ExpressionAttributeNames={"#ttl": "TTL"},
+            ExpressionAttributeValues={":ttl": ttl, ":kbs": {str(kb) for kb in kbs}}
+        )
+
+    def get_pending(self, instance_ids):
+        # {instance_id: [KBs waiting for the reboot]} for the servers that need one
+        now = int(datetime.utcnow().timestamp())
+        pending = {}
+        for item in aws.batch_get(self.table_name, [reboot_key(x) for x in instance_ids]):
+            if int(item.get("TTL", 0)) > now:
+                pending[item["PK"].replace("REBOOT#", "", 1)] = sorted(item.get("KBs", []))
+        return pending
+
+    def clear(self, instance_ids):
+        with self.table.batch_writer() as batch:
+            for instance_id in instance_ids:
+                batch.delete_item(Key=reboot_key(instance_id))
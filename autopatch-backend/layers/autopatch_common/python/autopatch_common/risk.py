@@ -0,0 +1,57 @@
+# KB risk from the vpbank-cve-data rows: every KB takes the worst CVE it fixes
+# (severity, then CVSS baseScore, then impact). get_target_instances_and_kbs orders KB lists
+# with it so installs close the most dangerous exposure first. A KB that supersedes others also
+# takes their risk: the older KBs are skipped and it is the one that closes their CVEs.
+
+SEVERITY_RANK = {"Critical": 4, "Important": 3, "Moderate": 2, "Low": 1}
+IMPACT_RANK = {
+    "Remote Code Execution": 5,
+    "Elevation of Privilege": 4,
+    "Security Feature Bypass": 3,
+    "Information Disclosure": 2,
+    "Denial of Service": 2,
+    "Spoofing": 1,
+    "Tampering": 1
+}
+
+# Never deferred to a later window, whatever the deadline (time-to-remediate SLA)
+CRITICAL_SEVERITY = "Critical"
+
+def cve_risk(row):
+    try:
+        base_score = float(row.get("baseScore") or 0)
+    except (TypeError, ValueError):
+        base_score = 0.0
+    return (SEVERITY_RANK.get(row.get("severity"), 0), base_score, IMPACT_RANK.get(row.get("impact"), 0))
+
+class RiskIndex:
+    def __init__(self, rows, supersedence=None):
+        self.risk = {}
+        self.severity = {}
+        for row in rows:
+            kb = str(row.get("kbArticle", "")).replace("KB", "")
+            if not kb:
+                continue
+            risk = cve_risk(row)
+            if kb not in self.risk or risk > self.risk[kb]:
+                self.risk[kb] = risk
+                self.severity[kb] = row.get("severity", "")
+        if supersedence:
+            self.inherit(supersedence)
+
+    def inherit(self, supersedence):
+        # replaced_by is transitive, so one pass over the KBs' own risk is enough
+        own, own_severity = dict(self.risk), dict(self.severity)
+        for kb in own:
+            for old_kb in supersedence.replaced_by(kb):
+                if old_kb in own and own[old_kb] > self.risk[kb]:
+                    self.risk[kb] = own[old_kb]
+                    self.severity[kb] = own_severity[old_kb]
+
+    def order(self, kbs):
+        # Highest risk first; newer KB first on ties so cumulative updates lead
+        return sorted(kbs, key=lambda kb: (self.risk.get(str(kb).replace("KB", ""), (0, 0.0, 0)), str(kb)),
+                      reverse=True)
+
+    def critical(self, kbs):
+        return [kb for kb in kbs if self.severity.get(str(kb).replace("KB", "")) == CRITICAL_SEVERITY]
@@ -0,0 +1,82 @@
+# Turn a finished run_patch command invocation into the PollResult the patch flows expect.
+# Shared by poll_command_status (polling), ssm_command_callback (EventBridge push) and patch_engine.
+PENDING_STATUSES = ["InProgress", "Pending", "Delayed"]
+
+def poll_patch_result(ssm, command_id, instance_id, kbs=None):
+    response = ssm.get_command_invocation(
+        CommandId=command_id,
+        InstanceId=instance_id,
+        PluginName='aws:runPowerShellScript'
+    )
+    if response.get("Status") in PENDING_STATUSES:
+        return response, {
+            "Status": "InProgress",
+            "RebootRequired": False,
+            "Output": response.get("StandardOutputContent", "").strip(),
+            "ErrorOutput": response.get("StandardErrorContent", "").strip()
+        }
+    return response, build_patch_result(response, instance_id, kbs)
+
+def build_patch_result(invocation, instance_id, kbs=None):
+    stdout = invocation.get("StandardOutputContent", "")
+    stderr = invocation.get("StandardErrorContent", "")
+
+    if kbs:
+        result = {
+            "ExitCode": invocation.get("ResponseCode"),
+            "Output": stdout.strip(),
+            "ErrorOutput": stderr.strip()
+        }
+        return with_kb_results(result, instance_id, kbs, stdout)
+
+    if "PATCH_SUCCESS" in stdout:
+        return {
+            "Status": "Success",
+            "RebootRequired": "REBOOT_REQUIRED" in stdout,
+            "Output": stdout.strip(),
+            "ErrorOutput": stderr.strip()
+        }
+    return {
+        "Status": "Failed",
+        "ExitCode": invocation.get("ResponseCode"),
+        "Output": stdout.strip(),
+        "ErrorOutput": stderr.strip()
+    }
+
+def parse_kb_results(stdout):
+    # KB_RESULT|<kb>|Success or Failed|REBOOT_REQUIRED or NO_REBOOT, printed by run_patch batch mode
+    parsed = {}
+    for line in stdout.splitlines():
+        parts = [p.strip() for p in line.strip().split("|")]
+        if len(parts) == 4 and parts[0] == "KB_RESULT":
+            parsed[parts[1].replace("KB", "")] = (parts[2], parts[3] == "REBOOT_REQUIRED")
+    return parsed
+
+def with_kb_results(result, instance_id, kbs, stdout=""):
+    # KBs without a result line (install threw, command failed) are reported as Failed
+    parsed = parse_kb_results(stdout)
+    results = []
+    for kb in kbs:
+        status, reboot_required = parsed.get(str(kb).replace("KB", ""), ("Failed", False))
+        results.append({
+            "InstanceId": instance_id,
+            "KB": kb,
+            "Status": "Success" if status == "Success" else "Failed",
+            "RebootRequired": reboot_required
+        })
+
+    result.update({
+        "Status": "Success" if all(r["Status"] == "Success" for r in results) else "Failed",
+        "RebootRequired": any(r["RebootRequired"] for r in results),
+        "Results": results
+    })
+    return result
+
+def parse_stage_results(stdout):
+    # STAGE_RESULT|<kb>|Staged or Failed, printed by the prestage_updates download script
+    staged, failed = [], []
+    for line in stdout.splitlines():
+        parts = [p.strip() for p in line.strip().split("|")]
+        if len(parts) == 3 and parts[0] == "STAGE_RESULT":
+            (staged if parts[2] == "Staged" else failed).append(parts[1].replace("KB", ""))
+    return staged, failed
@@ -0,0 +1,40 @@
+# Pre-staged downloads (PK STAGE#<id>, SK STAGED) in PatchProgress. prestage_updates adds every
+# KB its download-only run left in the server's Windows Update cache; schedule_patch_waves reads
+# them so run_patch installs those KBs from the cache instead of downloading inside the window.
+# Outlives the 5-minute status rows, and stays out of the PATCH# stream.
+import logging
+from datetime import datetime, timedelta
+from autopatch_common import aws
+
+logger = logging.getLogger()
+
+STAGED_SK = "STAGED"
+# Windows Update keeps downloaded content for days; staging is usually done the day before
+STAGE_TTL_DAYS = 7
+
+def stage_key(instance_id):
+    return {"PK": f"STAGE#{instance_id}", "SK": STAGED_SK}
+
+class StagingStore:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.table = aws.table(table_name)
+
+    def mark_staged(self, instance_id, kbs):
+        now = datetime.utcnow()
+        ttl = int((now + timedelta(days=STAGE_TTL_DAYS)).timestamp())
+        self.table.update_item(
+            Key=stage_key(instance_id),
+            UpdateExpression="SET #ttl = :ttl, StagedAt = :now ADD KBs :kbs",
+            ExpressionAttributeNames={"#ttl": "TTL"},
+            ExpressionAttributeValues={":ttl": ttl, ":now": now.isoformat(), ":kbs": {str(kb).replace("KB", "") for kb in kbs}}
+        )
+
+    def get_staged(self, instance_ids):
+        # {instance_id: [staged KB numbers]} for the servers with anything staged
+        now = int(datetime.utcnow().timestamp())
+        staged = {}
+        for item in aws.batch_get(self.table_name, [stage_key(x) for x in instance_ids]):
+            if int(item.get("TTL", 0)) > now:
+                staged[item["PK"].replace("STAGE#", "", 1)] = sorted(item.get("KBs", []))
+        return staged
@@ -0,0 +1,71 @@
+# KB supersedence graph from the vpbank-cve-data rows (kbArticle + MSRC supercedence field).
+# get_target_instances_and_kbs builds it per OS; poll_get_KB_command_result uses the result to
+# drop KBs that a newer KB offered to (or installed on) the same server already replaces.
+import re
+
+SUPERSEDED_STATUS = "Superseded"
+
+def normalize_kb(kb):
+    return str(kb).strip().upper().replace("KB", "")
+
+def parse_supersedence(value):
+    # MSRC gives "5034127", "KB5034127" or several numbers separated by ; or ,
+    if isinstance(value, (list, set, tuple)):
+        value = ",".join(str(v) for v in value)
+    return re.findall(r"\d{6,8}", str(value or ""))
+
+class SupersedenceIndex:
+    def __init__(self, rows):
+        # newer KB -> KBs it directly replaces
+        self.replaces = {}
+        for row in rows:
+            kb = normalize_kb(row.get("kbArticle", ""))
+            if not kb:
+                continue
+            for old_kb in parse_supersedence(row.get("supercedence")):
+                if old_kb != kb:
+                    self.replaces.setdefault(kb, set()).add(old_kb)
+        self._closure = {}
+
+    def replaced_by(self, kb):
+        # Every KB reachable through supersedence chains (cumulative updates replace the whole chain)
+        kb = normalize_kb(kb)
+        if kb in self._closure:
+            return self._closure[kb]
+        seen = set()
+        stack = list(self.replaces.get(kb, ()))
+        while stack:
+            old_kb = stack.pop()
+            if old_kb in seen or old_kb == kb:
+                continue
+            seen.add(old_kb)
+            stack.extend(self.replaces.get(old_kb, ()))
+        self._closure[kb] = seen
+        return seen
+
+    def superseded_by(self, kbs):
+        # {old KB: [newer KBs in the same list]} restricted to the list, for the Step Functions payload
+        kbs = [normalize_kb(kb) for kb in kbs]
+        listed = set(kbs)
+        result = {}
+        for kb in kbs:
+            for old_kb in self.replaced_by(kb) & listed:
+                if kb in self.replaced_by(old_kb):
+                    # Cycle in the source data: neither replaces the other
+                    continue
+                result.setdefault(old_kb, []).append(kb)
+        return {old_kb: sorted(set(newer)) for old_kb, newer in result.items()}
+
+def covering_set(available_kbs, installed_kbs, superseded_by):
+    # Minimal set to install: an available KB is skipped when a newer KB replacing it is
+    # installed already or is itself being installed. Returns (to_install, {skipped KB: newer KB}).
+    present = {normalize_kb(kb) for kb in available_kbs} | {normalize_kb(kb) for kb in installed_kbs}
+    to_install = []
+    skipped = {}
+    for kb in available_kbs:
+        newer = [n for n in superseded_by.get(normalize_kb(kb), []) if n in present]
+        if newer:
+            skipped[kb] = max(newer)
+        else:
+            to_install.append(kb)
+    return to_install, skipped
@@ -0,0 +1,13 @@
+# Timestamps passed between the state machines and the Lambdas
+from datetime import datetime, timezone
+
+def parse_time(value):
+    # ISO 8601 as Step Functions writes it ("...Z") or as isoformat() does; a naive time is UTC
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def event_now(event):
+    # "now": $$.State.EnteredTime, so waits and deadlines follow the execution clock
+    return parse_time(event.get("now")) or datetime.now(timezone.utc)
@@ -0,0 +1,455 @@
+"""Local executor for the Amazon States Language subset used in stepfunctions/.
+
+Supported: Task (Lambda ARNs and lambda:invoke.waitForTaskToken, Retry, Catch,
+TimeoutSeconds), Map (ItemsPath, ItemSelector/Parameters, MaxConcurrency[Path],
+Iterator/ItemProcessor), Choice, Wait (Seconds/SecondsPath), Pass, Succeed and Fail,
+with InputPath/Parameters/ResultSelector/ResultPath/OutputPath and the $$ context object.
+
+Nothing sleeps for real: every branch is a generator that yields what it waits for
+(virtual time, a task token, child branches) and VirtualClock runs them in time order.
+"""
+import copy
+import heapq
+import itertools
+import json
+import re
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+WAIT_FOR_TASK_TOKEN = "arn:aws:states:::lambda:invoke.waitForTaskToken"
+
+class StatesError(Exception):
+    def __init__(self, error, cause=""):
+        super().__init__(f"{error}: {cause}" if cause else error)
+        self.error = error
+        self.cause = cause
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+        # Wall-clock time at virtual 0, for $$.Execution.StartTime and $$.State.EnteredTime
+        self.epoch = datetime.utcnow()
+        self.queue = []
+        self.sequence = itertools.count()
+
+    def call_at(self, when, callback):
+        heapq.heappush(self.queue, (max(when, self.now), next(self.sequence), callback))
+
+    def call_later(self, delay, callback):
+        self.call_at(self.now + delay, callback)
+
+    def timestamp(self, when):
+        return (self.epoch + timedelta(seconds=when)).isoformat(timespec="milliseconds") + "Z"
+
+    def run(self):
+        while self.queue:
+            self.now, _, callback = heapq.heappop(self.queue)
+            callback()
+
+# --- Branches and what they can wait for ----------------------------------
+
+class Branch:
+    """One generator-driven thread of execution (the execution itself or a Map iteration)."""
+
+    def __init__(self, executor, generator, on_done):
+        self.executor = executor
+        self.generator = generator
+        self.on_done = on_done
+        self.cancelled = False
+
+    def start(self):
+        self.executor.clock.call_later(0, self.step)
+
+    def step(self, value=None, error=None):
+        if self.cancelled:
+            self.generator.close()
+            return
+        try:
+            command = self.generator.throw(error) if error else self.generator.send(value)
+        except StopIteration as stop:
+            self.on_done(stop.value, None)
+            return
+        except StatesError as e:
+            self.on_done(None, e)
+            return
+        command.start(self)
+
+class Sleep:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def start(self, branch):
+        branch.executor.clock.call_later(self.seconds, branch.step)
+
+class WaitForToken:
+    def __init__(self, token, timeout):
+        self.token = token
+        self.timeout = timeout
+
+    def start(self, branch):
+        executor = branch.executor
+        executor.waiting[self.token] = branch
+        if self.timeout:
+            def expire():
+                if executor.waiting.pop(self.token, None) is branch:
+                    branch.step(error=StatesError("States.Timeout", f"No callback within {self.timeout}s"))
+            executor.clock.call_later(self.timeout, expire)
+
+class Gather:
+    """Run child generators with at most `limit` in flight; resume with their results in order."""
+
+    def __init__(self, generators, limit):
+        self.generators = generators
+        self.limit = limit or len(generators)
+
+    def start(self, branch):
+        results = [None] * len(self.generators)
+        queued = list(enumerate(self.generators))
+        running = {}
+        state = {"remaining": len(queued), "failed": False}
+
+        if not queued:
+            branch.executor.clock.call_later(0, lambda: branch.step(value=[]))
+            return
+
+        def launch():
+            while queued and len(running) < self.limit:
+                index, generator = queued.pop(0)
+                child = Branch(branch.executor, generator, lambda value, error, i=index: done(i, value, error))
+                running[index] = child
+                child.start()
+
+        def done(index, value, error):
+            running.pop(index, None)
+            if state["failed"]:
+                return
+            if error:
+                # The first failed iteration fails the Map and stops the others
+                state["failed"] = True
+                for child in running.values():
+                    child.cancelled = True
+                queued.clear()
+                branch.step(error=error)
+                return
+            results[index] = value
+            state["remaining"] -= 1
+            if state["remaining"] == 0:
+                branch.step(value=results)
+            else:
+                launch()
+
+        launch()
+
+# --- JSONPath subset --------------------------------------------------------
+
+MISSING = object()
+
+def split_path(path):
+    parts = []
+    for name, index in _path_tokens(path):
+        parts.append(int(index) if index else name)
+    return parts
+
+def _path_tokens(path):
+    body = path[2:] if path.startswith("$$") else path[1:]
+    return re.findall(r"\.([^.\[]+)|\[(\d+)\]", body)
+
+def read_path(path, data, context):
+    value = context if path.startswith("$$") else data
+    for part in split_path(path):
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return MISSING
+            value = value[part]
+    return value
+
+def get_path(path, data, context):
+    value = read_path(path, data, context)
+    if value is MISSING:
+        raise StatesError("States.Runtime", f"Path {path} not found in input")
+    return value
+
+def set_path(path, data, value):
+    if path is None:
+        return data
+    if path == "$":
+        return value
+    data = copy.deepcopy(data) if isinstance(data, dict) else {}
+    target = data
+    parts = split_path(path)
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+    return data
+
+def resolve(template, data, context):
+    # Parameters / ItemSelector / ResultSelector: keys ending in .$ are paths
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                if not value.startswith("$"):
+                    raise StatesError("States.Runtime", f"Intrinsic functions are not supported: {value}")
+                resolved[key[:-2]] = get_path(value, data, context)
+            else:
+                resolved[key] = resolve(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve(value, data, context) for value in template]
+    return template
+
+# --- Choice rules -------------------------------------------------------------
+
+COMPARISONS = {
+    "StringEquals": lambda v, x: isinstance(v, str) and v == x,
+    "StringLessThan": lambda v, x: isinstance(v, str) and v < x,
+    "StringGreaterThan": lambda v, x: isinstance(v, str) and v > x,
+    "NumericEquals": lambda v, x: is_number(v) and v == x,
+    "NumericLessThan": lambda v, x: is_number(v) and v < x,
+    "NumericLessThanEquals": lambda v, x: is_number(v) and v <= x,
+    "NumericGreaterThan": lambda v, x: is_number(v) and v > x,
+    "NumericGreaterThanEquals": lambda v, x: is_number(v) and v >= x,
+    "BooleanEquals": lambda v, x: isinstance(v, bool) and v == x,
+}
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def matches(rule, data, context):
+    if "And" in rule:
+        return all(matches(r, data, context) for r in rule["And"])
+    if "Or" in rule:
+        return any(matches(r, data, context) for r in rule["Or"])
+    if "Not" in rule:
+        return not matches(rule["Not"], data, context)
+
+    value = read_path(rule["Variable"], data, context)
+    if "IsPresent" in rule:
+        return (value is not MISSING) == rule["IsPresent"]
+    if value is MISSING:
+        raise StatesError("States.Runtime", f"Choice variable {rule['Variable']} not found")
+    if "IsNull" in rule:
+        return (value is None) == rule["IsNull"]
+
+    for operator, compare in COMPARISONS.items():
+        if operator in rule:
+            return compare(value, rule[operator])
+        if operator + "Path" in rule:
+            return compare(value, get_path(rule[operator + "Path"], data, context))
+    raise StatesError("States.Runtime", f"Unsupported choice rule: {json.dumps(rule)}")
+
+def error_matches(error_equals, error):
+    return error in error_equals or ("States.ALL" in error_equals and error != "States.Runtime")
+
+# --- Executor -----------------------------------------------------------------
+
+class Executor:
+    """Runs one state machine definition against local Lambda handlers on a virtual clock.
+
+    `invoke(function_name, payload)` calls the handler and returns (result, api_calls);
+    each Lambda invocation costs `lambda_seconds` plus `api_seconds` per AWS call it made.
+    """
+
+    def __init__(self, clock, invoke, lambda_seconds=0.1, api_seconds=0.02):
+        self.clock = clock
+        self.invoke = invoke
+        self.lambda_seconds = lambda_seconds
+        self.api_seconds = api_seconds
+        self.waiting = {}
+        self.early = {}
+        self.state_seconds = defaultdict(float)
+        self.state_entries = defaultdict(int)
+        self.state_max_seconds = defaultdict(float)
+        self.invocations = defaultdict(int)
+        self.transitions = 0
+
+    def run(self, definition, execution_input):
+        outcome = {}
+
+        def done(value, error):
+            outcome.update(output=value, error=error, finished_at=self.clock.now)
+
+        name = str(uuid.uuid4())
+        context = {"Execution": {"Id": name, "Name": name, "Input": execution_input,
+                                 "StartTime": self.clock.timestamp(self.clock.now)}}
+        Branch(self, self.run_states(definition, execution_input, context, ""), done).start()
+        self.clock.run()
+
+        if "finished_at" not in outcome:
+            raise RuntimeError(f"Execution stalled waiting on {len(self.waiting)} task token(s)")
+        return outcome
+
+    def resume(self, token, output=None, error=None, cause=None):
+        if token not in self.waiting:
+            return False
+        branch = self.waiting.pop(token)
+        if branch is None:
+            self.early[token] = (json.loads(output) if output is not None else None,
+                                 StatesError(error, cause or "") if error else None)
+            return True
+        if error:
+            self.clock.call_later(0, lambda: branch.step(error=StatesError(error, cause or "")))
+        else:
+            self.clock.call_later(0, lambda: branch.step(value=json.loads(output)))
+        return True
+
+    def run_states(self, definition, data, context, scope):
+        name = definition["StartAt"]
+        states = definition["States"]
+        while True:
+            state = states[name]
+            key = f"{scope}{name}"
+            started = self.clock.now
+            self.transitions += 1
+            state_context = dict(context, State={"Name": name, "EnteredTime": self.clock.timestamp(started)})
+            try:
+                data, next_name = yield from self.run_state(state, data, state_context, key)
+            finally:
+                elapsed = self.clock.now - started
+                self.state_seconds[key] += elapsed
+                self.state_entries[key] += 1
+                self.state_max_seconds[key] = max(self.state_max_seconds[key], elapsed)
+            if next_name is None:
+                return data
+            name = next_name
+
+    def run_state(self, state, data, context, key):
+        kind = state["Type"]
+        if kind == "Choice":
+            for rule in state.get("Choices", []):
+                if matches(rule, data, context):
+                    return data, rule["Next"]
+            if "Default" not in state:
+                raise StatesError("States.NoChoiceMatched", key)
+            return data, state["Default"]
+        if kind == "Succeed":
+            return data, None
+        if kind == "Fail":
+            raise StatesError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+
+        input_path = state.get("InputPath", "$")
+        effective = get_path(input_path, data, context) if input_path else {}
+
+        if kind == "Pass":
+            if "Parameters" in state:
+                result = resolve(state["Parameters"], effective, context)
+            else:
+                result = state.get("Result", effective)
+            return self.finish(state, data, result, context)
+
+        if kind == "Wait":
+            if "SecondsPath" in state:
+                seconds = get_path(state["SecondsPath"], effective, context)
+            else:
+                seconds = state.get("Seconds", 0)
+            yield Sleep(seconds)
+            return self.finish(state, data, None, context, keep_input=True)
+
+        if kind == "Task":
+            try:
+                result = yield from self.run_task(state, effective, context)
+            except StatesError as e:
+                catcher = next((c for c in state.get("Catch", []) if error_matches(c["ErrorEquals"], e.error)), None)
+                if not catcher:
+                    raise
+                output = set_path(catcher.get("ResultPath", "$"), data, {"Error": e.error, "Cause": e.cause})
+                return output, catcher["Next"]
+            return self.finish(state, data, result, context)
+
+        if kind == "Map":
+            result = yield from self.run_map(state, effective, context, key)
+            return self.finish(state, data, result, context)
+
+        raise StatesError("States.Runtime", f"Unsupported state type {kind} in {key}")
+
+    def finish(self, state, data, result, context, keep_input=False):
+        if keep_input:
+            output = data
+        else:
+            if "ResultSelector" in state:
+                result = resolve(state["ResultSelector"], result, context)
+            output = set_path(state.get("ResultPath", "$"), data, result)
+        if state.get("OutputPath", "$"):
+            output = get_path(state.get("OutputPath", "$"), output, context)
+        else:
+            output = {}
+        return output, (None if state.get("End") else state.get("Next"))
+
+    def run_task(self, state, effective, context):
+        retry_counts = defaultdict(int)
+        while True:
+            try:
+                result = yield from self.invoke_task(state, effective, context)
+                return result
+            except StatesError as e:
+                index, retrier = next(((i, r) for i, r in enumerate(state.get("Retry", []))
+                                       if error_matches(r["ErrorEquals"], e.error)), (None, None))
+                if retrier is None or retry_counts[index] >= retrier.get("MaxAttempts", 3):
+                    raise
+                delay = retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** retry_counts[index]
+                retry_counts[index] += 1
+                yield Sleep(delay)
+
+    def invoke_task(self, state, effective, context):
+        resource = state["Resource"]
+        if resource == WAIT_FOR_TASK_TOKEN:
+            token = str(uuid.uuid4())
+            task_context = dict(context, Task={"Token": token})
+            parameters = resolve(state.get("Parameters", {}), effective, task_context)
+            function_name = parameters["FunctionName"].rsplit(":", 1)[-1]
+            # The token is live from the start of the task: a callback that arrives while the
+            # Lambda is still running is kept until the branch parks
+            self.waiting[token] = None
+            try:
+                yield from self.invoke_lambda(function_name, parameters.get("Payload", effective))
+            except StatesError:
+                self.waiting.pop(token, None)
+                raise
+            if token in self.early:
+                output, error = self.early.pop(token)
+                if error:
+                    raise error
+                return output
+            result = yield WaitForToken(token, state.get("TimeoutSeconds"))
+            return result
+
+        if ":function:" not in resource:
+            raise StatesError("States.Runtime", f"Unsupported resource {resource}")
+        parameters = resolve(state["Parameters"], effective, context) if "Parameters" in state else effective
+        result = yield from self.invoke_lambda(resource.rsplit(":", 1)[-1], parameters)
+        return result
+
+    def invoke_lambda(self, function_name, payload):
+        self.invocations[function_name] += 1
+        try:
+            result, api_calls = self.invoke(function_name, json.loads(json.dumps(payload)))
+        except Exception as e:
+            result, api_calls, error = None, 0, e
+        else:
+            error = None
+        yield Sleep(self.lambda_seconds + api_calls * self.api_seconds)
+        if error:
+            raise StatesError(type(error).__name__, str(error))
+        return result
+
+    def run_map(self, state, effective, context, key):
+        items = get_path(state.get("ItemsPath", "$"), effective, context)
+        if "MaxConcurrencyPath" in state:
+            limit = int(get_path(state["MaxConcurrencyPath"], effective, context))
+        else:
+            limit = state.get("MaxConcurrency", 0)
+        selector = state.get("ItemSelector", state.get("Parameters"))
+        definition = state.get("ItemProcessor", state.get("Iterator"))
+
+        branches = []
+        for index, item in enumerate(items):
+            item_context = dict(context, Map={"Item": {"Index": index, "Value": item}})
+            item_input = resolve(selector, effective, item_context) if selector is not None else item
+            branches.append(self.run_states(definition, item_input, item_context, f"{key}/"))
+        results = yield Gather(branches, limit)
+        return results
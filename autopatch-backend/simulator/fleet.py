@@ -0,0 +1,286 @@
+"""Simulated Windows fleet behind the SSM and EC2 stand-ins, driven by the virtual clock.
+
+Every instance gets a profile (install time per KB, failure rate, reboot behaviour).
+Commands finish when the clock reaches their end time; until then SSM reports them
+InProgress. Outcomes are seeded per (instance, KB, attempt), so two orchestrations run
+against the same fleet see the same failures.
+"""
+import random
+import re
+import uuid
+from datetime import timedelta
+
+from standins import EC2StandIn, Fleet, SSMStandIn, StandIns, StepFunctionsStandIn
+
+PROFILES = {
+    # install_seconds: mean per KB, inventory_seconds: Get-HotFix + Get-WindowsUpdate scan,
+    # download_fraction: share of install_seconds spent downloading (saved when pre-staged)
+    "fast": {"install_seconds": 120, "failure_rate": 0.01, "reboot_rate": 0.2,
+             "reboot_seconds": 90, "inventory_seconds": 40, "download_fraction": 0.5},
+    "typical": {"install_seconds": 300, "failure_rate": 0.03, "reboot_rate": 0.4,
+                "reboot_seconds": 180, "inventory_seconds": 75, "download_fraction": 0.5},
+    "slow": {"install_seconds": 900, "failure_rate": 0.05, "reboot_rate": 0.6,
+             "reboot_seconds": 420, "inventory_seconds": 150, "download_fraction": 0.5},
+    "flaky": {"install_seconds": 300, "failure_rate": 0.3, "reboot_rate": 0.5,
+              "reboot_seconds": 300, "inventory_seconds": 90, "download_fraction": 0.5},
+}
+
+DEFAULT_MIX = {"typical": 0.7, "fast": 0.1, "slow": 0.15, "flaky": 0.05}
+
+# AWS-RunPowerShellScript default when the command sets no executionTimeout
+DEFAULT_EXECUTION_TIMEOUT = 3600
+
+# Install times vary by +/- this fraction around the profile mean
+INSTALL_JITTER = 0.3
+
+def parse_mix(text):
+    # "typical=0.7,slow=0.3" -> {"typical": 0.7, "slow": 0.3}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in PROFILES:
+            raise ValueError(f"Unknown profile {name.strip()!r}, expected one of {sorted(PROFILES)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+class SimulatedFleet(Fleet):
+    def __init__(self, size, mix=None, seed=0):
+        super().__init__(size)
+        self.seed = seed
+        mix = mix or DEFAULT_MIX
+        rng = random.Random(f"{seed}:profiles")
+        names = sorted(mix)
+        self.profile_by_instance = {
+            i: rng.choices(names, weights=[mix[n] for n in names])[0] for i in self.instance_ids
+        }
+        self.installed = {i: set(Fleet.installed_kbs(self, i)) for i in self.instance_ids}
+        self.attempts = {}
+        self.reboot_pending = set()
+        # Instance busy (installing, scanning or rebooting) until this virtual time
+        self.busy_until = {i: 0.0 for i in self.instance_ids}
+        self.rebooting_until = {}
+        self.rebooted_at = {}
+        # KBs already in each instance's Windows Update download cache
+        self.staged = {i: set() for i in self.instance_ids}
+
+    def profile(self, instance_id):
+        return PROFILES[self.profile_by_instance[instance_id]]
+
+    def installed_kbs(self, instance_id):
+        return sorted(self.installed[instance_id])
+
+    def available_kbs(self, instance_id):
+        # Windows Update stops offering a KB once a KB that supersedes it is installed
+        installed = self.installed[instance_id]
+        return [kb for kb in Fleet.available_kbs(self, instance_id)
+                if kb not in installed and not any(self.supersedes.get(new_kb) == kb for new_kb in installed)]
+
+    def roll(self, instance_id, kb, install_only=False):
+        # (seconds, succeeded, reboot_required) for the next install attempt of this KB
+        kb = str(kb).replace("KB", "")
+        attempt = self.attempts.get((instance_id, kb), 0) + 1
+        self.attempts[(instance_id, kb)] = attempt
+        rng = random.Random(f"{self.seed}:{instance_id}:{kb}:{attempt}")
+        profile = self.profile(instance_id)
+
+        if kb not in Fleet.available_kbs(self, instance_id):
+            return 5.0, False, False
+        seconds = profile["install_seconds"] * rng.uniform(1 - INSTALL_JITTER, 1 + INSTALL_JITTER)
+        if install_only and kb in self.staged[instance_id]:
+            seconds *= 1 - profile["download_fraction"]
+        succeeded = rng.random() >= profile["failure_rate"]
+        return seconds, succeeded, succeeded and rng.random() < profile["reboot_rate"]
+
+    def download(self, instance_id, kb):
+        # Seconds to download the KB into the cache, or None when Windows Update does not offer it
+        kb = str(kb).replace("KB", "")
+        if kb not in self.available_kbs(instance_id):
+            return None
+        rng = random.Random(f"{self.seed}:{instance_id}:{kb}:download")
+        profile = self.profile(instance_id)
+        self.staged[instance_id].add(kb)
+        return profile["install_seconds"] * profile["download_fraction"] * rng.uniform(1 - INSTALL_JITTER, 1 + INSTALL_JITTER)
+
+    def installed_kb(self, instance_id, kb, reboot_required):
+        self.installed[instance_id].add(str(kb).replace("KB", ""))
+        if reboot_required:
+            self.reboot_pending.add(instance_id)
+
+class Invocation:
+    def __init__(self, instance_id, ends_at, status, output, error="", code=0):
+        self.instance_id = instance_id
+        self.ends_at = ends_at
+        self.status = status
+        self.output = output
+        self.error = error
+        self.code = code
+
+class SimulatedSSM(SSMStandIn):
+    """SSM Run Command whose invocations finish on the virtual clock."""
+
+    def __init__(self, log, fleet, clock, on_complete):
+        super().__init__(log, 0, fleet)
+        self.clock = clock
+        self.on_complete = on_complete
+
+    def send_command(self, InstanceIds, Parameters, DocumentName="AWS-RunPowerShellScript", **kwargs):
+        self._call("SendCommand")
+        command_id = str(uuid.uuid4())
+        script = Parameters["commands"][0]
+        timeout = int(Parameters.get("executionTimeout", [DEFAULT_EXECUTION_TIMEOUT])[0])
+        invocations = {}
+        for instance_id in InstanceIds:
+            # Windows Update runs one job at a time, so commands queue behind each other
+            starts_at = max(self.clock.now, self.fleet.busy_until[instance_id])
+            invocation = self.execute(instance_id, script, starts_at, starts_at + timeout)
+            self.fleet.busy_until[instance_id] = invocation.ends_at
+            invocations[instance_id] = invocation
+            self.clock.call_at(invocation.ends_at, lambda i=instance_id: self.on_complete(command_id, i))
+        self.commands[command_id] = {"instance_ids": list(InstanceIds), "script": script, "document": DocumentName,
+                                     "invocations": invocations}
+        return {"Command": {"CommandId": command_id}}
+
+    def execute(self, instance_id, script, starts_at, deadline):
+        fleet = self.fleet
+        if "Get-HotFix" in script:
+            installed = ",".join(f"KB{kb}" for kb in fleet.installed_kbs(instance_id))
+            available = ",".join(f"KB{kb}" for kb in fleet.available_kbs(instance_id))
+            seconds = fleet.profile(instance_id)["inventory_seconds"]
+            return Invocation(instance_id, starts_at + seconds, "Success",
+                              f"INSTALLED_KBS={installed}\nAVAILABLE_KBS={available}\n"
+                              f"OS_BUILD={fleet.os_build(instance_id)}\n")
+
+        batch = re.search(r"\$kbs = @\((.*)\)", script)
+        if batch and "STAGE_RESULT" in script:
+            # Download only: the KBs land in the cache back to back
+            ends_at, lines = starts_at, []
+            for kb in re.findall(r"\d+", batch.group(1)):
+                seconds = fleet.download(instance_id, kb)
+                ends_at += seconds or 5.0
+                lines.append(f"STAGE_RESULT|{kb}|{'Staged' if seconds else 'Failed'}")
+            if ends_at > deadline:
+                return Invocation(instance_id, deadline, "TimedOut", "", "Execution timed out", 1)
+            return Invocation(instance_id, ends_at, "Success", "\n".join(lines) + "\n")
+
+        install_only = "CreateUpdateInstaller" in script
+        if batch:
+            # One Install-WindowsUpdate call installs the KBs back to back until executionTimeout
+            ends_at, lines = starts_at, []
+            for kb in re.findall(r"\d+", batch.group(1)):
+                seconds, succeeded, reboot = fleet.roll(instance_id, kb, install_only)
+                if ends_at + seconds > deadline:
+                    return Invocation(instance_id, deadline, "TimedOut", "\n".join(lines) + "\n",
+                                      "Execution timed out", 1)
+                ends_at += seconds
+                if succeeded:
+                    fleet.installed_kb(instance_id, kb, reboot)
+                lines.append(f"KB_RESULT|{kb}|{'Success' if succeeded else 'Failed'}|"
+                             f"{'REBOOT_REQUIRED' if reboot else 'NO_REBOOT'}")
+            return Invocation(instance_id, ends_at, "Success", "\n".join(lines) + "\n")
+
+        kb = re.search(r'\$kb = "([^"]+)"', script).group(1)
+        seconds, succeeded, reboot = fleet.roll(instance_id, kb, install_only)
+        if starts_at + seconds > deadline:
+            return Invocation(instance_id, deadline, "TimedOut", "", "Execution timed out", 1)
+        if not succeeded:
+            return Invocation(instance_id, starts_at + seconds, "Failed", "",
+                              f"PATCH_FAILED: KB{kb} could not be installed", 1)
+        fleet.installed_kb(instance_id, kb, reboot)
+        output = "PATCH_SUCCESS\n" + ("REBOOT_REQUIRED\n" if reboot else "")
+        return Invocation(instance_id, starts_at + seconds, "Success", output)
+
+    def invocation(self, command_id, instance_id):
+        command = self.commands.get(command_id)
+        if not command or instance_id not in command["invocations"]:
+            raise self.exceptions.InvocationDoesNotExist(command_id)
+        return command["invocations"][instance_id]
+
+    def status(self, invocation):
+        return invocation.status if self.clock.now >= invocation.ends_at else "InProgress"
+
+    def get_command_invocation(self, CommandId, InstanceId, **kwargs):
+        self._call("GetCommandInvocation")
+        invocation = self.invocation(CommandId, InstanceId)
+        status = self.status(invocation)
+        finished = status != "InProgress"
+        return {
+            "CommandId": CommandId,
+            "InstanceId": InstanceId,
+            "Status": status,
+            "ResponseCode": invocation.code if finished else -1,
+            "StandardOutputContent": invocation.output if finished else "",
+            "StandardErrorContent": invocation.error if finished else ""
+        }
+
+    def list_command_invocations(self, CommandId, NextToken=None, **kwargs):
+        self._call("ListCommandInvocations")
+        command = self.commands[CommandId]
+        page = command["instance_ids"][int(NextToken or 0):int(NextToken or 0) + 50]
+        invocations = []
+        for instance_id in page:
+            invocation = command["invocations"][instance_id]
+            status = self.status(invocation)
+            output = invocation.output if status != "InProgress" else ""
+            invocations.append({"CommandId": CommandId, "InstanceId": instance_id, "Status": status,
+                                "CommandPlugins": [{"Output": output}]})
+        response = {"CommandInvocations": invocations}
+        end = int(NextToken or 0) + 50
+        if end < len(command["instance_ids"]):
+            response["NextToken"] = str(end)
+        return response
+
+    def describe_instance_information(self, NextToken=None, **kwargs):
+        response = super().describe_instance_information(NextToken=NextToken, **kwargs)
+        for info in response["InstanceInformationList"]:
+            instance_id = info["InstanceId"]
+            rebooting = self.clock.now < self.fleet.rebooting_until.get(instance_id, 0)
+            info["PingStatus"] = "ConnectionLost" if rebooting else "Online"
+            # The agent pings as soon as it is back; while down, the last ping is from before the reboot
+            last_ping = self.fleet.rebooted_at.get(instance_id, 0) if rebooting else self.clock.now
+            info["LastPingDateTime"] = self.clock.epoch + timedelta(seconds=last_ping)
+        return response
+
+class SimulatedEC2(EC2StandIn):
+    def __init__(self, log, fleet, clock):
+        super().__init__(log, 0, fleet)
+        self.clock = clock
+
+    def reboot_instances(self, InstanceIds, **kwargs):
+        self._call("RebootInstances")
+        for instance_id in InstanceIds:
+            starts_at = max(self.clock.now, self.fleet.busy_until[instance_id])
+            ends_at = starts_at + self.fleet.profile(instance_id)["reboot_seconds"]
+            self.fleet.busy_until[instance_id] = ends_at
+            self.fleet.rebooting_until[instance_id] = ends_at
+            self.fleet.rebooted_at[instance_id] = starts_at
+            self.fleet.reboot_pending.discard(instance_id)
+        return {}
+
+class SimulatedStepFunctions(StepFunctionsStandIn):
+    """Task-token callbacks go straight to the local executor."""
+
+    def __init__(self, log, executor):
+        super().__init__(log, 0)
+        self.executor = executor
+
+    def send_task_success(self, taskToken, output, **kwargs):
+        self._call("SendTaskSuccess")
+        if not self.executor.resume(taskToken, output=output):
+            raise self.exceptions.TaskTimedOut(taskToken)
+        return {}
+
+    def send_task_failure(self, taskToken, error=None, cause=None, **kwargs):
+        self._call("SendTaskFailure")
+        if not self.executor.resume(taskToken, error=error or "States.TaskFailed", cause=cause):
+            raise self.exceptions.TaskTimedOut(taskToken)
+        return {}
+
+class SimulatedStandIns(StandIns):
+    def __init__(self, fleet, clock, executor, on_complete):
+        super().__init__(0, 0, 0, watchers=0)
+        self.fleet = fleet
+        self.clients.update({
+            "ssm": SimulatedSSM(self.log, fleet, clock, on_complete),
+            "ec2": SimulatedEC2(self.log, fleet, clock),
+            "stepfunctions": SimulatedStepFunctions(self.log, executor),
+        })
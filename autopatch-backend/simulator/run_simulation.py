@@ -0,0 +1,242 @@
+"""Run a patch workflow end to end against a simulated fleet on a virtual clock.
+
+    python simulator/run_simulation.py                                   # full patch flow, 50 instances
+    python simulator/run_simulation.py --fleet-size 200 --input '{"installMode": "batch", "maxConcurrency": 25}'
+    python simulator/run_simulation.py --definition stepfunctions/RetrySingleKBPatch.json
+    python simulator/run_simulation.py --mix typical=0.5,flaky=0.5 --no-eventbridge --output run.json
+    python simulator/run_simulation.py --runs 2 --input '{"maxFailureRate": 0.05}'   # repeat run in one window
+    python simulator/run_simulation.py --prestage                        # download ahead, then patch
+
+The real Lambda handlers run in-process against the benchmark stand-ins; SSM commands take
+the time given by each instance's profile, and the SSM status-change rule delivers
+EventBridge events to ssm_command_callback unless --no-eventbridge is set. Reports the flow's
+result (done/halted, servers patched, failed and halted, KBs deferred), the patch-window
+duration, time per state, Lambda invocations, state transitions and AWS calls.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+from collections import Counter
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SIM_DIR)
+LAMBDA_DIR = os.path.join(BACKEND_DIR, "lambda")
+LAYER_DIR = os.path.join(BACKEND_DIR, "layers", "autopatch_common", "python")
+BENCH_DIR = os.path.join(BACKEND_DIR, "benchmarks")
+DEFAULT_DEFINITION = os.path.join(BACKEND_DIR, "stepfunctions", "Runpatch-Sequential-KB-install-per-server.json")
+PRESTAGE_DEFINITION = os.path.join(BACKEND_DIR, "stepfunctions", "PrestageUpdates.json")
+EVENT_RULE = os.path.join(BACKEND_DIR, "eventbridge", "ssm_command_status_rule.json")
+
+sys.path.insert(0, LAYER_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SIM_DIR)
+
+from asl import Executor, VirtualClock
+from fleet import SimulatedFleet, SimulatedStandIns, parse_mix
+from scenarios import ENVIRONMENT, seed_cve_table
+
+# Function names in the state machine ARNs -> lambda/ directories
+FUNCTIONS = {
+    "getTargetInstancesAndKBsLambda_1": "get_target_instances_and_kbs",
+    "pollGetKBCommandResult": "poll_get_KB_command_result",
+    "schedulePatchWavesLambda": "schedule_patch_waves",
+    "updatePatchStatusLambda": "update_patch_status",
+    "runPatchLambda": "run_patch",
+    "ssmCommandCallbackLambda": "ssm_command_callback",
+    "pollCommandStatusLambda": "poll_command_status",
+    "rebootOrchestratorLambda": "reboot_orchestrator",
+    "prestageUpdatesLambda": "prestage_updates",
+    "summarizeLambda": "summarize_SNS",
+}
+
+# SSM status change -> EventBridge -> Lambda usually lands within a few seconds
+EVENTBRIDGE_DELAY_SECONDS = 2.0
+
+# The patch flow's own result is what it hands to the summary step; its execution output is the email's
+SUMMARY_FUNCTION = "summarizeLambda"
+
+def rule_documents():
+    # document-name values the SSM status-change rule matches (Refs resolved to their defaults)
+    with open(EVENT_RULE) as f:
+        template = json.load(f)
+    pattern = template["Resources"]["CommandStatusChangeRule"]["Properties"]["EventPattern"]
+    return {template["Parameters"][name["Ref"]]["Default"] if isinstance(name, dict) else name
+            for name in pattern["detail"]["document-name"]}
+
+def load_handler(directory):
+    spec = importlib.util.spec_from_file_location(f"sim_{directory}", os.path.join(LAMBDA_DIR, directory, "lambda_function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Simulation:
+    def __init__(self, args):
+        from autopatch_common import aws
+
+        self.args = args
+        self.clock = VirtualClock()
+        self.fleet = SimulatedFleet(args.fleet_size, parse_mix(args.mix) if args.mix else None, args.seed)
+        self.executor = Executor(self.clock, self.invoke, args.lambda_seconds, args.api_seconds)
+        self.standins = SimulatedStandIns(self.fleet, self.clock, self.executor, self.command_finished)
+        self.standins.install(aws)
+        seed_cve_table(self.standins)
+        self.handlers = {}
+        self.events_delivered = 0
+        self.event_documents = rule_documents()
+        self.flow_result = None
+
+    def handler(self, function_name):
+        directory = FUNCTIONS.get(function_name, function_name)
+        if directory not in self.handlers:
+            self.handlers[directory] = load_handler(directory).lambda_handler
+        return self.handlers[directory]
+
+    def invoke(self, function_name, payload):
+        if function_name == SUMMARY_FUNCTION:
+            self.flow_result = payload.get("summary", payload)
+        before = sum(self.standins.log.counts.values())
+        result = self.handler(function_name)(payload, None)
+        return result, sum(self.standins.log.counts.values()) - before
+
+    def command_finished(self, command_id, instance_id):
+        ssm = self.standins.clients["ssm"]
+        if self.args.no_eventbridge or ssm.commands[command_id]["document"] not in self.event_documents:
+            return
+        invocation = ssm.invocation(command_id, instance_id)
+        event = {
+            "source": "aws.ssm",
+            "detail-type": "EC2 Command Invocation Status-change Notification",
+            "detail": {"command-id": command_id, "document-name": ssm.commands[command_id]["document"],
+                       "instance-id": instance_id, "status": invocation.status}
+        }
+
+        def deliver():
+            self.events_delivered += 1
+            self.executor.invocations["ssmCommandCallbackLambda (EventBridge)"] += 1
+            self.handler("ssmCommandCallbackLambda")(event, None)
+
+        self.clock.call_later(EVENTBRIDGE_DELAY_SECONDS, deliver)
+
+    def default_input(self, definition_path):
+        if os.path.basename(definition_path) == "RetrySingleKBPatch.json":
+            instance_id = self.fleet.instance_ids[0]
+            return {"InstanceId": instance_id, "KB": self.fleet.available_kbs(instance_id)[0]}
+        return {"instance_ids": self.fleet.instance_ids}
+
+    def run(self, definition_path, extra_input, runs=1, prestage=False):
+        # Back-to-back executions share the fleet and the tables, like repeat runs in one window
+        reports = []
+        if prestage:
+            # Download run ahead of the window; its report comes first
+            reports.append(self.execute(PRESTAGE_DEFINITION, extra_input))
+        for _ in range(runs):
+            reports.append(self.execute(definition_path, extra_input))
+        return reports
+
+    def execute(self, definition_path, extra_input):
+        with open(definition_path) as f:
+            definition = json.load(f)
+        execution_input = dict(self.default_input(definition_path), **extra_input)
+
+        self.executor = Executor(self.clock, self.invoke, self.args.lambda_seconds, self.args.api_seconds)
+        self.standins.clients["stepfunctions"].executor = self.executor
+        self.standins.log.reset()
+        self.fleet.attempts.clear()
+        self.flow_result = None
+        started_at = self.clock.now
+        outcome = self.executor.run(definition, execution_input)
+        return self.report(definition_path, outcome, started_at)
+
+    def report(self, definition_path, outcome, started_at):
+        executor = self.executor
+        states = sorted(executor.state_seconds, key=lambda k: -executor.state_seconds[k])
+        kb_attempts = Counter(self.fleet.attempts.values())
+        error = outcome["error"]
+        return {
+            "definition": os.path.relpath(definition_path, BACKEND_DIR),
+            "settings": {key: getattr(self.args, key) for key in
+                         ("fleet_size", "mix", "seed", "lambda_seconds", "api_seconds", "no_eventbridge", "runs", "prestage")},
+            "status": "FAILED" if error else "SUCCEEDED",
+            "error": f"{error.error}: {error.cause}" if error else None,
+            "result": self.flow_result if self.flow_result is not None else outcome["output"],
+            "window_seconds": round(outcome["finished_at"] - started_at, 1),
+            "states": {key: {
+                "entries": executor.state_entries[key],
+                "total_seconds": round(executor.state_seconds[key], 1),
+                "max_seconds": round(executor.state_max_seconds[key], 1)
+            } for key in states},
+            "state_transitions": executor.transitions,
+            "lambda_invocations": dict(sorted(executor.invocations.items())),
+            "api_calls": self.standins.log.snapshot(),
+            "fleet": {
+                "profiles": dict(Counter(self.fleet.profile_by_instance.values())),
+                "kb_install_attempts": sum(n * count for n, count in kb_attempts.items()),
+                "kbs_still_available": sum(len(self.fleet.available_kbs(i)) for i in self.fleet.instance_ids),
+                "instances_pending_reboot": len(self.fleet.reboot_pending),
+                "kbs_staged": sum(len(self.fleet.staged[i] - self.fleet.installed[i]) for i in self.fleet.instance_ids)
+            }
+        }
+
+def format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m{rest % 60:02d}s"
+
+def format_result(result):
+    # The wave summary when the flow produced one, else the raw execution output
+    if not isinstance(result, dict) or "waves" not in result:
+        return json.dumps(result, default=str)[:300]
+    waves = result["waves"]
+    return (f"{result.get('status')}, {waves.get('patchedServers', 0)} server(s) patched "
+            f"({waves.get('failedServers', 0)} failed) in {waves.get('completed', 0)} wave(s), "
+            f"{waves.get('haltedServers', 0)} halted, {waves.get('deferredKBs', 0)} KB(s) deferred")
+
+def print_report(report, top):
+    print(f"{report['definition']}: {report['status']}" + (f" ({report['error']})" if report["error"] else ""))
+    print(f"Result: {format_result(report['result'])}")
+    print(f"Patch window: {format_duration(report['window_seconds'])} ({report['window_seconds']} s virtual)")
+    print(f"Fleet: {report['fleet']}")
+    print()
+    print(f"{'state':64} {'entries':>8} {'total s':>11} {'max s':>9}")
+    for name, s in list(report["states"].items())[:top]:
+        print(f"{name:64} {s['entries']:>8} {s['total_seconds']:>11.1f} {s['max_seconds']:>9.1f}")
+    print()
+    print(f"State transitions: {report['state_transitions']}")
+    print("Lambda invocations: " + ", ".join(f"{k}={v}" for k, v in report["lambda_invocations"].items()))
+    print(f"AWS calls ({sum(report['api_calls'].values())}): " + ", ".join(f"{k}={v}" for k, v in report["api_calls"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--definition", default=DEFAULT_DEFINITION)
+    parser.add_argument("--input", default="{}", help="JSON merged over the default execution input")
+    parser.add_argument("--fleet-size", type=int, default=50)
+    parser.add_argument("--mix", help="instance profile weights, e.g. typical=0.7,slow=0.2,flaky=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lambda-seconds", type=float, default=0.1, help="virtual cost of one Lambda invocation")
+    parser.add_argument("--api-seconds", type=float, default=0.02, help="virtual cost of one AWS call inside a Lambda")
+    parser.add_argument("--runs", type=int, default=1, help="back-to-back executions against the same fleet")
+    parser.add_argument("--prestage", action="store_true", help="run PrestageUpdates.json first, against the same fleet")
+    parser.add_argument("--no-eventbridge", action="store_true", help="no SSM status events, only the polling fallback")
+    parser.add_argument("--top", type=int, default=25, help="states shown in the report")
+    parser.add_argument("--output", help="also write the report JSON here")
+    parser.add_argument("--verbose", action="store_true", help="show Lambda logs")
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    logging.disable(logging.NOTSET if args.verbose else logging.WARNING)
+
+    reports = Simulation(args).run(os.path.abspath(args.definition), json.loads(args.input), args.runs, args.prestage)
+    for n, report in enumerate(reports, 1):
+        if len(reports) > 1:
+            print(f"=== Run {n}/{len(reports)} ===")
+        print_report(report, args.top)
+        print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports if len(reports) > 1 else reports[0], f, indent=2)
+    return 0 if all(r["status"] == "SUCCEEDED" for r in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Local stand-in for the patch progress WebSocket API.
+
+Plays the part of API Gateway for patch_progress_socket and publish_patch_progress:
+
+- ws://localhost:8765           WebSocket endpoint for the frontend (VITE_PROGRESS_WS_URL)
+- http://localhost:8766         @connections management API (WEBSOCKET_ENDPOINT of the publisher)
+- POST http://localhost:8766/stream   feed a DynamoDB stream event (e.g. sample_stream_event.json)
+
+Both Lambdas still need CONNECTIONS_TABLE; point boto3 at DynamoDB Local with
+AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000. Standard library only.
+"""
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import socketserver
+import struct
+import sys
+import threading
+import uuid
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_PORT = int(os.environ.get("WS_PORT", "8765"))
+API_PORT = int(os.environ.get("API_PORT", "8766"))
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+# The Lambdas import autopatch_common from their layer
+sys.path.insert(0, os.path.join(LAMBDA_DIR, "..", "layers", "autopatch_common", "python"))
+
+connections = {}
+connections_lock = threading.Lock()
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDA_DIR, name, "lambda_function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def send_frame(sock, payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    sock.sendall(header + payload)
+
+def read_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise ConnectionError("Connection closed")
+    return data
+
+def read_frame(rfile):
+    first, second = read_exact(rfile, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", read_exact(rfile, 8))[0]
+    mask = read_exact(rfile, 4) if second & 0x80 else None
+    payload = read_exact(rfile, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+class WebSocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        headers = {}
+        self.rfile.readline()
+        for line in iter(self.rfile.readline, b"\r\n"):
+            if not line:
+                return
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+        connection_id = base64.urlsafe_b64encode(uuid.uuid4().bytes[:9]).decode()
+        with connections_lock:
+            connections[connection_id] = self.connection
+        invoke_route("$connect", connection_id)
+
+        try:
+            while True:
+                opcode, payload = read_frame(self.rfile)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with connections_lock:
+                        send_frame(self.connection, payload, opcode=0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                # Same route selection as the API: $request.body.action
+                action = json.loads(payload.decode("utf-8")).get("action", "$default")
+                invoke_route(action, connection_id, payload.decode("utf-8"))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with connections_lock:
+                connections.pop(connection_id, None)
+            invoke_route("$disconnect", connection_id)
+
+def invoke_route(route, connection_id, body=None):
+    event = {"requestContext": {"routeKey": route, "connectionId": connection_id}, "body": body}
+    response = socket_lambda.lambda_handler(event, None)
+    print(f"[ws] {route} {connection_id} -> {response.get('statusCode')}")
+
+class ManagementApiHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        path = unquote(self.path)
+        if path == "/stream":
+            result = publish_lambda.lambda_handler(json.loads(body), None)
+            return self.reply(200, json.dumps(result).encode())
+
+        if not path.startswith("/@connections/"):
+            return self.reply(404)
+        connection_id = path.rsplit("/", 1)[-1]
+        with connections_lock:
+            sock = connections.get(connection_id)
+            if sock is None:
+                return self.reply(410)
+            send_frame(sock, body)
+        self.reply(200)
+
+    def reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == "__main__":
+    os.environ.setdefault("WEBSOCKET_ENDPOINT", f"http://localhost:{API_PORT}")
+    socket_lambda = load_lambda("patch_progress_socket")
+    publish_lambda = load_lambda("publish_patch_progress")
+
+    ws_server = socketserver.ThreadingTCPServer(("", WS_PORT), WebSocketHandler)
+    ws_server.daemon_threads = True
+    threading.Thread(target=ws_server.serve_forever, daemon=True).start()
+    print(f"WebSocket on ws://localhost:{WS_PORT}, management API on http://localhost:{API_PORT}")
+    ThreadingHTTPServer(("", API_PORT), ManagementApiHandler).serve_forever()
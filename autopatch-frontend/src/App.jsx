@@ -2,6 +2,21 @@ import { useState, useEffect } from 'react';
 import { getApiUrl, API_CONFIG } from './config/api';
 import './App.css';
 
+const STATUS_POLL_INTERVAL_MS = 5000;
+const COMPLETED_STATUSES = ['Success', 'Already Installed', 'Failed', 'Not Available', 'Superseded', 'Deferred'];
+
+const summarizeStatus = (instanceId, details) => {
+  const sorted = [...details].sort((a, b) => (a.LastUpdated || '').localeCompare(b.LastUpdated || ''));
+  const completed = sorted.filter(kb => COMPLETED_STATUSES.includes(kb.Status)).length;
+  return {
+    instance_id: instanceId,
+    total: sorted.length,
+    completed,
+    percentage: sorted.length ? Math.round((completed / sorted.length) * 100) : 0,
+    details: sorted,
+  };
+};
+
 export default function App() {
   const [servers, setServers] = useState([]);
   const [loading, setLoading] = useState(false);
@@ -113,43 +128,103 @@ export default function App() {
   useEffect(() => {
     if (!isPatching) return;
 
-    const interval = setInterval(async () => {
-      let allCompleted = true;
-
-      for (const instanceId of selected) {
-        try {
-          const res = await fetch(getApiUrl(API_CONFIG.ENDPOINTS.GET_STATUS), {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ instance_id: instanceId })
-          });
-
-          const data = await res.json();
-          if (data.statusCode === 200) {
-            const body = JSON.parse(data.body);
-            setPatchingStatus(prev => ({
-              ...prev,
-              [instanceId]: body
-            }));
-
-            // Nếu vẫn còn chưa hoàn tất → tiếp tục polling
-            if (body.percentage < 100) {
-              allCompleted = false;
-            }
-          }
-        } catch (err) {
-          console.error('Lỗi polling status:', err);
-        }
+    // Cursor/ETag của lần poll trước: server chỉ trả về các KB thay đổi sau cursor
+    let cursor = null;
+    let etag = null;
+    let details = {};
+    let progress = {};
+    let interval = null;
+    let socket = null;
+    let stopped = false;
+
+    const stop = () => {
+      stopped = true;
+      clearInterval(interval);
+      if (socket) socket.close();
+    };
+
+    // Giữ dòng mới nhất theo KB (snapshot và push có thể về lệch thứ tự)
+    const mergeRow = (instanceId, row) => {
+      const byKb = details[instanceId] || {};
+      const current = byKb[row.KB];
+      if (!current || (row.LastUpdated || '') >= (current.LastUpdated || '')) {
+        details[instanceId] = { ...byKb, [row.KB]: row };
       }
+    };
+
+    const publish = () => {
+      const nextStatus = {};
+      Object.entries(details).forEach(([instanceId, byKb]) => {
+        nextStatus[instanceId] = summarizeStatus(instanceId, Object.values(byKb));
+      });
+      Object.entries(progress).forEach(([instanceId, summary]) => {
+        if (!nextStatus[instanceId]) nextStatus[instanceId] = { ...summary, details: [] };
+      });
+      setPatchingStatus(prev => ({ ...prev, ...nextStatus }));
 
-      // Dừng polling nếu tất cả đều xong
+      // Dừng khi tất cả đều xong
+      const allCompleted = selected.every(id => nextStatus[id] && nextStatus[id].percentage >= 100);
       if (allCompleted) {
-        clearInterval(interval);
+        stop();
         setIsPatching(false);
       }
-    }, 20000); // mỗi 20s
+    };
+
+    const pollStatus = async () => {
+      try {
+        const res = await fetch(getApiUrl(API_CONFIG.ENDPOINTS.GET_STATUS), {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ instance_ids: selected, since: cursor, etag })
+        });
+
+        const data = await res.json();
+        if (data.statusCode !== 200 || stopped) return;
+
+        const body = JSON.parse(data.body);
+        cursor = body.cursor;
+        etag = body.etag;
+        if (body.notModified) return;
+
+        Object.entries(body.instances).forEach(([instanceId, status]) => {
+          status.details.forEach(row => mergeRow(instanceId, row));
+        });
+        publish();
+      } catch (err) {
+        console.error('Lỗi polling status:', err);
+      }
+    };
+
+    const startPolling = () => {
+      if (stopped || interval) return;
+      interval = setInterval(pollStatus, STATUS_POLL_INTERVAL_MS);
+    };
+
+    if (API_CONFIG.PROGRESS_WS_URL) {
+      // Server push: chỉ nhận thay đổi trạng thái của các server đang theo dõi
+      socket = new WebSocket(API_CONFIG.PROGRESS_WS_URL);
+      socket.onopen = () => {
+        socket.send(JSON.stringify({ action: 'subscribe', instance_ids: selected }));
+        pollStatus(); // snapshot ban đầu
+      };
+      socket.onmessage = (event) => {
+        const { changes = [] } = JSON.parse(event.data);
+        changes.forEach(change => {
+          if (change.type === 'status') {
+            mergeRow(change.instance_id, change);
+          } else if (change.type === 'progress') {
+            progress[change.instance_id] = change;
+          }
+        });
+        publish();
+      };
+      // Mất kết nối → quay lại polling
+      socket.onclose = () => startPolling();
+    } else {
+      startPolling();
+    }
 
-    return () => clearInterval(interval);
+    return stop;
   }, [isPatching]);
 
   // Handler for updating CVE
@@ -226,7 +301,7 @@ export default function App() {
       const statusRes = await fetch(getApiUrl(API_CONFIG.ENDPOINTS.GET_STATUS), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ instance_id: instanceId }),
+        body: JSON.stringify({ instance_id: instanceId, include_details: true }),
       });
 
       const statusData = await statusRes.json();
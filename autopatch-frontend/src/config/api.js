@@ -8,7 +8,9 @@ export const API_CONFIG = {
     UPDATE_CVE: '/update-cve',
     REBOOT_SERVER: '/reboot-server',
     START_PATCH_SINGLE_KB: '/start-patch-single-kb',
-  }
+  },
+  // WebSocket API for realtime patch progress; empty → dashboard falls back to polling
+  PROGRESS_WS_URL: import.meta.env.VITE_PROGRESS_WS_URL || '',
 };
 
 export const getApiUrl = (endpoint) => {